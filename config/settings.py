@@ -102,6 +102,12 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": DB_DIR / "db.sqlite3",
+        "OPTIONS": {
+            # ждём освободившуюся блокировку, а не падаем с "database is locked"
+            "timeout": 20,
+            # блокировку записи берём сразу в BEGIN, без апгрейда посреди транзакции
+            "transaction_mode": "IMMEDIATE",
+        },
     }
 }
 
@@ -163,4 +169,86 @@ SUPERUSER_EMAIL = os.getenv('SUPERUSER_EMAIL', default='admin123@example.com')
 SUPERUSER_NAME = os.getenv('SUPERUSER_NAME', default='admin123')
 SUPERUSER_PASSWORD = os.getenv('SUPERUSER_PASSWORD', default='super-secret')
 MEDIA_ROOT= os.path.join(BASE_DIR, 'photos')
-MEDIA_URL = 'photos/'
\ No newline at end of file
+MEDIA_URL = 'photos/'
+
+# Загрузки всегда идут потоком во временный файл (а не в память)
+# на том же томе, что и MEDIA_ROOT, – см. photostudio/uploadhandlers.py
+FILE_UPLOAD_HANDLERS = [
+    'photostudio.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+# каталог создаёт сам обработчик загрузки при первом файле
+FILE_UPLOAD_TEMP_DIR = os.path.join(MEDIA_ROOT, 'tmp')
+
+# Сколько процессов параллельно обрабатывают фото в воркере process_photos
+# (поиск лица, encoding, водяной знак). 0 – по числу ядер.
+# Каждый процесс на 24 Мп фото держит ~200 МБ (см. utils.process_photo_file),
+# при mem_limit 1g больше 2–3 процессов не ставить.
+PHOTO_INGEST_WORKERS = int(os.getenv('PHOTO_INGEST_WORKERS', default=1))
+
+# После стольких попыток (воркер падал на фото) задача помечается FAILED,
+# а не возвращается в очередь снова.
+PHOTO_JOB_MAX_ATTEMPTS = int(os.getenv('PHOTO_JOB_MAX_ATTEMPTS', default=3))
+
+# Лица ищутся на копии фото, уменьшенной до этой длинной стороны (px),
+# рамки переводятся обратно в полное разрешение. 0 – искать на полном кадре.
+FACE_DETECTION_MAX_SIDE = int(os.getenv('FACE_DETECTION_MAX_SIDE', default=1600))
+FACE_DETECTION_UPSAMPLE = int(os.getenv('FACE_DETECTION_UPSAMPLE', default=1))
+
+# Кэш готовых слоёв водяного знака: сколько держать в памяти процесса
+# и куда складывать на диск (пусто – только память).
+WATERMARK_OVERLAY_CACHE_SIZE = int(os.getenv('WATERMARK_OVERLAY_CACHE_SIZE', default=8))
+WATERMARK_CACHE_DIR = os.getenv('WATERMARK_CACHE_DIR', default=os.path.join(BASE_DIR, 'cache', 'watermarks'))
+
+# Дополнительные варианты фото с водяным знаком (основное превью 1000 px
+# – SessionPhoto.watermarked_image – строится всегда).
+PHOTO_RENDITIONS = [
+    {'name': 'thumb', 'max_width': 320, 'format': 'JPEG', 'quality': 80},
+    {'name': 'thumb_webp', 'max_width': 320, 'format': 'WEBP', 'quality': 75},
+    {'name': 'preview_webp', 'max_width': 1000, 'format': 'WEBP', 'quality': 80},
+]
+
+# Варианты фото по запросу (/api/photos/<id>/render/): допустимые размеры
+# и дисковый LRU-кэш готовых картинок.
+RENDITION_SIZES = [160, 320, 640, 1000, 1600]
+# вырез лица (variant=face) – с водяным знаком и не крупнее этого,
+# иначе это бесплатный портрет
+FACE_RENDER_MAX_SIZE = int(os.getenv('FACE_RENDER_MAX_SIZE', default=320))
+RENDITION_CACHE_DIR = os.getenv('RENDITION_CACHE_DIR', default=os.path.join(BASE_DIR, 'cache', 'renditions'))
+RENDITION_CACHE_MAX_BYTES = int(os.getenv('RENDITION_CACHE_MAX_BYTES', default=512 * 1024 * 1024))
+
+# ZIP с оригиналами (/api/download/): файлы читаются и отдаются такими
+# кусками, в памяти на одно скачивание – один кусок.
+ZIP_CHUNK_SIZE = int(os.getenv('ZIP_CHUNK_SIZE', default=1024 * 1024))
+
+# Индексы лиц поиска по селфи (сессия / альбом / фотограф): файлы
+# в FACE_INDEX_DIR, открываются через numpy.memmap и общие для всех
+# процессов gunicorn. До FACE_ANN_MIN_FACES лиц – точный перебор,
+# дальше ~sqrt(N) списков, из которых запрос смотрит FACE_ANN_NPROBE.
+FACE_INDEX_DIR = os.getenv('FACE_INDEX_DIR', default=os.path.join(BASE_DIR, 'cache', 'faces'))
+FACE_ANN_MIN_FACES = int(os.getenv('FACE_ANN_MIN_FACES', default=20000))
+FACE_ANN_NPROBE = int(os.getenv('FACE_ANN_NPROBE', default=8))
+# сколько открытых индексов держать в процессе (данные – в page cache)
+FACE_INDEX_CACHE_SIZE = int(os.getenv('FACE_INDEX_CACHE_SIZE', default=32))
+
+# Порог расстояния для поиска по селфи (клиент может передать свой ?threshold=)
+FACE_MATCH_THRESHOLD = float(os.getenv('FACE_MATCH_THRESHOLD', default=0.45))
+
+# Селфи для поиска: лимиты загрузки (проверяются до декодирования)
+# и длинная сторона, до которой селфи уменьшается перед поиском лица.
+SELFIE_MAX_UPLOAD_BYTES = int(os.getenv('SELFIE_MAX_UPLOAD_BYTES', default=15 * 1024 * 1024))
+SELFIE_MAX_PIXELS = int(os.getenv('SELFIE_MAX_PIXELS', default=50_000_000))
+SELFIE_MAX_SIDE = int(os.getenv('SELFIE_MAX_SIDE', default=800))
+
+# "faces" – кэш поиска по селфи: sha256 селфи -> encoding и готовые
+# результаты поиска (LRU в памяти процесса, с TTL).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'faces': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'faces',
+        'TIMEOUT': int(os.getenv('FACE_SEARCH_CACHE_TTL', default=600)),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('FACE_SEARCH_CACHE_SIZE', default=2000))},
+    },
+}
@@ -1,5 +1,12 @@
 #!/bin/sh
 
+# воркер обработки фото – отдельный сервис compose (command: worker),
+# миграции и статику делает backend
+if [ "$1" = "worker" ]; then
+    echo "📸 Запускаем воркер обработки фото..."
+    exec python manage.py process_photos
+fi
+
 echo "🔄 Применяем миграции..."
 python manage.py makemigrations --noinput
 python manage.py migrate --noinput
@@ -23,4 +30,6 @@ if not User.objects.filter(username=settings.SUPERUSER_NAME).exists() or not Use
 "
 
 echo "Запускаем сервер"
-exec gunicorn config.wsgi:application --workers 1 --bind 0.0.0.0:8000
\ No newline at end of file
+# gthread: долгие ответы (ZIP с оригиналами, /api/download/) занимают
+# один поток, а не весь процесс, и не упираются в --timeout sync-воркера
+exec gunicorn config.wsgi:application --workers 1 --worker-class gthread --threads 8 --bind 0.0.0.0:8000
\ No newline at end of file
@@ -3,12 +3,16 @@ from django.shortcuts import redirect
 from django.utils.html import format_html
 from django.db.models import Sum
 
+from .jobs import enqueue_upload
 from .models import (
+    Album,
     Photographer,
     PhotoSession,
     SessionPhoto,
     PhotoOrder,
     Service,
+    PhotoJob,
+    FaceCluster,
 )
 
 
@@ -57,6 +61,33 @@ class ServiceAdmin(admin.ModelAdmin):
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
+# ====== АЛЬБОМЫ ======
+
+@admin.register(Album)
+class AlbumAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "photographer", "view_code", "created_at")
+    search_fields = ("name", "view_code")
+    readonly_fields = ("view_code", "created_at")
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        if request.user.is_superuser:
+            return qs
+        # фотограф видит только свои альбомы
+        if hasattr(request.user, "photographer"):
+            return qs.filter(photographer=request.user.photographer)
+        return qs.none()
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == "photographer" and not request.user.is_superuser:
+            if hasattr(request.user, "photographer"):
+                kwargs["queryset"] = Photographer.objects.filter(
+                    id=request.user.photographer.id
+                )
+                kwargs["initial"] = request.user.photographer
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
 # ====== ФОТОСЕССИИ ======
 
 @admin.register(PhotoSession)
@@ -72,7 +103,7 @@ class PhotoSessionAdmin(admin.ModelAdmin):
         "download_code",
         "created_at",
     )
-    list_filter = ("photographer", "date", "created_at")
+    list_filter = ("photographer", "album", "date", "created_at")
     search_fields = ("client_name", "client_phone", "view_code", "download_code")
     readonly_fields = ("view_code", "download_code", "created_at")
 
@@ -93,6 +124,14 @@ class PhotoSessionAdmin(admin.ModelAdmin):
                     id=request.user.photographer.id
                 )
                 kwargs["initial"] = request.user.photographer
+        # альбом – только из своих
+        if db_field.name == "album" and not request.user.is_superuser:
+            if hasattr(request.user, "photographer"):
+                kwargs["queryset"] = Album.objects.filter(
+                    photographer=request.user.photographer
+                )
+            else:
+                kwargs["queryset"] = Album.objects.none()
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
@@ -102,7 +141,7 @@ class PhotoSessionAdmin(admin.ModelAdmin):
 class SessionPhotoAdmin(admin.ModelAdmin):
     list_display = ("id", "session", "uploaded_at")
     list_filter = ("session__photographer", "uploaded_at")
-    readonly_fields = ("watermarked_image", "face_encoding")
+    readonly_fields = ("watermarked_image", "sha256", "crc32")
 
     # --- показываем только свои фотосессии фотографу ---
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
@@ -147,14 +186,18 @@ class SessionPhotoAdmin(admin.ModelAdmin):
 
                 created = 0
                 for f in files:
-                    photo = SessionPhoto(session=session, original_image=f)
-                    # в save() уже генерируется face_encoding и watermarked_image
-                    photo.save()
+                    # оригинал сохраняется, фото ставится в очередь обработки
+                    try:
+                        enqueue_upload(session, f)
+                    except Exception as e:
+                        messages.error(request, f"{f.name}: {e}")
+                        continue
                     created += 1
 
                 messages.success(
                     request,
-                    f"Успешно загружено {created} фотографий в сессию «{session}».",
+                    f"Успешно загружено {created} фотографий в сессию «{session}». "
+                    f"Водяные знаки и поиск по лицу появятся после фоновой обработки.",
                 )
                 # после загрузки — обратно в список фотографий
                 return redirect("admin:photos_sessionphoto_changelist")
@@ -163,6 +206,33 @@ class SessionPhotoAdmin(admin.ModelAdmin):
         return super().add_view(request, form_url, extra_context)
 
 
+# ====== ОЧЕРЕДЬ ОБРАБОТКИ ======
+
+@admin.register(PhotoJob)
+class PhotoJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "photo", "status", "attempts", "created_at", "finished_at")
+    list_filter = ("status", "photo__session__photographer")
+    readonly_fields = ("photo", "attempts", "error", "created_at", "started_at", "finished_at")
+    actions = ["retry_jobs"]
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request).select_related("photo")
+        if request.user.is_superuser:
+            return qs
+        if hasattr(request.user, "photographer"):
+            return qs.filter(photo__session__photographer=request.user.photographer)
+        return qs.none()
+
+    @admin.action(description="Повторить обработку")
+    def retry_jobs(self, request, queryset):
+        updated = queryset.exclude(status=PhotoJob.STATUS_RUNNING).update(
+            status=PhotoJob.STATUS_PENDING,
+            error="",
+            attempts=0,
+        )
+        messages.success(request, f"Возвращено в очередь: {updated}")
+
+
 # ====== ЗАКАЗЫ ======
 
 @admin.register(PhotoOrder)
@@ -235,3 +305,28 @@ class PhotoOrderAdmin(admin.ModelAdmin):
         total = qs.aggregate(total=Sum("amount"))["total"] or 0
         response.context_data["summary_total"] = total
         return response
+
+
+# ====== ЛЮДИ В СЕССИЯХ (КЛАСТЕРЫ ЛИЦ) ======
+
+@admin.register(FaceCluster)
+class FaceClusterAdmin(admin.ModelAdmin):
+    list_display = ("id", "session", "photos_count", "size", "face_preview")
+    list_filter = ("session__photographer",)
+    readonly_fields = ("session", "representative", "image", "size", "photos_count")
+    exclude = ("centroid",)
+
+    def face_preview(self, obj):
+        if not obj.image:
+            return "-"
+        return format_html('<img src="{}" style="height:48px">', obj.image.url)
+
+    face_preview.short_description = "Лицо"
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        if request.user.is_superuser:
+            return qs
+        if hasattr(request.user, "photographer"):
+            return qs.filter(session__photographer=request.user.photographer)
+        return qs.none()
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PhotostudioConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'photostudio'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,122 @@
+import os
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+
+
+class LRUCache:
+    """
+    Простой потокобезопасный LRU-кэш в памяти процесса.
+    При переполнении выкидывается запись, к которой дольше всего
+    не обращались.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskLRUCache:
+    """
+    Файловый кэш с ограничением по суммарному размеру.
+
+    Время последнего обращения – mtime файла (обновляется при попадании),
+    при переполнении удаляются самые «старые» файлы. Запись атомарная
+    (свой tmp-файл на каждую запись + rename), поэтому кэш можно делить
+    между процессами и потоками.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Путь к файлу в кэше или None.
+        """
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def set(self, key: str, data: bytes) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """
+        Удаляет давно не использованные файлы, пока кэш не станет
+        меньше 90% от max_bytes. Файл keep (только что записанный) не трогаем.
+        """
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.is_file() or entry.name.endswith(".tmp"):
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        except FileNotFoundError:
+            return
+
+        if total <= self.max_bytes:
+            return
+
+        target = int(self.max_bytes * 0.9)
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,246 @@
+"""
+Кластеризация лиц сессии: «люди на этой фотосессии».
+
+Лица сессии связываются ребром, если расстояние между encoding'ами
+не больше FACE_CLUSTER_THRESHOLD (лица с одного фото не связываем –
+это заведомо разные люди), а затем граф делится на людей алгоритмом
+Chinese Whispers. Всё векторизовано на numpy: матрица расстояний
+считается кусками (строк в куске столько, чтобы временные массивы
+уложились в FACE_CLUSTER_MEMORY_BYTES), обновление меток – пачками вершин.
+
+Кластеры пересчитываются целиком, когда очередь сессии разобрана
+(см. jobs.process_jobs) или командой `manage.py cluster_faces`.
+"""
+import os
+
+import numpy as np
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+
+from .faceindex import _best_per_photo
+from .models import FaceCluster, PhotoFace, PhotoJob, PhotoSession
+from .utils import face_thumbnail
+
+
+# байт временных массивов на одну ячейку куска матрицы расстояний:
+# произведение, сумма (float32) и маска сравнения, с запасом
+EDGE_CELL_BYTES = 16
+
+
+def face_edges(vectors, photo_ids, threshold, chunk=None):
+    """
+    Рёбра графа (src, dst): пары лиц не дальше threshold, с разных фото.
+
+    Матрица N×N считается кусками по chunk строк; по умолчанию размер
+    куска – из FACE_CLUSTER_MEMORY_BYTES / N, чтобы память не росла
+    с размером сессии.
+    """
+    if chunk is None:
+        budget = getattr(settings, "FACE_CLUSTER_MEMORY_BYTES", 64 * 1024 * 1024)
+        chunk = max(1, budget // (EDGE_CELL_BYTES * max(len(vectors), 1)))
+    squared = np.einsum("ij,ij->i", vectors, vectors)
+    src, dst = [], []
+    for start in range(0, len(vectors), chunk):
+        part = vectors[start:start + chunk]
+        d2 = squared[start:start + chunk, None] - 2 * part @ vectors.T + squared[None, :]
+        i, j = np.nonzero(d2 <= threshold * threshold)
+        i += start
+        keep = photo_ids[i] != photo_ids[j]
+        src.append(i[keep])
+        dst.append(j[keep])
+
+    if not src:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(src), np.concatenate(dst)
+
+
+def chinese_whispers(n, src, dst, iterations=20, batches=8, seed=0) -> np.ndarray:
+    """
+    Chinese Whispers: каждая вершина берёт метку, самую частую среди
+    соседей. Вершины обновляются пачками в случайном порядке – так
+    метки не «качаются», как при полностью синхронном обновлении.
+    Возвращает метки (n,); вершины без рёбер остаются сами по себе.
+    """
+    labels = np.arange(n)
+    rng = np.random.default_rng(seed)
+
+    for _ in range(iterations):
+        changed = False
+        for batch in np.array_split(rng.permutation(n), batches):
+            selected = np.zeros(n, dtype=bool)
+            selected[batch] = True
+            mask = selected[src]
+            if not mask.any():
+                continue
+
+            # сколько раз каждая метка встречается у соседей вершины
+            keys, counts = np.unique(src[mask] * n + labels[dst[mask]], return_counts=True)
+            nodes, node_labels = keys // n, keys % n
+            order = np.lexsort((-counts, nodes))
+            nodes, node_labels = nodes[order], node_labels[order]
+            first = np.r_[True, nodes[1:] != nodes[:-1]]
+
+            nodes, node_labels = nodes[first], node_labels[first]
+            changed |= bool(np.any(labels[nodes] != node_labels))
+            labels[nodes] = node_labels
+
+        if not changed:
+            break
+
+    return labels
+
+
+def cluster_session(session) -> int:
+    """
+    Пересчитывает FaceCluster сессии. Возвращает число кластеров.
+    Кластеры меньше FACE_CLUSTER_MIN_SIZE (случайные лица на фоне)
+    не сохраняются – у их лиц cluster остаётся пустым.
+    """
+    version = session.faces_version
+    rows = list(
+        PhotoFace.objects
+        .filter(photo__session=session)
+        .order_by("id")
+        .values_list("id", "photo_id", "encoding", "top", "right", "bottom", "left")
+    )
+    face_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    photo_ids = np.array([row[1] for row in rows], dtype=np.int64)
+    vectors = np.frombuffer(
+        b"".join(bytes(row[2]) for row in rows),
+        dtype=np.float32,
+    ).reshape(-1, PhotoFace.ENCODING_SIZE)
+
+    threshold = getattr(settings, "FACE_CLUSTER_THRESHOLD", 0.5)
+    min_size = getattr(settings, "FACE_CLUSTER_MIN_SIZE", 2)
+    labels = chinese_whispers(len(rows), *face_edges(vectors, photo_ids, threshold))
+
+    clusters = []
+    members = []
+    for label in np.unique(labels):
+        rows_of = np.flatnonzero(labels == label)
+        if len(rows_of) < min_size:
+            continue
+
+        centroid = vectors[rows_of].mean(axis=0)
+        # представитель – лицо ближе всех к центроиду (и с известной рамкой)
+        closest = rows_of[np.argsort(np.linalg.norm(vectors[rows_of] - centroid, axis=1))]
+        with_box = [i for i in closest if rows[i][3] is not None]
+        representative = with_box[0] if with_box else closest[0]
+
+        clusters.append(FaceCluster(
+            session=session,
+            representative_id=int(face_ids[representative]),
+            centroid=PhotoFace.pack(centroid),
+            size=len(rows_of),
+            photos_count=len(np.unique(photo_ids[rows_of])),
+        ))
+        members.append((face_ids[rows_of].tolist(), rows[representative]))
+
+    # вырезы лиц – до транзакции, это чтение оригиналов с диска
+    style = session.photographer.watermark_style()
+    photos = {
+        photo.id: photo
+        for photo in session.sessionphoto_set.filter(
+            id__in=[face[1] for _, face in members]
+        )
+    }
+    for cluster, (_, face) in zip(clusters, members):
+        if face[3] is None:
+            continue
+        photo = photos[face[1]]
+        name = os.path.splitext(os.path.basename(photo.original_image.name))[0]
+        cluster.image.save(
+            f"{name}_face{face[0]}.jpg",
+            ContentFile(face_thumbnail(photo.original_image.path, face[3:7], style=style)),
+            save=False,
+        )
+
+    with transaction.atomic():
+        old = list(session.clusters.all())
+        PhotoFace.objects.filter(photo__session=session).update(cluster=None)
+        FaceCluster.objects.filter(session=session).delete()
+        FaceCluster.objects.bulk_create(clusters)
+        for cluster, (ids, _) in zip(clusters, members):
+            PhotoFace.objects.filter(id__in=ids).update(cluster=cluster)
+        PhotoSession.objects.filter(id=session.id).update(
+            clusters_version=version,
+            content_version=F("content_version") + 1,
+        )
+
+    for cluster in old:
+        if cluster.image:
+            cluster.image.delete(save=False)
+
+    session.clusters_version = version
+    return len(clusters)
+
+
+def stale_sessions():
+    """
+    Сессии, у которых лица менялись после последней кластеризации.
+    """
+    return PhotoSession.objects.exclude(clusters_version=F("faces_version"))
+
+
+def cluster_ready_sessions(session_ids) -> None:
+    """
+    После пачки: кластеризует те сессии, у которых очередь разобрана
+    (во время массовой загрузки пересчитывать на каждую пачку незачем).
+    """
+    session_ids = set(session_ids)
+    busy = PhotoJob.busy_session_ids(session_ids)
+    for session in stale_sessions().filter(id__in=session_ids).exclude(id__in=busy):
+        cluster_session(session)
+
+
+def search_clusters(session, encodings, threshold):
+    """
+    Поиск по селфи через людей сессии: запрос сравнивается только
+    с центроидами кластеров (их десятки, а лиц – тысячи), и если
+    ближайший не дальше threshold – в ответ идут лица этого человека,
+    тоже не дальше threshold (порог у клиента один на весь поиск).
+
+    Для каждого запроса – (photo_ids, distances) или None (человек
+    не найден или кластеры устарели). Это дополнение к обычному поиску
+    по индексу, а не замена: лица, не попавшие в кластер (мелкие
+    кластеры не сохраняются, Chinese Whispers может разделить человека),
+    находит только индекс – результаты объединяются (merge_results).
+    """
+    if session.clusters_version != session.faces_version:
+        return [None] * len(encodings)
+
+    clusters = list(session.clusters.values_list("id", "centroid"))
+    if not clusters:
+        return [None] * len(encodings)
+
+    centroids = np.frombuffer(
+        b"".join(bytes(row[1]) for row in clusters),
+        dtype=np.float32,
+    ).reshape(-1, PhotoFace.ENCODING_SIZE)
+
+    results = []
+    for encoding in encodings:
+        distances = np.linalg.norm(centroids - encoding, axis=1)
+        best = int(np.argmin(distances))
+        if distances[best] > threshold:
+            results.append(None)
+            continue
+
+        faces = list(
+            PhotoFace.objects
+            .filter(cluster_id=clusters[best][0])
+            .values_list("photo_id", "encoding")
+        )
+        vectors = np.frombuffer(
+            b"".join(bytes(row[1]) for row in faces),
+            dtype=np.float32,
+        ).reshape(-1, PhotoFace.ENCODING_SIZE)
+        distances = np.linalg.norm(vectors - encoding, axis=1)
+        hits = distances <= threshold
+        results.append(_best_per_photo(
+            np.array([row[0] for row in faces], dtype=np.int64)[hits],
+            distances[hits],
+        ))
+    return results
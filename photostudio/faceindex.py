@@ -0,0 +1,619 @@
+"""
+Индексы лиц для поиска по селфи.
+
+Индекс строится на каждую область поиска – сессию, альбом или всех
+фотографа (FaceScope) – и лежит на диске одним файлом (FACE_INDEX_DIR):
+заголовок фиксированного размера и подряд идущие массивы, в т.ч.
+float32-строки encoding'ов (N×128). Файл пишется атомарно при
+обработке фото, а процессы gunicorn открывают его через numpy.memmap:
+страницы общие в page cache ОС, копий в памяти каждого процесса нет,
+а холодный запрос читает только нужные страницы.
+
+Лица разложены по спискам ближайших k-means центроидов (IVF):
+запрос считает расстояния только в нескольких ближайших списках.
+На небольшом индексе список один – это обычный точный перебор.
+
+Индекс привязан к версии области – хешу пар (сессия, faces_version).
+faces_version растёт, когда у сессии появляются или пропадают лица;
+устаревший индекс дообновляется по изменившимся лицам.
+"""
+import base64
+import hashlib
+import os
+import struct
+import tempfile
+from typing import NamedTuple
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from .cache import LRUCache
+from .models import PhotoFace, PhotoJob, PhotoSession
+
+
+# ========== IVF-ИНДЕКС ==========
+
+def _best_per_photo(photo_ids, distances):
+    """
+    Оставляет по одному (лучшему) расстоянию на фото.
+    """
+    order = np.lexsort((distances, photo_ids))
+    photo_ids = photo_ids[order]
+    first = np.r_[True, photo_ids[1:] != photo_ids[:-1]] if len(photo_ids) else np.empty(0, dtype=bool)
+    return photo_ids[first], distances[order][first]
+
+
+def _nearest_centroid(vectors, centroids, chunk=8192) -> np.ndarray:
+    """
+    Номер ближайшего центроида для каждой строки vectors.
+    ||x - c||² = ||x||² - 2x·c + ||c||², ||x||² на argmin не влияет.
+    Считаем кусками, чтобы не держать целиком матрицу N×K.
+    """
+    c_norms = np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk):
+        part = vectors[start:start + chunk]
+        labels[start:start + chunk] = np.argmin(c_norms - 2 * part @ centroids.T, axis=1)
+    return labels
+
+
+def _kmeans(vectors, n_lists, iterations=10, sample_size=50_000, seed=0) -> np.ndarray:
+    """
+    Центроиды k-means (Ллойд) по случайной выборке лиц.
+    Для разбиения на списки точность k-means не критична – важно,
+    чтобы похожие лица попадали в один-два соседних списка.
+    """
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _nearest_centroid(vectors, centroids)
+        counts = np.bincount(labels, minlength=n_lists)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        filled = counts > 0
+        # пустой список оставляем на старом центроиде
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def _n_lists(n_faces: int) -> int:
+    """
+    Число списков ~ sqrt(N); на маленьком индексе – один список,
+    т.е. обычный точный перебор.
+    """
+    if n_faces < getattr(settings, "FACE_ANN_MIN_FACES", 20_000):
+        return 1
+    return int(np.sqrt(n_faces))
+
+
+class IVFFaceIndex:
+    """
+    Inverted file index по encoding'ам лиц.
+
+    Строки (лица) отсортированы по номеру списка: лица списка i –
+    это строки offsets[i]:offsets[i + 1] в vectors/face_ids/photo_ids.
+    """
+
+    def __init__(self, version, centroids, offsets, face_ids, photo_ids, vectors, trained_size):
+        self.version = version
+        self.centroids = centroids
+        self.offsets = offsets
+        self.face_ids = face_ids
+        self.photo_ids = photo_ids
+        self.vectors = vectors
+        # сколько лиц было при обучении центроидов (см. updated())
+        self.trained_size = trained_size
+
+    def __len__(self):
+        return len(self.face_ids)
+
+    @classmethod
+    def build(cls, version, face_ids, photo_ids, vectors) -> "IVFFaceIndex":
+        n_lists = _n_lists(len(face_ids))
+        if n_lists > 1:
+            centroids = _kmeans(vectors, n_lists)
+        else:
+            centroids = np.zeros((1, PhotoFace.ENCODING_SIZE), dtype=np.float32)
+        labels = _nearest_centroid(vectors, centroids)
+        return cls._from_labels(version, centroids, labels, face_ids, photo_ids, vectors, len(face_ids))
+
+    @classmethod
+    def _from_labels(cls, version, centroids, labels, face_ids, photo_ids, vectors, trained_size):
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=len(centroids))
+        return cls(
+            version=version,
+            centroids=centroids,
+            offsets=np.r_[0, np.cumsum(counts)].astype(np.int64),
+            face_ids=face_ids[order],
+            photo_ids=photo_ids[order],
+            vectors=vectors[order],
+            trained_size=trained_size,
+        )
+
+    def updated(self, version, face_ids, load_faces) -> "IVFFaceIndex":
+        """
+        Новый индекс под текущий набор лиц face_ids.
+
+        Пропавшие лица выкидываются, новые (их encoding'и дочитывает
+        load_faces(ids) -> (face_ids, photo_ids, vectors)) раскладываются
+        по существующим центроидам. Если лиц стало вдвое больше или
+        меньше, чем при обучении, центроиды обучаются заново.
+        """
+        keep = np.isin(self.face_ids, face_ids)
+        new_ids, new_photo_ids, new_vectors = load_faces(
+            face_ids[~np.isin(face_ids, self.face_ids)]
+        )
+
+        total = int(keep.sum()) + len(new_ids)
+        retrain = (
+            not (self.trained_size / 2 <= total <= self.trained_size * 2)
+            # перешли порог FACE_ANN_MIN_FACES в ту или другую сторону
+            or (len(self.centroids) == 1) != (_n_lists(total) == 1)
+        )
+        if retrain:
+            return IVFFaceIndex.build(
+                version,
+                np.concatenate([self.face_ids[keep], new_ids]),
+                np.concatenate([self.photo_ids[keep], new_photo_ids]),
+                np.concatenate([self.vectors[keep], new_vectors]),
+            )
+
+        # Без переобучения – сразу в итоговые массивы, список за списком:
+        # старые строки списка уже лежат подряд, новые добавляются в конец.
+        # Полная копия vectors одна (сам результат), временные – размером
+        # со список, а не со весь индекс.
+        n_lists = len(self.centroids)
+        new_labels = _nearest_centroid(new_vectors, self.centroids)
+        new_order = np.argsort(new_labels, kind="stable")
+        new_offsets = np.r_[0, np.cumsum(np.bincount(new_labels, minlength=n_lists))]
+        old_labels = np.repeat(np.arange(n_lists), np.diff(self.offsets))
+        counts = np.bincount(old_labels[keep], minlength=n_lists) + np.diff(new_offsets)
+        offsets = np.r_[0, np.cumsum(counts)].astype(np.int64)
+
+        out_face_ids = np.empty(total, dtype=np.int64)
+        out_photo_ids = np.empty(total, dtype=np.int64)
+        out_vectors = np.empty((total, PhotoFace.ENCODING_SIZE), dtype=np.float32)
+        for i in range(n_lists):
+            kept = self.offsets[i] + np.flatnonzero(keep[self.offsets[i]:self.offsets[i + 1]])
+            added = new_order[new_offsets[i]:new_offsets[i + 1]]
+            old_end = offsets[i] + len(kept)
+            for out, old, new in (
+                (out_face_ids, self.face_ids, new_ids),
+                (out_photo_ids, self.photo_ids, new_photo_ids),
+                (out_vectors, self.vectors, new_vectors),
+            ):
+                out[offsets[i]:old_end] = old[kept]
+                out[old_end:offsets[i + 1]] = new[added]
+
+        return IVFFaceIndex(
+            version=version,
+            centroids=self.centroids,
+            offsets=offsets,
+            face_ids=out_face_ids,
+            photo_ids=out_photo_ids,
+            vectors=out_vectors,
+            trained_size=self.trained_size,
+        )
+
+    def search(self, encoding, threshold, nprobe=None):
+        """
+        Фото, где есть лицо не дальше threshold: (photo_ids, distances).
+        Смотрим только nprobe списков с ближайшими центроидами.
+        """
+        query = np.asarray(encoding, dtype=np.float32)
+        if nprobe is None:
+            nprobe = getattr(settings, "FACE_ANN_NPROBE", 8)
+
+        n_lists = len(self.centroids)
+        if n_lists <= nprobe:
+            rows = slice(0, len(self.face_ids))
+        else:
+            probe = np.argpartition(np.linalg.norm(self.centroids - query, axis=1), nprobe)[:nprobe]
+            rows = np.concatenate([
+                np.arange(self.offsets[i], self.offsets[i + 1]) for i in probe
+            ])
+
+        distances = np.linalg.norm(self.vectors[rows] - query, axis=1)
+        hits = distances <= threshold
+        return _best_per_photo(self.photo_ids[rows][hits], distances[hits])
+
+    def search_many(self, encodings, threshold, nprobe=None):
+        """
+        Пакетный search() для Q запросов (несколько селфи / лиц):
+        расстояния до всех строк – одна матрица Q×N через
+        ||x - q||² = ||x||² - 2x·q + ||q||² (одно матричное умножение).
+        Возвращает список (photo_ids, distances) по каждому запросу.
+        """
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, PhotoFace.ENCODING_SIZE)
+        if len(queries) == 1:
+            return [self.search(queries[0], threshold, nprobe)]
+        if nprobe is None:
+            nprobe = getattr(settings, "FACE_ANN_NPROBE", 8)
+
+        n_lists = len(self.centroids)
+        if n_lists <= nprobe:
+            rows = slice(0, len(self.face_ids))
+        else:
+            # объединение списков, ближайших хотя бы к одному запросу
+            centroid_sq = (
+                np.einsum("ij,ij->i", self.centroids, self.centroids)[None, :]
+                - 2 * queries @ self.centroids.T
+            )
+            probe = np.unique(np.argpartition(centroid_sq, nprobe, axis=1)[:, :nprobe])
+            rows = np.concatenate([
+                np.arange(self.offsets[i], self.offsets[i + 1]) for i in probe
+            ])
+
+        vectors = self.vectors[rows]
+        photo_ids = self.photo_ids[rows]
+        squared = (
+            np.einsum("ij,ij->i", vectors, vectors)[None, :]
+            - 2 * queries @ vectors.T
+            + np.einsum("ij,ij->i", queries, queries)[:, None]
+        )
+        distances = np.sqrt(np.maximum(squared, 0))
+
+        results = []
+        for row in distances:
+            hits = row <= threshold
+            results.append(_best_per_photo(photo_ids[hits], row[hits]))
+        return results
+
+    # --- хранение на диске ---
+    #
+    # Формат файла (little-endian):
+    #   заголовок HEADER_SIZE байт: magic b"PEFI", версия формата, dim,
+    #   n_rows, n_lists, trained_size, версия индекса (ascii);
+    #   offsets   int64   (n_lists + 1)
+    #   face_ids  int64   (n_rows)
+    #   photo_ids int64   (n_rows)
+    #   centroids float32 (n_lists, dim)
+    #   vectors   float32 (n_rows, dim)
+
+    MAGIC = b"PEFI"
+    FORMAT_VERSION = 1
+    HEADER = struct.Struct("<4sIIQIQ64s")
+    HEADER_SIZE = 128
+
+    def _sections(self):
+        return (self.offsets, self.face_ids, self.photo_ids, self.centroids, self.vectors)
+
+    def save(self, path) -> None:
+        """
+        Атомарно: пишем во временный файл рядом и переименовываем.
+        Процессы, открывшие старый файл, дочитывают его же.
+        """
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        header = self.HEADER.pack(
+            self.MAGIC,
+            self.FORMAT_VERSION,
+            PhotoFace.ENCODING_SIZE,
+            len(self.face_ids),
+            len(self.centroids),
+            self.trained_size,
+            self.version.encode("ascii"),
+        )
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(header.ljust(self.HEADER_SIZE, b"\0"))
+                for array, dtype in zip(self._sections(), self._dtypes()):
+                    f.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @staticmethod
+    def _dtypes():
+        return (np.int64, np.int64, np.int64, np.float32, np.float32)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Индекс поверх np.memmap файла; None, если файла нет
+        или он в другом формате (тогда индекс просто перестроится).
+        """
+        try:
+            mm = np.memmap(path, dtype=np.uint8, mode="r")
+        except (FileNotFoundError, ValueError):
+            return None
+        if len(mm) < cls.HEADER_SIZE:
+            return None
+
+        magic, fmt, dim, n_rows, n_lists, trained_size, version = cls.HEADER.unpack(
+            mm[:cls.HEADER.size].tobytes()
+        )
+        if magic != cls.MAGIC or fmt != cls.FORMAT_VERSION or dim != PhotoFace.ENCODING_SIZE:
+            return None
+
+        shapes = ((n_lists + 1,), (n_rows,), (n_rows,), (n_lists, dim), (n_rows, dim))
+        arrays = []
+        offset = cls.HEADER_SIZE
+        for shape, dtype in zip(shapes, cls._dtypes()):
+            array = np.ndarray(shape, dtype=dtype, buffer=mm, offset=offset)
+            offset += array.nbytes
+            arrays.append(array)
+        offsets, face_ids, photo_ids, centroids, vectors = arrays
+
+        return cls(
+            version=version.rstrip(b"\0").decode("ascii"),
+            centroids=centroids,
+            offsets=offsets,
+            face_ids=face_ids,
+            photo_ids=photo_ids,
+            vectors=vectors,
+            trained_size=trained_size,
+        )
+
+
+# ========== ОБЛАСТИ ПОИСКА ==========
+
+def _scope_version(pairs) -> str:
+    return hashlib.sha1(repr(list(pairs)).encode()).hexdigest()
+
+
+class FaceScope(NamedTuple):
+    """
+    Область поиска: одна сессия, альбом или все сессии фотографа.
+    """
+    kind: str  # "session" | "album" | "photographer"
+    id: int
+
+    @classmethod
+    def for_session(cls, session) -> "FaceScope":
+        return cls("session", session.id)
+
+    @property
+    def key(self) -> str:
+        return f"{self.kind}_{self.id}"
+
+    @property
+    def path(self) -> str:
+        return os.path.join(settings.FACE_INDEX_DIR, f"{self.key}.idx")
+
+    def sessions(self):
+        if self.kind == "session":
+            return PhotoSession.objects.filter(id=self.id)
+        if self.kind == "album":
+            return PhotoSession.objects.filter(album_id=self.id)
+        return PhotoSession.objects.filter(photographer_id=self.id)
+
+    def faces(self):
+        return PhotoFace.objects.filter(photo__session__in=self.sessions())
+
+    def version(self) -> str:
+        """
+        Версия области – хеш пар (сессия, faces_version): меняется,
+        когда меняются лица любой сессии или состав сессий области.
+        """
+        return _scope_version(self.sessions().order_by("id").values_list("id", "faces_version"))
+
+    def search_version(self) -> str:
+        """
+        Версия, по которой ищем. Индексы фотографа и альбома воркер
+        дообновляет, только когда очередь сессии разобрана (см.
+        refresh_scope_indexes); пока идёт загрузка, ищем по последнему
+        записанному файлу, а не перестраиваем его на каждый запрос.
+        """
+        if self.kind != "session":
+            busy = PhotoJob.objects.filter(
+                photo__session__in=self.sessions(),
+                status__in=[PhotoJob.STATUS_PENDING, PhotoJob.STATUS_RUNNING],
+            )
+            if busy.exists():
+                published = IVFFaceIndex.load(self.path)
+                if published is not None:
+                    return published.version
+        return self.version()
+
+
+def _load_faces(face_ids):
+    """
+    (face_ids, photo_ids, vectors) для лиц с данными id.
+    """
+    rows = list(
+        PhotoFace.objects
+        .filter(id__in=face_ids.tolist())
+        .order_by("id")
+        .values_list("id", "photo_id", "encoding")
+    )
+    vectors = np.frombuffer(
+        b"".join(bytes(row[2]) for row in rows),
+        dtype=np.float32,
+    ).reshape(-1, PhotoFace.ENCODING_SIZE)
+    return (
+        np.array([row[0] for row in rows], dtype=np.int64),
+        np.array([row[1] for row in rows], dtype=np.int64),
+        vectors,
+    )
+
+
+def refresh_scope_index(scope: FaceScope, index=None, version=None) -> IVFFaceIndex:
+    """
+    Индекс области на текущую версию.
+
+    Порядок: index из памяти -> файл на диске (его мог уже обновить
+    воркер или другой процесс) -> дообновление по лицам из БД
+    с атомарной записью нового файла.
+    """
+    if version is None:
+        version = scope.version()
+    if index is not None and index.version == version:
+        return index
+
+    on_disk = IVFFaceIndex.load(scope.path)
+    if on_disk is not None:
+        if on_disk.version == version:
+            return on_disk
+        index = on_disk
+
+    face_ids = np.array(
+        list(scope.faces().order_by("id").values_list("id", flat=True)),
+        dtype=np.int64,
+    )
+    if index is None:
+        index = IVFFaceIndex.build(version, *_load_faces(face_ids))
+    else:
+        index = index.updated(version, face_ids, _load_faces)
+
+    index.save(scope.path)
+    # дальше работаем с файлом, а не с копией в памяти процесса
+    return IVFFaceIndex.load(scope.path)
+
+
+# в памяти держим только memmap-обёртки: сами данные – в page cache ОС
+_scope_indexes = LRUCache(getattr(settings, "FACE_INDEX_CACHE_SIZE", 32))
+
+
+def get_scope_index(scope: FaceScope, version=None) -> IVFFaceIndex:
+    """
+    Индекс области, актуальный на текущую версию.
+    """
+    index = refresh_scope_index(scope, _scope_indexes.get(scope.key), version)
+    _scope_indexes.set(scope.key, index)
+    return index
+
+
+def session_index_version(session) -> str:
+    # версия известна из уже загруженной сессии – без лишнего запроса
+    return _scope_version([(session.id, session.faces_version)])
+
+
+def forget_session_index(session_id) -> None:
+    _scope_indexes.pop(FaceScope("session", session_id).key)
+
+
+def refresh_scope_indexes(session_ids, drained_ids=()) -> None:
+    """
+    После обработки пачки фото: атомарно переписывает на диске индексы
+    сессий session_ids – поиск только открывает файл.
+
+    Индексы фотографов и альбомов (сотни тысяч лиц) переписываются
+    только для drained_ids – сессий, чья очередь разобрана: во время
+    массовой загрузки не копируем их целиком после каждой пачки.
+    """
+    for session_id in set(session_ids):
+        refresh_scope_index(FaceScope("session", session_id))
+
+    photographers = set()
+    albums = set()
+    for photographer_id, album_id in (
+        PhotoSession.objects
+        .filter(id__in=set(drained_ids))
+        .values_list("photographer_id", "album_id")
+    ):
+        photographers.add(photographer_id)
+        if album_id is not None:
+            albums.add(album_id)
+
+    for photographer_id in photographers:
+        refresh_scope_index(FaceScope("photographer", photographer_id))
+    for album_id in albums:
+        refresh_scope_index(FaceScope("album", album_id))
+
+
+def merge_results(results):
+    """
+    Объединение нескольких (photo_ids, distances): фото один раз,
+    с лучшим расстоянием.
+    """
+    if not results:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    return _best_per_photo(
+        np.concatenate([photo_ids for photo_ids, _ in results]),
+        np.concatenate([distances for _, distances in results]),
+    )
+
+
+# ========== РАНЖИРОВАНИЕ И СТРАНИЦЫ ==========
+#
+# Совпадения упорядочены по (distance, photo_id). Курсор – позиция
+# последнего отданного совпадения, следующая страница – всё, что
+# строго после него; пересортировывать весь список не нужно.
+
+def encode_cursor(distance: float, photo_id: int) -> str:
+    raw = f"{float(distance).hex()}:{int(photo_id)}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """
+    (distance, photo_id) из курсора; мусор -> ValueError.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        distance, photo_id = raw.split(":")
+        return float.fromhex(distance), int(photo_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Некорректный cursor")
+
+
+def rank_page(photo_ids, distances, limit: int, after=None):
+    """
+    Страница из limit лучших совпадений (после курсора after).
+
+    Лучшие k выбираются np.argpartition за O(N), сортируются только они.
+    Возвращает (photo_ids, distances, has_more).
+    """
+    if after is not None:
+        after_distance, after_id = after
+        rest = (distances > after_distance) | ((distances == after_distance) & (photo_ids > after_id))
+        photo_ids, distances = photo_ids[rest], distances[rest]
+
+    has_more = len(distances) > limit
+    if has_more:
+        kth = distances[np.argpartition(distances, limit - 1)[limit - 1]]
+        # <= kth – чтобы при равных расстояниях порядок по photo_id был честным
+        top = distances <= kth
+        photo_ids, distances = photo_ids[top], distances[top]
+
+    order = np.lexsort((photo_ids, distances))[:limit]
+    return photo_ids[order], distances[order], has_more
+
+
+# ========== КЭШ ПОИСКА ПО СЕЛФИ ==========
+#
+# Клиенты часто повторяют тот же селфи (плохая связь, повторная
+# отправка). По sha256 файла кэшируем encoding (HOG + encoding – самое
+# дорогое), а по (область, версия индекса, селфи, порог) – все
+# совпадения (photo_ids, distances), из которых режутся страницы.
+# Версия индекса в ключе: как только лица области меняются, старые
+# результаты просто перестают находиться.
+
+def selfie_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_selfie_encodings(digest: str, extract, all_faces: bool = False) -> np.ndarray:
+    """
+    Encoding'и лиц селфи (K×128) из кэша; при промахе – extract()
+    и в кэш (в т.ч. «лиц нет», чтобы не гонять HOG повторно).
+    """
+    cache = caches["faces"]
+    key = f"selfie:{digest}:{'all' if all_faces else 'one'}"
+    cached = cache.get(key)
+    if cached is None:
+        cached = np.asarray(extract(), dtype=np.float32).tobytes()
+        cache.set(key, cached)
+    return np.frombuffer(cached, dtype=np.float32).reshape(-1, PhotoFace.ENCODING_SIZE)
+
+
+def _result_key(scope: FaceScope, version: str, query_key: str, threshold: float) -> str:
+    return f"result:{scope.key}:{version}:{query_key}:{threshold}"
+
+
+def get_cached_result(scope: FaceScope, version: str, query_key: str, threshold: float):
+    return caches["faces"].get(_result_key(scope, version, query_key, threshold))
+
+
+def set_cached_result(scope: FaceScope, version: str, query_key: str, threshold: float, result) -> None:
+    caches["faces"].set(_result_key(scope, version, query_key, threshold), result)
@@ -0,0 +1,304 @@
+"""
+Фоновая обработка загруженных фото.
+
+Загрузка только сохраняет оригиналы и ставит PhotoJob в очередь,
+а CPU-тяжёлую часть (поиск лица, encoding, водяной знак) делает
+воркер `manage.py process_photos`.
+"""
+import os
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from datetime import timedelta
+from typing import List, Optional, Tuple
+
+import django
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .clusters import cluster_ready_sessions
+from .faceindex import refresh_scope_indexes
+from .manifests import update_manifests
+from .models import PhotoFace, PhotoJob, PhotoRendition, PhotoSession, SessionPhoto
+from .utils import FaceLibsMissing, check_image_header, process_photo_file
+from .zipstream import file_crc32
+
+
+def enqueue_upload(session, uploaded_file) -> PhotoJob:
+    """
+    Сохраняет один загруженный оригинал и ставит его в очередь.
+
+    Файл пишется в storage ДО транзакции, а сама транзакция
+    (SessionPhoto + PhotoJob) – две короткие вставки. Так SQLite
+    не держит блокировку записи, пока копируются мегабайты.
+
+    Не картинка -> ValueError (по заголовку, без декодирования).
+    """
+    check_image_header(uploaded_file)
+
+    photo = SessionPhoto(
+        session=session,
+        sha256=getattr(uploaded_file, "sha256", ""),
+        crc32=getattr(uploaded_file, "crc32", None),
+    )
+    photo.original_image.save(uploaded_file.name, uploaded_file, save=False)
+
+    try:
+        with transaction.atomic():
+            # внутри save() создаётся PhotoJob
+            photo.save()
+    except Exception:
+        photo.original_image.delete(save=False)
+        raise
+
+    return photo.job
+
+
+def get_max_attempts() -> int:
+    return getattr(settings, "PHOTO_JOB_MAX_ATTEMPTS", 3)
+
+
+def requeue_stale_jobs(older_than: timedelta) -> Tuple[int, int]:
+    """
+    Возвращает в очередь задачи, «зависшие» в RUNNING
+    (например, воркер был убит посреди обработки).
+
+    Задача, на которой воркер падал уже PHOTO_JOB_MAX_ATTEMPTS раз,
+    помечается FAILED – иначе одно «ядовитое» фото крутится вечно.
+    Возвращает (сколько вернули в очередь, сколько пометили FAILED).
+    """
+    border = timezone.now() - older_than
+    return _requeue(
+        PhotoJob.objects.filter(status=PhotoJob.STATUS_RUNNING, started_at__lt=border)
+    )
+
+
+def retry_jobs(jobs: List[PhotoJob]) -> Tuple[int, int]:
+    """
+    Пачка прервана (упал процесс пула): задачи – снова в очередь,
+    попытка засчитана. Повторные задачи claim_jobs() раздаёт по одной,
+    так что фото, из-за которого упал пул, быстро дойдёт до FAILED,
+    а остальные обработаются.
+    """
+    return _requeue(
+        PhotoJob.objects.filter(id__in=[job.id for job in jobs], status=PhotoJob.STATUS_RUNNING)
+    )
+
+
+def _requeue(running) -> Tuple[int, int]:
+    max_attempts = get_max_attempts()
+    failed = running.filter(attempts__gte=max_attempts).update(
+        status=PhotoJob.STATUS_FAILED,
+        finished_at=timezone.now(),
+        error=f"Обработка прерывалась {max_attempts} раз(а), фото пропущено",
+    )
+    requeued = running.update(status=PhotoJob.STATUS_PENDING)
+    return requeued, failed
+
+
+def claim_jobs(limit: int) -> List[PhotoJob]:
+    """
+    Забирает до `limit` задач из очереди.
+    Каждая задача переводится в RUNNING условным UPDATE,
+    поэтому два воркера не возьмут одну и ту же задачу.
+
+    Повторные задачи (attempts > 0) берутся по одной: если воркер
+    снова упадёт, попытка засчитается только подозрительному фото,
+    а не всей пачке.
+    """
+    pending = PhotoJob.objects.filter(status=PhotoJob.STATUS_PENDING).order_by("id")
+    retry = pending.filter(attempts__gt=0).values_list("id", flat=True).first()
+    if retry is not None:
+        ids = [retry]
+    else:
+        ids = list(pending.values_list("id", flat=True)[:limit])
+
+    claimed = []
+    for job_id in ids:
+        updated = (
+            PhotoJob.objects
+            .filter(id=job_id, status=PhotoJob.STATUS_PENDING)
+            .update(
+                status=PhotoJob.STATUS_RUNNING,
+                started_at=timezone.now(),
+                attempts=F("attempts") + 1,
+            )
+        )
+        if updated:
+            claimed.append(job_id)
+
+    return list(
+        PhotoJob.objects
+        .filter(id__in=claimed)
+        .select_related("photo__session__photographer")
+        .order_by("id")
+    )
+
+
+def release_jobs(jobs: List[PhotoJob]) -> None:
+    """
+    Возвращает взятые, но не обработанные задачи обратно в очередь.
+    Попытка не засчитывается – фото тут ни при чём.
+    """
+    (
+        PhotoJob.objects
+        .filter(id__in=[job.id for job in jobs], status=PhotoJob.STATUS_RUNNING)
+        .update(status=PhotoJob.STATUS_PENDING, attempts=F("attempts") - 1)
+    )
+
+
+def fill_missing_crc32(limit: int, after_id: int = 0) -> Optional[int]:
+    """
+    Досчитывает CRC32 оригиналов, загруженных до того, как его стал
+    считать upload handler (нужен для ZIP, см. zipstream.py).
+    Воркер зовёт это, пока очередь пуста, по `limit` фото за раз.
+
+    Возвращает id последнего просмотренного фото (следующий after_id)
+    или None, если дальше after_id таких фото нет.
+    """
+    photos = list(
+        SessionPhoto.objects
+        .filter(crc32__isnull=True, id__gt=after_id)
+        .order_by("id")
+        .only("id", "original_image")[:limit]
+    )
+    if not photos:
+        return None
+
+    done = []
+    for photo in photos:
+        try:
+            photo.crc32 = file_crc32(photo.original_image.path)
+        except OSError:
+            # файла нет – пропускаем, в архив он всё равно не попадёт
+            continue
+        done.append(photo)
+    SessionPhoto.objects.bulk_update(done, ["crc32"])
+    return photos[-1].id
+
+
+def get_ingest_workers() -> int:
+    """
+    Размер пула процессов из настройки PHOTO_INGEST_WORKERS (0 – все ядра).
+    """
+    workers = getattr(settings, "PHOTO_INGEST_WORKERS", 1)
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def _init_pool_worker():
+    # при spawn дочерний процесс стартует «с нуля» – поднимаем Django
+    django.setup()
+
+
+def make_ingest_pool(workers: int) -> Optional[ProcessPoolExecutor]:
+    """
+    Пул процессов для CPU-тяжёлой части (dlib HOG, LANCZOS, JPEG).
+    Потоки тут не помогают, поэтому именно процессы.
+    При workers == 1 пул не нужен – считаем в текущем процессе.
+    """
+    if workers <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_pool_worker)
+
+
+def process_jobs(jobs: List[PhotoJob], pool: Optional[ProcessPoolExecutor] = None) -> None:
+    """
+    Обрабатывает пачку задач.
+
+    Пайплайн (process_photo_file) для всех фото пачки идёт параллельно
+    в пуле, а в родителя возвращаются только результаты: он сохраняет
+    файлы водяных знаков и вариантов и одной транзакцией пишет фото,
+    PhotoRendition, PhotoFace и статусы задач.
+
+    FaceLibsMissing (нет face_recognition) пробрасывается наружу –
+    это проблема окружения, а не фото; см. release_jobs().
+    BrokenExecutor (дочерний процесс пула убит, чаще всего по OOM) –
+    тоже: пул надо пересоздать, а задачи пачки повторить; см. retry_jobs().
+
+    При повторной обработке старые лица, варианты и файлы водяного знака
+    заменяются новыми; faces_version растёт у каждой сессии, где лица
+    удалены или добавлены (в т.ч. если на фото лиц больше не нашлось).
+    """
+    # водяной знак – в оформлении фотографа этой сессии
+    tasks = [
+        (job.photo.original_image.path, job.photo.session.photographer.watermark_style())
+        for job in jobs
+    ]
+
+    if pool is None:
+        calls = [lambda task=task: process_photo_file(*task) for task in tasks]
+    else:
+        calls = [pool.submit(process_photo_file, *task).result for task in tasks]
+
+    results = []
+    for call in calls:
+        try:
+            results.append(call())
+        except (FaceLibsMissing, BrokenExecutor):
+            raise
+        except Exception as e:
+            results.append(e)
+
+    now = timezone.now()
+    photos = []
+    renditions = []
+    faces = []
+    old_files = set()
+    for job, result in zip(jobs, results):
+        job.finished_at = now
+        if isinstance(result, Exception):
+            job.status = PhotoJob.STATUS_FAILED
+            job.error = f"{type(result).__name__}: {result}"
+            continue
+
+        if job.photo.watermarked_image:
+            old_files.add(job.photo.watermarked_image.name)
+        # файлы водяного знака и вариантов пишутся в storage до транзакции
+        renditions.extend(job.photo.apply_processed(result))
+        faces.extend(job.photo.build_faces(result))
+        photos.append(job.photo)
+        job.status = PhotoJob.STATUS_DONE
+        job.error = ""
+
+    with transaction.atomic():
+        SessionPhoto.objects.bulk_update(
+            photos, ["watermarked_image", "width", "height", "placeholder"]
+        )
+        # при повторной обработке старые варианты и лица заменяются новыми
+        old_renditions = PhotoRendition.objects.filter(photo__in=photos)
+        old_files.update(old_renditions.values_list("image", flat=True))
+        old_renditions.delete()
+        PhotoRendition.objects.bulk_create(renditions)
+        old_faces = PhotoFace.objects.filter(photo__in=photos)
+        faces_changed = set(old_faces.values_list("photo__session_id", flat=True))
+        old_faces.delete()
+        PhotoFace.objects.bulk_create(faces)
+        faces_changed.update(face.photo.session_id for face in faces)
+        PhotoJob.objects.bulk_update(jobs, ["status", "error", "finished_at"])
+        # лица добавились или пропали -> индексы поиска этих сессий устарели
+        PhotoSession.bump_faces_version(faces_changed)
+        # обработанные фото появляются в галерее
+        PhotoSession.bump_content_version(job.photo.session_id for job in jobs)
+
+    # индексы дообновляем здесь, а не на первом поиске; фотографов и
+    # альбомов – когда очередь сессии разобрана
+    touched = {job.photo.session_id for job in jobs}
+    drained = touched - PhotoJob.busy_session_ids(touched)
+    refresh_scope_indexes(faces_changed, drained)
+    # статические манифесты галерей (см. manifests.py)
+    added = {}
+    for photo in photos:
+        added.setdefault(photo.session_id, []).append(photo.id)
+    update_manifests(added)
+
+    # «люди в сессии» – когда очередь сессии разобрана целиком
+    cluster_ready_sessions(drained)
+
+    # файлы прежней обработки – когда на них уже не ссылается ни одна строка
+    old_files.difference_update(photo.watermarked_image.name for photo in photos)
+    old_files.difference_update(rendition.image.name for rendition in renditions)
+    for name in old_files:
+        default_storage.delete(name)
@@ -0,0 +1,93 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from photostudio import utils
+
+
+def _iou(a, b):
+    # рамки (top, right, bottom, left)
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(bottom - top, 0) * max(right - left, 0)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    union = area_a + area_b - inter
+    return inter / union if union else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает поиск лиц на полном кадре (как раньше) и на уменьшенной "
+        "копии (FACE_DETECTION_MAX_SIDE): время и recall по папке с фото."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", help="Папка с JPEG для замера.")
+        parser.add_argument(
+            "--max-side",
+            type=int,
+            action="append",
+            help="Длинная сторона для уменьшенной копии (можно несколько раз).",
+        )
+        parser.add_argument(
+            "--iou",
+            type=float,
+            default=0.4,
+            help="Порог IoU, при котором лицо считается найденным.",
+        )
+
+    def handle(self, *args, **options):
+        directory = options["directory"]
+        if not os.path.isdir(directory):
+            raise CommandError(f"Нет такой папки: {directory}")
+
+        try:
+            utils._ensure_face_libs_loaded()
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        sides = options["max_side"] or [1600, 1200, 800]
+        names = sorted(
+            n for n in os.listdir(directory)
+            if n.lower().endswith((".jpg", ".jpeg", ".png"))
+        )
+        if not names:
+            raise CommandError("В папке нет фото")
+
+        baseline_time = 0.0
+        baseline_faces = 0
+        stats = {side: {"time": 0.0, "found": 0, "matched": 0} for side in sides}
+
+        for name in names:
+            img = utils._load_image_safely(os.path.join(directory, name))
+
+            started = time.perf_counter()
+            reference = utils._detect_faces(img, max_side=0, upsample=1)
+            baseline_time += time.perf_counter() - started
+            baseline_faces += len(reference)
+
+            for side in sides:
+                started = time.perf_counter()
+                found = utils._detect_faces(img, max_side=side)
+                stats[side]["time"] += time.perf_counter() - started
+                stats[side]["found"] += len(found)
+                stats[side]["matched"] += sum(
+                    1 for ref in reference
+                    if any(_iou(ref, box) >= options["iou"] for box in found)
+                )
+
+        count = len(names)
+        self.stdout.write(f"Фото: {count}, лиц на полном кадре: {baseline_faces}")
+        self.stdout.write(f"{'режим':>14} {'мс/фото':>10} {'ускорение':>10} {'recall':>8} {'лиц':>6}")
+        self.stdout.write(
+            f"{'полный кадр':>14} {baseline_time / count * 1000:>10.1f} {'1.0x':>10} {'1.000':>8} {baseline_faces:>6}"
+        )
+        for side in sides:
+            s = stats[side]
+            recall = s["matched"] / baseline_faces if baseline_faces else 1.0
+            speedup = baseline_time / s["time"] if s["time"] else 0.0
+            self.stdout.write(
+                f"{side:>14} {s['time'] / count * 1000:>10.1f} {speedup:>9.1f}x {recall:>8.3f} {s['found']:>6}"
+            )
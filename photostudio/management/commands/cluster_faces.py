@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from photostudio.clusters import cluster_session, stale_sessions
+from photostudio.models import PhotoSession
+
+
+class Command(BaseCommand):
+    help = "Кластеризация лиц сессий («люди на фотосессии»)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--session",
+            type=int,
+            action="append",
+            default=[],
+            help="id сессии (можно несколько раз). По умолчанию – все сессии, "
+                 "у которых лица менялись после последней кластеризации.",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Все сессии – например, чтобы пересобрать вырезы лиц "
+                 "после смены водяного знака.",
+        )
+
+    def handle(self, *args, **options):
+        if options["session"]:
+            sessions = PhotoSession.objects.filter(id__in=options["session"])
+        elif options["all"]:
+            sessions = PhotoSession.objects.all()
+        else:
+            sessions = stale_sessions()
+
+        for session in sessions:
+            count = cluster_session(session)
+            self.stdout.write(f"Сессия #{session.id}: людей – {count}")
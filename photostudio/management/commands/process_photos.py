@@ -0,0 +1,111 @@
+import time
+from concurrent.futures import BrokenExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from photostudio.jobs import (
+    claim_jobs,
+    fill_missing_crc32,
+    get_ingest_workers,
+    make_ingest_pool,
+    process_jobs,
+    release_jobs,
+    requeue_stale_jobs,
+    retry_jobs,
+)
+from photostudio.utils import FaceLibsMissing
+
+
+class Command(BaseCommand):
+    help = "Воркер очереди обработки фото: лицо, encoding и водяной знак."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Разобрать текущую очередь и выйти (без ожидания новых задач).",
+        )
+        parser.add_argument(
+            "--batch",
+            type=int,
+            default=10,
+            help="Сколько задач забирать за один раз (не меньше числа процессов).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Размер пула процессов (по умолчанию PHOTO_INGEST_WORKERS).",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=2.0,
+            help="Пауза (сек) между опросами пустой очереди.",
+        )
+        parser.add_argument(
+            "--stale-minutes",
+            type=int,
+            default=30,
+            help="Через сколько минут задача в RUNNING считается зависшей.",
+        )
+
+    def handle(self, *args, **options):
+        self._requeue_stale(options)
+
+        workers = options["workers"]
+        if workers is None:
+            workers = get_ingest_workers()
+        batch = max(options["batch"], workers)
+
+        self.workers = workers
+        self.crc_after = 0
+        self.pool = make_ingest_pool(workers)
+        try:
+            self._loop(batch, options)
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown(cancel_futures=True)
+
+    def _loop(self, batch, options):
+        while True:
+            jobs = claim_jobs(batch)
+
+            if not jobs:
+                if options["once"]:
+                    return
+                # задачи, брошенные другим (упавшим) воркером
+                self._requeue_stale(options)
+                # пока пусто – CRC32 старых оригиналов для ZIP-скачивания
+                self.crc_after = fill_missing_crc32(20, self.crc_after)
+                if self.crc_after is None:
+                    self.crc_after = 0
+                    time.sleep(options["sleep"])
+                continue
+
+            try:
+                process_jobs(jobs, pool=self.pool)
+            except BrokenExecutor:
+                # процесс пула убит (обычно OOM на каком-то фото): новый пул,
+                # а задачи пачки повторятся по одной
+                requeued, failed = retry_jobs(jobs)
+                self.stderr.write(
+                    f"Пул обработки упал, задач возвращено: {requeued}, FAILED: {failed}"
+                )
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = make_ingest_pool(self.workers)
+                continue
+            except FaceLibsMissing as e:
+                release_jobs(jobs)
+                raise CommandError(str(e))
+
+            for job in jobs:
+                self.stdout.write(f"Задача #{job.id} (фото {job.photo_id}): {job.status}")
+
+    def _requeue_stale(self, options):
+        requeued, failed = requeue_stale_jobs(timedelta(minutes=options["stale_minutes"]))
+        if requeued:
+            self.stdout.write(f"Возвращено в очередь зависших задач: {requeued}")
+        if failed:
+            self.stdout.write(f"Задач, превысивших число попыток (FAILED): {failed}")
@@ -0,0 +1,208 @@
+"""
+Статический манифест галереи сессии: MEDIA_ROOT/manifests/<view_code>.json.
+
+Галерея меняется только при загрузке / удалении фото, поэтому её JSON
+пишется заранее – после каждой пачки воркера и после удаления фото –
+и отдаётся nginx напрямую, без Django и SQLite.
+
+Манифест дообновляется: новые фото добавляются, удалённые выкидываются,
+остальные строки берутся из старого файла. Запись атомарная (временный
+файл + rename), читатель всегда видит целый файл. Чтение + запись идут
+под flock на соседнем .lock-файле: воркер и веб-процесс не затирают
+изменения друг друга.
+"""
+import fcntl
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .models import PhotoJob, PhotoRendition, PhotoSession, SessionPhoto
+from .serializers import gallery_photos
+
+MANIFEST_DIR = "manifests"
+MANIFEST_FORMAT = 3  # 2: width / height / placeholder; 3: без download_code
+
+
+def visible_photos(session):
+    """
+    Фото сессии, которые видит клиент: пока воркер не наложил
+    водяной знак – фото в галерее нет.
+    """
+    return (
+        SessionPhoto.objects
+        .filter(session=session)
+        .exclude(job__status__in=[
+            PhotoJob.STATUS_PENDING,
+            PhotoJob.STATUS_RUNNING,
+            PhotoJob.STATUS_FAILED,
+        ])
+        .order_by("uploaded_at", "id")
+    )
+
+
+def manifest_name(session) -> str:
+    return f"{MANIFEST_DIR}/{session.view_code}.json"
+
+
+def manifest_path(session) -> str:
+    return default_storage.path(manifest_name(session))
+
+
+def manifest_url(session) -> str:
+    return default_storage.url(manifest_name(session))
+
+
+def _photo_entries(session, queryset):
+    """
+    Строки манифеста – как в /api/photos/, плюс uploaded_at для порядка.
+    URL относительные: манифест не знает, с какого хоста его откроют.
+    """
+    rows = list(queryset.values(
+        "id", "uploaded_at", "original_image", "watermarked_image",
+        "width", "height", "placeholder",
+    ))
+    renditions = (
+        PhotoRendition.objects
+        .filter(photo_id__in=[row["id"] for row in rows])
+        .order_by("width", "name")
+        .values("photo_id", "name", "format", "width", "height", "image")
+    )
+    entries = gallery_photos(rows, renditions, default_storage.url(""), session.client_name)
+    for entry, row in zip(entries, rows):
+        entry["uploaded_at"] = row["uploaded_at"].isoformat()
+    return entries
+
+
+@contextmanager
+def _locked(path):
+    """
+    Эксклюзивная блокировка манифеста (между процессами и потоками).
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if manifest.get("format") != MANIFEST_FORMAT:
+        return None
+    return manifest
+
+
+def _write(path, manifest) -> None:
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, separators=(",", ":"))
+        # mkstemp создаёт файл 0600 – nginx должен его читать
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def write_manifest(session, added=(), removed=(), rebuild=False) -> None:
+    """
+    Пишет манифест сессии. added / removed – id фото, которые появились
+    или пропали; если старого манифеста нет (или rebuild) – строится целиком.
+    """
+    path = manifest_path(session)
+    with _locked(path):
+        manifest = None if rebuild else _read(path)
+        _write(path, _build(session, manifest, added, removed))
+
+
+def _build(session, manifest, added, removed):
+    if manifest is None:
+        photos = _photo_entries(session, visible_photos(session))
+    else:
+        drop = set(removed) | set(added)
+        photos = [photo for photo in manifest["photos"] if photo["id"] not in drop]
+        if added:
+            photos += _photo_entries(session, visible_photos(session).filter(id__in=list(added)))
+            photos.sort(key=lambda photo: (photo["uploaded_at"], photo["id"]))
+
+    return {
+        "format": MANIFEST_FORMAT,
+        "session": {
+            "id": session.id,
+            "client_name": session.client_name,
+            "view_code": session.view_code,
+        },
+        "photos": photos,
+    }
+
+
+def rebuild_manifest(session) -> None:
+    """
+    Полная пересборка (например, поменялось имя клиента).
+    """
+    write_manifest(session, rebuild=True)
+
+
+def update_manifests(added_by_session) -> None:
+    """
+    После пачки воркера: {session_id: [photo_id, ...]}.
+    """
+    for session in PhotoSession.objects.filter(id__in=list(added_by_session)):
+        write_manifest(session, added=added_by_session[session.id])
+
+
+# Удаление из админки – по фото за раз, но внутри одной транзакции:
+# копим id и переписываем манифест один раз после коммита.
+_pending = threading.local()
+
+
+def schedule_removal(session_id, photo_id) -> None:
+    removed = getattr(_pending, "removed", None)
+    if removed is None:
+        removed = _pending.removed = {}
+    removed.setdefault(session_id, set()).add(photo_id)
+    # вне транзакции выполнится сразу; в транзакции – после коммита,
+    # и только первый вызов застанет непустой список
+    transaction.on_commit(_flush_removals)
+
+
+def _flush_removals() -> None:
+    removed = getattr(_pending, "removed", None)
+    if not removed:
+        return
+    _pending.removed = {}
+
+    # после отката транзакции фото на месте – их не трогаем
+    still_there = set(
+        SessionPhoto.objects
+        .filter(id__in=[pk for ids in removed.values() for pk in ids])
+        .values_list("id", flat=True)
+    )
+    for session in PhotoSession.objects.filter(id__in=list(removed)):
+        write_manifest(session, removed=removed[session.id] - still_there)
+
+
+def delete_manifest(session) -> None:
+    path = manifest_path(session)
+    with _locked(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    # сам .lock не удаляем: пока его держит другой процесс, новый файл
+    # с тем же именем дал бы вторую, независимую блокировку
+
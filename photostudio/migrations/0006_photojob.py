@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photostudio', '0005_photosession_session_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PENDING', 'В очереди'), ('RUNNING', 'Обрабатывается'), ('DONE', 'Готово'), ('FAILED', 'Ошибка')], db_index=True, default='PENDING', max_length=10, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('photo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='job', to='photostudio.sessionphoto', verbose_name='Фото')),
+            ],
+            options={
+                'verbose_name': 'Задача обработки фото',
+                'verbose_name_plural': 'Очередь обработки фото',
+                'ordering': ['id'],
+            },
+        ),
+    ]
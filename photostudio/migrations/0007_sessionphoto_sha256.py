@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photostudio', '0006_photojob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sessionphoto',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:12
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photostudio', '0007_sessionphoto_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photographer',
+            name='watermark_angle',
+            field=models.SmallIntegerField(default=30, validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)], verbose_name='Угол водяного знака (градусы)'),
+        ),
+        migrations.AddField(
+            model_name='photographer',
+            name='watermark_opacity',
+            field=models.PositiveSmallIntegerField(default=160, validators=[django.core.validators.MaxValueValidator(255)], verbose_name='Непрозрачность водяного знака (0-255)'),
+        ),
+        migrations.AddField(
+            model_name='photographer',
+            name='watermark_text',
+            field=models.CharField(blank=True, help_text='Пусто – «PHOTOEASY». Например, название студии.', max_length=64, verbose_name='Текст водяного знака'),
+        ),
+    ]
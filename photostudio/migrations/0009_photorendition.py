@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photostudio', '0008_photographer_watermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32)),
+                ('format', models.CharField(max_length=8)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('image', models.ImageField(upload_to='photos/renditions/')),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='photostudio.sessionphoto')),
+            ],
+            options={
+                'ordering': ['width', 'name'],
+                'unique_together': {('photo', 'name')},
+            },
+        ),
+    ]
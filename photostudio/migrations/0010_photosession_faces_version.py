@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photostudio', '0009_photorendition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photosession',
+            name='faces_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:16
+
+import django.db.models.deletion
+import numpy as np
+from django.db import migrations, models
+
+
+def encodings_to_faces(apps, schema_editor):
+    """
+    JSON-список из 128 float -> PhotoFace.encoding (512 байт float32).
+    """
+    SessionPhoto = apps.get_model('photostudio', 'SessionPhoto')
+    PhotoFace = apps.get_model('photostudio', 'PhotoFace')
+
+    batch = []
+    rows = (
+        SessionPhoto.objects
+        .filter(face_encoding__isnull=False)
+        .values_list('id', 'face_encoding')
+        .iterator()
+    )
+    for photo_id, encoding in rows:
+        if not encoding:
+            continue
+        batch.append(PhotoFace(
+            photo_id=photo_id,
+            encoding=np.asarray(encoding, dtype=np.float32).tobytes(),
+        ))
+        if len(batch) >= 500:
+            PhotoFace.objects.bulk_create(batch)
+            batch = []
+    PhotoFace.objects.bulk_create(batch)
+
+
+def faces_to_encodings(apps, schema_editor):
+    SessionPhoto = apps.get_model('photostudio', 'SessionPhoto')
+    PhotoFace = apps.get_model('photostudio', 'PhotoFace')
+
+    for face in PhotoFace.objects.order_by('photo_id', 'id').iterator():
+        SessionPhoto.objects.filter(id=face.photo_id, face_encoding__isnull=True).update(
+            face_encoding=np.frombuffer(bytes(face.encoding), dtype=np.float32).tolist(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photostudio', '0010_photosession_faces_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoFace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('encoding', models.BinaryField()),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='faces', to='photostudio.sessionphoto')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunPython(encodings_to_faces, faces_to_encodings),
+        migrations.RemoveField(
+            model_name='sessionphoto',
+            name='face_encoding',
+        ),
+    ]
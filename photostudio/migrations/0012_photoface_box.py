@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photostudio', '0011_photoface'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photoface',
+            name='bottom',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photoface',
+            name='left',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photoface',
+            name='right',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photoface',
+            name='top',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
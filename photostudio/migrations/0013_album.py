@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photostudio', '0012_photoface_box'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Album',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Название')),
+                ('view_code', models.CharField(blank=True, max_length=12, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('photographer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='albums', to='photostudio.photographer')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='photosession',
+            name='album',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sessions', to='photostudio.album'),
+        ),
+    ]
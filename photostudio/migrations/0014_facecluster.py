@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photostudio', '0013_album'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photosession',
+            name='clusters_version',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='FaceCluster',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.ImageField(blank=True, upload_to='photos/faces/')),
+                ('centroid', models.BinaryField()),
+                ('size', models.PositiveIntegerField(default=0, verbose_name='Лиц')),
+                ('photos_count', models.PositiveIntegerField(default=0, verbose_name='Фото')),
+                ('representative', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='photostudio.photoface')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='clusters', to='photostudio.photosession')),
+            ],
+            options={
+                'ordering': ['-photos_count', 'id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='photoface',
+            name='cluster',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='faces', to='photostudio.facecluster'),
+        ),
+    ]
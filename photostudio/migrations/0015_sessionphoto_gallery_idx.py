@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photostudio', '0014_facecluster'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sessionphoto',
+            index=models.Index(fields=['session', 'uploaded_at', 'id'], name='sessionphoto_gallery_idx'),
+        ),
+    ]
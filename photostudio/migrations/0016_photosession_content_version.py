@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photostudio', '0015_sessionphoto_gallery_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photosession',
+            name='content_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photostudio', '0016_photosession_content_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sessionphoto',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sessionphoto',
+            name='placeholder',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='sessionphoto',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
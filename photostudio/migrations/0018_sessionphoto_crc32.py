@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photostudio', '0017_sessionphoto_layout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sessionphoto',
+            name='crc32',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -1,10 +1,14 @@
+import os
+
+import numpy as np
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.files.base import ContentFile
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.utils.crypto import get_random_string
 from django.conf import settings
 
-from .utils import extract_face_encoding_from_file, add_watermark_to_bytes
+from .utils import DEFAULT_WATERMARK_STYLE, WatermarkStyle
 
 User = get_user_model()
 
@@ -15,10 +19,54 @@ class Photographer(models.Model):
     first_name = models.CharField(max_length=255)
     last_name = models.CharField(max_length=255)
 
+    # оформление водяного знака на фото этого фотографа
+    watermark_text = models.CharField(
+        "Текст водяного знака",
+        max_length=64,
+        blank=True,
+        help_text="Пусто – «PHOTOEASY». Например, название студии.",
+    )
+    watermark_opacity = models.PositiveSmallIntegerField(
+        "Непрозрачность водяного знака (0-255)",
+        default=DEFAULT_WATERMARK_STYLE.alpha,
+        validators=[MaxValueValidator(255)],
+    )
+    watermark_angle = models.SmallIntegerField(
+        "Угол водяного знака (градусы)",
+        default=DEFAULT_WATERMARK_STYLE.angle,
+        validators=[MinValueValidator(-90), MaxValueValidator(90)],
+    )
+
+    def watermark_style(self) -> WatermarkStyle:
+        return WatermarkStyle(
+            text=self.watermark_text or DEFAULT_WATERMARK_STYLE.text,
+            alpha=self.watermark_opacity,
+            angle=self.watermark_angle,
+        )
+
     def __str__(self):
         return f"{self.studio_name} ({self.first_name})"
 
 
+class Album(models.Model):
+    """
+    Альбом – несколько сессий фотографа под одним публичным кодом
+    (например, все классы школы). Поиск по лицу идёт сразу по всем.
+    """
+    photographer = models.ForeignKey(Photographer, on_delete=models.CASCADE, related_name="albums")
+    name = models.CharField("Название", max_length=255)
+    view_code = models.CharField(max_length=12, unique=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def save(self, *args, **kwargs):
+        if not self.view_code:
+            self.view_code = get_random_string(10).upper()
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+
 class PhotoSession(models.Model):
     SESSION_TYPES = [
         ("REGULAR", "Обычная"),
@@ -28,6 +76,13 @@ class PhotoSession(models.Model):
     ]
 
     photographer = models.ForeignKey(Photographer, on_delete=models.CASCADE)
+    album = models.ForeignKey(
+        Album,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="sessions",
+    )
     client_name = models.CharField(max_length=255)
     client_phone = models.CharField(max_length=50)
     date = models.DateField(null=True, blank=True)
@@ -44,53 +99,344 @@ class PhotoSession(models.Model):
     view_code = models.CharField(max_length=12, unique=True, blank=True)
     download_code = models.CharField(max_length=12, unique=True, blank=True)
 
+    # растёт при каждом изменении набора лиц сессии (см. faceindex.py)
+    faces_version = models.PositiveIntegerField(default=0, editable=False)
+    # faces_version, по которому построены FaceCluster (см. clusters.py)
+    clusters_version = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    # растёт при любом изменении того, что видит клиент в галерее
+    # (фото, люди, услуги фотографа) – ключ кэша ответов и ETag
+    content_version = models.PositiveIntegerField(default=0, editable=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # меняются только атомарно через F() (bump_*, clusters.py); save()
+    # их не пишет – иначе значения из памяти затрут параллельный bump
+    VERSION_FIELDS = ("faces_version", "clusters_version", "content_version")
+
     def save(self, *args, **kwargs):
         if not self.view_code:
             self.view_code = get_random_string(10).upper()
         if not self.download_code:
             self.download_code = get_random_string(10).upper()
+
+        updating = not self._state.adding
+        if updating:
+            update_fields = kwargs.get("update_fields")
+            if update_fields is None:
+                update_fields = [
+                    field.name
+                    for field in self._meta.concrete_fields
+                    if not field.primary_key
+                ]
+            kwargs["update_fields"] = [
+                name for name in update_fields if name not in self.VERSION_FIELDS
+            ]
+            if not kwargs["update_fields"]:
+                return
+
         super().save(*args, **kwargs)
 
+        if updating:
+            # поменялись данные сессии (имя клиента и т.п.) – кэш галереи устарел
+            PhotoSession.bump_content_version([self.pk])
+
     def __str__(self):
         return f"{self.client_name} — {self.get_session_type_display()}"
 
+    @classmethod
+    def bump_faces_version(cls, session_ids) -> None:
+        cls.objects.filter(id__in=set(session_ids)).update(
+            faces_version=models.F("faces_version") + 1
+        )
+
+    @classmethod
+    def bump_content_version(cls, session_ids) -> None:
+        cls.objects.filter(id__in=set(session_ids)).update(
+            content_version=models.F("content_version") + 1
+        )
+
+
+def orientation_of(width, height):
+    """
+    "landscape" / "portrait" / "square" или None, если размер неизвестен.
+    """
+    if not width or not height:
+        return None
+    if width > height:
+        return "landscape"
+    if width < height:
+        return "portrait"
+    return "square"
 
 
 class SessionPhoto(models.Model):
     session = models.ForeignKey(PhotoSession, on_delete=models.CASCADE)
     original_image = models.ImageField(upload_to="photos/originals/")
     watermarked_image = models.ImageField(upload_to="photos/watermarked/", blank=True, null=True)
-    face_encoding = models.JSONField(blank=True, null=True)
+    # sha256 оригинала, считается потоково при загрузке
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True)
+    # CRC32 оригинала – для ZIP-архива (см. zipstream.py); у старых фото
+    # досчитывает воркер (jobs.fill_missing_crc32)
+    crc32 = models.PositiveBigIntegerField(null=True, blank=True)
+    # для раскладки галереи до загрузки картинок (заполняет воркер)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    placeholder = models.TextField(blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # галерея сессии листается по (uploaded_at, id), см. SessionPhotoListView
+            models.Index(fields=["session", "uploaded_at", "id"], name="sessionphoto_gallery_idx"),
+        ]
+
+    def apply_processed(self, processed):
+        """
+        Проставляет результат process_photo_file(): файл с водяным
+        знаком, размеры и placeholder, сохраняет файлы вариантов.
+        Возвращает НЕсохранённые PhotoRendition – их пишет вызывающий код
+        (фото к этому моменту уже должно быть в БД).
+        """
+        name = os.path.basename(self.original_image.name)
+        base = os.path.splitext(name)[0]
+
+        wm = processed.watermarked
+        self.watermarked_image.save(f"wm_{name}", ContentFile(wm.data), save=False)
+        self.width = processed.width
+        self.height = processed.height
+        self.placeholder = processed.placeholder
+        self._processed = True
+
+        # основное превью – тот же файл, что и watermarked_image
+        renditions = [
+            PhotoRendition(
+                photo=self,
+                name=wm.name,
+                format=wm.format,
+                width=wm.width,
+                height=wm.height,
+                image=self.watermarked_image.name,
+            )
+        ]
+        for r in processed.renditions:
+            rendition = PhotoRendition(
+                photo=self,
+                name=r.name,
+                format=r.format,
+                width=r.width,
+                height=r.height,
+            )
+            ext = "webp" if r.format == "WEBP" else "jpg"
+            rendition.image.save(f"{base}_{r.name}.{ext}", ContentFile(r.data), save=False)
+            renditions.append(rendition)
+
+        return renditions
+
+    def build_faces(self, processed):
+        """
+        НЕсохранённые PhotoFace (по одному на каждое лицо)
+        по результату process_photo_file().
+        """
+        return [
+            PhotoFace(
+                photo=self,
+                top=face.location[0],
+                right=face.location[1],
+                bottom=face.location[2],
+                left=face.location[3],
+                encoding=PhotoFace.pack(face.encoding),
+            )
+            for face in processed.faces
+        ]
+
+    @property
+    def orientation(self):
+        return orientation_of(self.width, self.height)
+
     def save(self, *args, **kwargs):
-        if not self.pk and self.original_image:
-            data = self.original_image.read()
+        is_new = self.pk is None
+        super().save(*args, **kwargs)
 
-            try:
-                self.face_encoding = extract_face_encoding_from_file(
-                    ContentFile(data, name=self.original_image.name)
-                )
-            except Exception:
-                self.face_encoding = None
+        # тяжёлая обработка (лицо + водяной знак) – в фоне, см. process_photos
+        if is_new and self.original_image and not getattr(self, "_processed", False):
+            PhotoJob.objects.create(photo=self)
 
-            try:
-                wm_bytes = add_watermark_to_bytes(data, text="WATERMARK")
-                wm_name = f"wm_{self.original_image.name}"
-                self.watermarked_image.save(wm_name, ContentFile(wm_bytes), save=False)
-            except Exception:
-                pass
+    def __str__(self):
+        return f"Photo {self.id} — Session {self.session_id}"
 
-            self.original_image = ContentFile(data, name=self.original_image.name)
 
-        super().save(*args, **kwargs)
+class PhotoFace(models.Model):
+    """
+    Лицо на фото для поиска по селфи – по строке на каждое найденное лицо.
+    Рамка – в пикселях оригинала (после EXIF-поворота).
+    encoding – 128 float32 подряд (512 байт), без JSON и без парсинга:
+    в numpy читается через np.frombuffer.
+    """
+    ENCODING_SIZE = 128
+
+    photo = models.ForeignKey(
+        SessionPhoto,
+        on_delete=models.CASCADE,
+        related_name="faces",
+    )
+    # null – лица, перенесённые из старого JSON (рамка тогда не хранилась)
+    top = models.PositiveIntegerField(null=True, blank=True)
+    right = models.PositiveIntegerField(null=True, blank=True)
+    bottom = models.PositiveIntegerField(null=True, blank=True)
+    left = models.PositiveIntegerField(null=True, blank=True)
+    encoding = models.BinaryField()
+    cluster = models.ForeignKey(
+        "FaceCluster",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="faces",
+    )
+
+    class Meta:
+        ordering = ["id"]
+
+    @staticmethod
+    def pack(encoding) -> bytes:
+        return np.asarray(encoding, dtype=np.float32).tobytes()
+
+    @property
+    def vector(self) -> np.ndarray:
+        """
+        Encoding как numpy-массив (128,) float32 – view на байты, без копии.
+        """
+        return np.frombuffer(self.encoding, dtype=np.float32)
+
+    @property
+    def location(self):
+        """
+        (top, right, bottom, left) или None.
+        """
+        if self.top is None:
+            return None
+        return (self.top, self.right, self.bottom, self.left)
 
     def __str__(self):
-        return f"Photo {self.id} — Session {self.session_id}"
+        return f"Лицо {self.id} — фото {self.photo_id}"
+
+
+class FaceCluster(models.Model):
+    """
+    Человек в сессии: лица, которые кластеризация сочла одним человеком.
+    Для галереи «выберите себя / своего ребёнка» – вырез лица
+    representative, для поиска по селфи – центроид encoding'ов.
+    """
+    session = models.ForeignKey(
+        PhotoSession,
+        on_delete=models.CASCADE,
+        related_name="clusters",
+    )
+    representative = models.ForeignKey(
+        PhotoFace,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    image = models.ImageField(upload_to="photos/faces/", blank=True)
+    centroid = models.BinaryField()
+    size = models.PositiveIntegerField("Лиц", default=0)
+    photos_count = models.PositiveIntegerField("Фото", default=0)
+
+    class Meta:
+        ordering = ["-photos_count", "id"]
+
+    @property
+    def vector(self) -> np.ndarray:
+        return np.frombuffer(self.centroid, dtype=np.float32)
+
+    def __str__(self):
+        return f"Человек {self.id} — сессия {self.session_id} ({self.photos_count} фото)"
 
 
+class PhotoRendition(models.Model):
+    """
+    Готовый вариант фото с водяным знаком: превью, миниатюра, WebP...
+    Набор задаётся настройкой PHOTO_RENDITIONS, строится при обработке.
+    """
+    photo = models.ForeignKey(
+        SessionPhoto,
+        on_delete=models.CASCADE,
+        related_name="renditions",
+    )
+    name = models.CharField(max_length=32)
+    format = models.CharField(max_length=8)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    image = models.ImageField(upload_to="photos/renditions/")
+
+    class Meta:
+        unique_together = ("photo", "name")
+        ordering = ["width", "name"]
+
+    def __str__(self):
+        return f"{self.name} {self.width}x{self.height} — фото {self.photo_id}"
+
+
+class PhotoJob(models.Model):
+    """
+    Очередь фоновой обработки фото (в БД, без Redis).
+    Разбирается командой `manage.py process_photos`.
+    """
+    STATUS_PENDING = "PENDING"
+    STATUS_RUNNING = "RUNNING"
+    STATUS_DONE = "DONE"
+    STATUS_FAILED = "FAILED"
+
+    STATUSES = [
+        (STATUS_PENDING, "В очереди"),
+        (STATUS_RUNNING, "Обрабатывается"),
+        (STATUS_DONE, "Готово"),
+        (STATUS_FAILED, "Ошибка"),
+    ]
+
+    photo = models.OneToOneField(
+        SessionPhoto,
+        on_delete=models.CASCADE,
+        related_name="job",
+        verbose_name="Фото",
+    )
+    status = models.CharField(
+        "Статус",
+        max_length=10,
+        choices=STATUSES,
+        default=STATUS_PENDING,
+        db_index=True,
+    )
+    attempts = models.PositiveSmallIntegerField("Попыток", default=0)
+    error = models.TextField("Ошибка", blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def busy_session_ids(cls, session_ids) -> set:
+        """
+        Сессии из session_ids, у которых очередь ещё не разобрана.
+        """
+        return set(
+            cls.objects
+            .filter(
+                photo__session_id__in=set(session_ids),
+                status__in=[cls.STATUS_PENDING, cls.STATUS_RUNNING],
+            )
+            .values_list("photo__session_id", flat=True)
+        )
+
+    class Meta:
+        verbose_name = "Задача обработки фото"
+        verbose_name_plural = "Очередь обработки фото"
+        ordering = ["id"]
+
+    def __str__(self):
+        return f"Задача #{self.id} (фото {self.photo_id}) — {self.get_status_display()}"
+
 # --------- НОВАЯ МОДЕЛЬ УСЛУГ ---------
 
 class Service(models.Model):
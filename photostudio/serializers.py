@@ -1,7 +1,11 @@
 from django.contrib.auth import get_user_model
+from django.utils.encoding import filepath_to_uri
 from rest_framework import serializers
 
-from .models import Photographer, PhotoSession, SessionPhoto, PhotoOrder, Service
+from .models import (
+    Photographer, PhotoSession, SessionPhoto, PhotoOrder, Service, PhotoJob, FaceCluster,
+    orientation_of,
+)
 
 User = get_user_model()
 
@@ -37,7 +41,15 @@ class UserRegisterSerializer(serializers.ModelSerializer):
 class PhotographerSerializer(serializers.ModelSerializer):
     class Meta:
         model = Photographer
-        fields = ["id", "first_name", "last_name", "studio_name"]
+        fields = [
+            "id",
+            "first_name",
+            "last_name",
+            "studio_name",
+            "watermark_text",
+            "watermark_opacity",
+            "watermark_angle",
+        ]
 
 
 class PhotoSessionSerializer(serializers.ModelSerializer):
@@ -52,9 +64,17 @@ class PhotoSessionSerializer(serializers.ModelSerializer):
             "created_at",
             "date",
             "price",  # стоимость фотосессии
+            "album",
         ]
         read_only_fields = ["view_code", "download_code", "created_at"]
 
+    def validate_album(self, album):
+        # сессию можно положить только в свой альбом
+        request = self.context.get("request")
+        if album is not None and request is not None and album.photographer_id != request.user.photographer.id:
+            raise serializers.ValidationError("Альбом принадлежит другому фотографу")
+        return album
+
 
 class SessionPhotoSerializer(serializers.ModelSerializer):
     class Meta:
@@ -64,6 +84,15 @@ class SessionPhotoSerializer(serializers.ModelSerializer):
         # original_image – пишем, watermarked_image – только читаем
 
 
+class PhotoJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.IntegerField(source="id", read_only=True)
+
+    class Meta:
+        model = PhotoJob
+        fields = ["job_id", "photo_id", "status", "attempts", "error", "created_at", "finished_at"]
+        read_only_fields = fields
+
+
 class ServiceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Service
@@ -110,12 +139,29 @@ class PhotoOrderSerializer(serializers.ModelSerializer):
         return order
 
 class SessionPhotoGallerySerializer(serializers.ModelSerializer):
+    """
+    Описание фото в галерее (в т.ч. для схемы API). Сам список
+    SessionPhotoListView собирает быстрее – gallery_photos() ниже.
+    """
     image_url = serializers.SerializerMethodField()
     client_name = serializers.CharField(source="session.client_name")
+    renditions = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
+    orientation = serializers.CharField(read_only=True)
 
     class Meta:
         model = SessionPhoto
-        fields = ["id", "image_url", "client_name"]
+        # width / height / placeholder – раскладка сетки до загрузки картинок
+        fields = [
+            "id", "image_url", "client_name", "renditions", "srcset",
+            "width", "height", "orientation", "placeholder",
+        ]
+
+    def _absolute(self, url):
+        request = self.context.get("request")
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
 
     def get_image_url(self, obj):
         # отдаём водяной знак, если есть, иначе оригинал
@@ -124,7 +170,88 @@ class SessionPhotoGallerySerializer(serializers.ModelSerializer):
         else:
             url = obj.original_image.url
 
+        return self._absolute(url)
+
+    def get_renditions(self, obj):
+        """
+        {"thumb": {"url": ..., "width": 320, "height": 213, "format": "JPEG"}, ...}
+        """
+        return {
+            r.name: {
+                "url": self._absolute(r.image.url),
+                "width": r.width,
+                "height": r.height,
+                "format": r.format,
+            }
+            for r in obj.renditions.all()
+        }
+
+    def get_srcset(self, obj):
+        """
+        Готовая строка для <img srcset>: JPEG-варианты по ширине.
+        """
+        return ", ".join(
+            f"{self._absolute(r.image.url)} {r.width}w"
+            for r in obj.renditions.all()
+            if r.format == "JPEG"
+        )
+
+
+def gallery_photos(rows, renditions, media_prefix, client_name):
+    """
+    Быстрый путь галереи: те же поля, что у SessionPhotoGallerySerializer,
+    но из values()-словарей, без экземпляров моделей.
+
+    rows       – values("id", "original_image", "watermarked_image",
+                        "width", "height", "placeholder")
+    renditions – values("photo_id", "name", "format", "width", "height", "image")
+    media_prefix – абсолютный URL MEDIA_URL, строится один раз на запрос.
+    """
+    by_photo = {}
+    for r in renditions:
+        by_photo.setdefault(r["photo_id"], []).append(r)
+
+    photos = []
+    for row in rows:
+        image = row["watermarked_image"] or row["original_image"]
+        variants = by_photo.get(row["id"], [])
+        photos.append({
+            "id": row["id"],
+            "image_url": media_prefix + filepath_to_uri(image),
+            "client_name": client_name,
+            "renditions": {
+                r["name"]: {
+                    "url": media_prefix + filepath_to_uri(r["image"]),
+                    "width": r["width"],
+                    "height": r["height"],
+                    "format": r["format"],
+                }
+                for r in variants
+            },
+            "srcset": ", ".join(
+                f"{media_prefix}{filepath_to_uri(r['image'])} {r['width']}w"
+                for r in variants
+                if r["format"] == "JPEG"
+            ),
+            "width": row["width"],
+            "height": row["height"],
+            "orientation": orientation_of(row["width"], row["height"]),
+            "placeholder": row["placeholder"],
+        })
+    return photos
+
+
+class FaceClusterSerializer(serializers.ModelSerializer):
+    image_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = FaceCluster
+        fields = ["id", "image_url", "photos_count"]
+
+    def get_image_url(self, obj):
+        if not obj.image:
+            return None
         request = self.context.get("request")
         if request is not None:
-            return request.build_absolute_uri(url)
-        return url
\ No newline at end of file
+            return request.build_absolute_uri(obj.image.url)
+        return obj.image.url
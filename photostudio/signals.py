@@ -0,0 +1,45 @@
+import os
+
+from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .faceindex import forget_session_index
+from .manifests import delete_manifest, manifest_path, rebuild_manifest, schedule_removal
+from .models import PhotoSession, Service, SessionPhoto
+
+
+@receiver(post_delete, sender=SessionPhoto)
+def session_photo_deleted(sender, instance, **kwargs):
+    # удалённое фото не должно находиться поиском по лицу
+    PhotoSession.bump_faces_version([instance.session_id])
+    PhotoSession.bump_content_version([instance.session_id])
+    forget_session_index(instance.session_id)
+    schedule_removal(instance.session_id, instance.id)
+
+
+@receiver(post_save, sender=SessionPhoto)
+def session_photo_saved(sender, instance, created, **kwargs):
+    if created:
+        PhotoSession.bump_content_version([instance.session_id])
+
+
+@receiver(post_save, sender=PhotoSession)
+def session_saved(sender, instance, created, **kwargs):
+    # в манифесте есть данные сессии (имя клиента, коды)
+    if not created and os.path.exists(manifest_path(instance)):
+        rebuild_manifest(instance)
+
+
+@receiver(post_delete, sender=PhotoSession)
+def session_deleted(sender, instance, **kwargs):
+    delete_manifest(instance)
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def service_changed(sender, instance, **kwargs):
+    # прайс показывается в галерее каждой сессии фотографа
+    PhotoSession.objects.filter(photographer_id=instance.photographer_id).update(
+        content_version=models.F("content_version") + 1
+    )
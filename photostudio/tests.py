@@ -1,3 +1,1423 @@
-from django.test import TestCase
+import base64
+import contextlib
+import fcntl
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+import zipfile
+import zlib
 
-# Create your tests here.
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image, features
+from rest_framework.test import APIClient, force_authenticate
+
+from .cache import DiskLRUCache
+from .clusters import chinese_whispers, cluster_session, face_edges, search_clusters
+from .faceindex import (
+    FaceScope,
+    IVFFaceIndex,
+    _nearest_centroid,
+    _scope_indexes,
+    decode_cursor,
+    encode_cursor,
+    get_cached_result,
+    get_scope_index,
+    get_selfie_encodings,
+    rank_page,
+    refresh_scope_index,
+    refresh_scope_indexes,
+    set_cached_result,
+)
+from .jobs import (
+    claim_jobs,
+    fill_missing_crc32,
+    process_jobs,
+    release_jobs,
+    requeue_stale_jobs,
+    retry_jobs,
+)
+from .manifests import MANIFEST_FORMAT, _build as build_manifest, manifest_path, write_manifest
+from .models import (
+    Album,
+    PhotoFace,
+    Photographer,
+    PhotoJob,
+    PhotoOrder,
+    PhotoRendition,
+    PhotoSession,
+    Service,
+    SessionPhoto,
+)
+from .utils import (
+    DEFAULT_WATERMARK_STYLE,
+    DetectedFace,
+    ProcessedPhoto,
+    WatermarkStyle,
+    _build_watermark_overlay,
+    _face_image,
+    _get_text_tile,
+    _get_watermark_overlay,
+    _make_renditions,
+    _overlay_cache,
+    _process_image,
+    _render_watermark,
+    process_photo_file,
+)
+from .views import SessionPhotoBulkUploadView
+from .zipstream import StoredZip, ZipEntry, file_crc32
+
+
+def jpeg_bytes(width=64, height=48, color=(120, 80, 200)) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(buf, "JPEG")
+    return buf.getvalue()
+
+
+class MediaTestCase(TestCase):
+    """
+    MEDIA_ROOT и кэши – во временном каталоге, у теста свой фотограф и сессия.
+    """
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media,
+            FILE_UPLOAD_TEMP_DIR=os.path.join(self.media, "tmp"),
+            FACE_INDEX_DIR=os.path.join(self.media, "faces"),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        cache.clear()
+        caches["faces"].clear()
+        _scope_indexes.clear()
+
+        self.user = get_user_model().objects.create_user("photographer", password="x")
+        self.photographer = Photographer.objects.create(
+            user=self.user, studio_name="Studio", first_name="Анна", last_name="Иванова",
+        )
+        self.session = PhotoSession.objects.create(
+            photographer=self.photographer, client_name="Клиент", client_phone="1",
+        )
+
+    def add_photo(self, name="photo.jpg", data=None, processed=True, session=None) -> SessionPhoto:
+        photo = SessionPhoto(session=session or self.session)
+        photo.original_image.save(name, SimpleUploadedFile(name, data or jpeg_bytes()), save=False)
+        photo.save()
+        if processed:
+            PhotoJob.objects.filter(photo=photo).update(status=PhotoJob.STATUS_DONE)
+            # сам файл превью тестам не нужен – важно, что воркер фото прошёл
+            SessionPhoto.objects.filter(id=photo.id).update(watermarked_image=f"photos/watermarked/{name}")
+            photo.refresh_from_db()
+        return photo
+
+    @staticmethod
+    def add_face(photo, box=None, encoding=None) -> PhotoFace:
+        top, right, bottom, left = box or (None, None, None, None)
+        return PhotoFace.objects.create(
+            photo=photo, top=top, right=right, bottom=bottom, left=left,
+            encoding=PhotoFace.pack(np.zeros(PhotoFace.ENCODING_SIZE) if encoding is None else encoding),
+        )
+
+
+# ========== ЗАГРУЗКА ==========
+
+def current_rss() -> int:
+    """
+    Текущий RSS процесса в байтах (Linux, /proc/self/statm).
+    """
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class PeakRSS:
+    """
+    Пик RSS процесса внутри блока with: фоновый поток опрашивает
+    /proc/self/statm каждую миллисекунду. ru_maxrss тут не годится –
+    это максимум за всю жизнь процесса, а тестовый процесс к этому
+    моменту мог уже занимать больше.
+    """
+
+    def __enter__(self):
+        self.baseline = self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            time.sleep(0.001)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    @property
+    def growth(self) -> int:
+        return self.peak - self.baseline
+
+
+class UploadMemoryTests(MediaTestCase):
+    """
+    Загрузка не держит файл в памяти: multipart-тело читается
+    из потока кусками, файл пишется во временный файл и переносится
+    в MEDIA_ROOT. Проверяется и рост RSS процесса за запрос,
+    и (точнее, без шума аллокатора) пик кучи Python через tracemalloc –
+    оба не должны зависеть от размера файла.
+    """
+    FILE_SIZE = 32 * 1024 * 1024
+    HEAP_PEAK_LIMIT = 4 * 1024 * 1024
+    RSS_GROWTH_LIMIT = 16 * 1024 * 1024
+    BOUNDARY = "photostudio-test-boundary"
+
+    def _write_body(self, path) -> bytes:
+        """
+        multipart-тело с одним JPEG размером FILE_SIZE (картинка + нули
+        в хвосте) пишется на диск; возвращает sha256 содержимого файла.
+        """
+        image = jpeg_bytes()
+        digest = hashlib.sha256(image)
+        filler = b"\0" * (1024 * 1024)
+        with open(path, "wb") as body:
+            body.write(
+                f"--{self.BOUNDARY}\r\n"
+                'Content-Disposition: form-data; name="images"; filename="big.jpg"\r\n'
+                "Content-Type: image/jpeg\r\n\r\n".encode()
+            )
+            body.write(image)
+            left = self.FILE_SIZE - len(image)
+            while left:
+                chunk = filler[:left]
+                body.write(chunk)
+                digest.update(chunk)
+                left -= len(chunk)
+            body.write(f"\r\n--{self.BOUNDARY}--\r\n".encode())
+        return digest.hexdigest()
+
+    def _upload(self, body_path, measure=contextlib.nullcontext()):
+        with open(body_path, "rb") as body:
+            request = WSGIRequest({
+                "REQUEST_METHOD": "POST",
+                "PATH_INFO": f"/api/sessions/{self.session.id}/photos/bulk-upload/",
+                "CONTENT_TYPE": f"multipart/form-data; boundary={self.BOUNDARY}",
+                "CONTENT_LENGTH": str(os.path.getsize(body_path)),
+                "SERVER_NAME": "testserver",
+                "SERVER_PORT": "80",
+                "wsgi.url_scheme": "http",
+                "wsgi.input": body,
+            })
+            force_authenticate(request, self.user)
+            try:
+                with measure:
+                    response = SessionPhotoBulkUploadView.as_view()(request, session_id=self.session.id)
+            finally:
+                request.close()
+        self.assertEqual(response.status_code, 202, response.data)
+
+    def test_bulk_upload_heap_peak_does_not_depend_on_file_size(self):
+        body_path = os.path.join(self.media, "body")
+        sha256 = self._write_body(body_path)
+
+        tracemalloc.start()
+        try:
+            self._upload(body_path)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, self.HEAP_PEAK_LIMIT)
+
+        photo = SessionPhoto.objects.get(session=self.session)
+        self.assertEqual(photo.sha256, sha256)
+        self.assertEqual(photo.crc32, file_crc32(photo.original_image.path))
+        self.assertEqual(os.path.getsize(photo.original_image.path), self.FILE_SIZE)
+        self.assertEqual(photo.job.status, PhotoJob.STATUS_PENDING)
+
+    def test_upload_creates_temp_dir(self):
+        # MEDIA_ROOT на свежем томе пуст – каталога tmp ещё нет
+        upload_tmp = os.path.join(self.media, "tmp")
+        self.assertFalse(os.path.exists(upload_tmp))
+        self.FILE_SIZE = 1024 * 1024
+        body_path = os.path.join(self.media, "body")
+        self._write_body(body_path)
+
+        self._upload(body_path)
+        self.assertTrue(os.path.isdir(upload_tmp))
+        self.assertEqual(SessionPhoto.objects.filter(session=self.session).count(), 1)
+
+    @unittest.skipUnless(os.path.exists("/proc/self/statm"), "RSS читается из /proc (Linux)")
+    def test_bulk_upload_rss_growth_is_bounded(self):
+        body_path = os.path.join(self.media, "body")
+        self._write_body(body_path)
+
+        rss = PeakRSS()
+        self._upload(body_path, rss)
+        self.assertLess(rss.growth, self.RSS_GROWTH_LIMIT)
+        self.assertEqual(os.path.getsize(SessionPhoto.objects.get().original_image.path), self.FILE_SIZE)
+
+
+# ========== ВАРИАНТЫ ФОТО ==========
+
+class RenditionTests(MediaTestCase):
+
+    @override_settings(PHOTO_RENDITIONS=[
+        {"name": "thumb", "max_width": 320, "format": "JPEG", "quality": 80},
+        {"name": "full", "max_width": 2000, "format": "jpeg"},
+        {"name": "thumb_webp", "max_width": 320, "format": "WEBP", "quality": 75},
+    ])
+    def test_renditions_follow_settings(self):
+        renditions = _make_renditions(Image.new("RGB", (1000, 667), (90, 120, 150)))
+        expected = [("thumb", "JPEG", 320, 213), ("full", "JPEG", 1000, 667)]
+        if features.check("webp"):
+            expected.append(("thumb_webp", "WEBP", 320, 213))
+        self.assertEqual([(r.name, r.format, r.width, r.height) for r in renditions], expected)
+        for rendition in renditions:
+            with Image.open(io.BytesIO(rendition.data)) as img:
+                self.assertEqual((img.format, img.size), (rendition.format, (rendition.width, rendition.height)))
+
+    @mock.patch("photostudio.jobs.process_photo_file")
+    def test_gallery_lists_renditions_and_srcset(self, process):
+        photo = self.add_photo("img.jpg", processed=False)
+        process.return_value = processed_photo()
+        process_jobs(claim_jobs(1))
+
+        data = APIClient().get(f"/api/photos/?view_code={self.session.view_code}").json()
+        [entry] = data["photos"]
+        self.assertEqual(entry["id"], photo.id)
+        stored = {r.name: r for r in PhotoRendition.objects.filter(photo=photo)}
+        self.assertEqual(set(entry["renditions"]), set(stored))
+        self.assertEqual(entry["renditions"]["thumb"]["width"], 320)
+        for name, rendition in entry["renditions"].items():
+            self.assertTrue(os.path.exists(stored[name].image.path))
+            self.assertTrue(rendition["url"].endswith(stored[name].image.name))
+        # в srcset – только JPEG, по возрастанию ширины
+        jpeg = sorted((r.width, r.image.name) for r in stored.values() if r.format == "JPEG")
+        self.assertEqual(entry["srcset"], ", ".join(
+            f"http://testserver/photos/{name} {width}w" for width, name in jpeg
+        ))
+
+
+# ========== ВАРИАНТЫ ФОТО ПО ЗАПРОСУ ==========
+
+class DiskLRUCacheTests(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+
+    def test_concurrent_set_of_same_key(self):
+        """
+        Потоки одного процесса (gthread) пишут один и тот же ключ:
+        у каждого свой tmp-файл, в итоге – один целый файл.
+        """
+        cache = DiskLRUCache(self.dir, 10 * 1024 * 1024)
+        payloads = [bytes([i]) * 200_000 for i in range(8)]
+
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda data: [cache.set("a.jpg", data) for _ in range(20)], payloads))
+
+        with open(cache.get("a.jpg"), "rb") as f:
+            self.assertIn(f.read(), payloads)
+        self.assertEqual(os.listdir(self.dir), ["a.jpg"])
+
+    def test_evicts_least_recently_used(self):
+        cache = DiskLRUCache(self.dir, 2500)
+        for name in ("a", "b", "c"):
+            cache.set(name, b"x" * 1000)
+            time.sleep(0.01)
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+
+
+class PhotoRenderViewTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.photo = self.add_photo("img.jpg", jpeg_bytes(1200, 800))
+        self.add_face(self.photo, (200, 700, 500, 400))
+        cache_patch = mock.patch("photostudio.views.render_cache", DiskLRUCache(os.path.join(self.media, "renditions"), 10**8))
+        cache_patch.start()
+        self.addCleanup(cache_patch.stop)
+        # у обработанного фото рамки берутся из PhotoFace – HOG не нужен
+        detect_patch = mock.patch("photostudio.utils._ensure_face_libs_loaded", side_effect=AssertionError("HOG"))
+        detect_patch.start()
+        self.addCleanup(detect_patch.stop)
+        self.url = f"/api/photos/{self.photo.id}/render/"
+
+    def _get(self, **params):
+        response = APIClient().get(self.url, {"view_code": self.session.view_code, **params})
+        if response.status_code == 200:
+            body = b"".join(response.streaming_content) if response.streaming else response.content
+            return response, Image.open(io.BytesIO(body))
+        return response, None
+
+    def test_variants(self):
+        response, img = self._get(variant="watermarked", size=640)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(img.width, 640)
+
+        _, img = self._get(variant="thumbnail", size=160)
+        self.assertEqual(img.size, (160, 160))
+
+        _, img = self._get(variant="face", size=160)
+        self.assertEqual(img.size, (160, 160))
+
+    def test_face_crop_is_watermarked(self):
+        _, img = self._get(variant="face", size=320)
+        plain = _face_image(self.photo.original_image.path, (200, 700, 500, 400), 320)
+        # средняя разница с вырезом без знака – не шум JPEG
+        difference = np.abs(np.asarray(img.convert("RGB"), dtype=np.int16) - np.asarray(plain.convert("RGB"), dtype=np.int16))
+        self.assertGreater(difference.mean(), 3)
+
+    def test_face_size_is_capped(self):
+        with override_settings(FACE_RENDER_MAX_SIZE=160):
+            response, _ = self._get(variant="face", size=320)
+        self.assertEqual(response.status_code, 400)
+
+    def test_bad_params(self):
+        self.assertEqual(self._get(variant="original")[0].status_code, 400)
+        self.assertEqual(self._get(size=123)[0].status_code, 400)
+        response = APIClient().get(self.url, {"view_code": "WRONG"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_etag_and_304(self):
+        response, _ = self._get(size=320)
+        self.assertNotIn("Last-Modified", response)
+        etag = response["ETag"]
+
+        cached, _ = self._get(size=320)
+        self.assertEqual(cached["ETag"], etag)
+
+        response = APIClient().get(
+            self.url, {"view_code": self.session.view_code, "size": 320}, HTTP_IF_NONE_MATCH=etag,
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_etag_follows_watermark_style(self):
+        etag = self._get(size=320)[0]["ETag"]
+        self.photographer.watermark_text = "STUDIO"
+        self.photographer.save()
+        self.assertNotEqual(self._get(size=320)[0]["ETag"], etag)
+
+
+# ========== ВОДЯНОЙ ЗНАК ==========
+
+class WatermarkCacheTests(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        settings_override = override_settings(WATERMARK_CACHE_DIR=self.dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        _overlay_cache.clear()
+        self.addCleanup(_overlay_cache.clear)
+
+    def overlay(self, width=400, height=300):
+        return _get_watermark_overlay(width, height, 18, "PHOTOEASY", 30, 160)
+
+    def test_overlay_is_built_once_per_size(self):
+        with mock.patch("photostudio.utils._build_watermark_overlay", wraps=_build_watermark_overlay) as build:
+            first = self.overlay()
+            self.assertIs(self.overlay(), first)
+            self.overlay(500, 300)
+        self.assertEqual(build.call_count, 2)
+
+    def test_overlay_is_shared_through_disk(self):
+        built = self.overlay()
+        self.assertEqual(len(os.listdir(self.dir)), 1)
+
+        _overlay_cache.clear()
+        with mock.patch("photostudio.utils._build_watermark_overlay") as build:
+            loaded = self.overlay()
+        build.assert_not_called()
+        self.assertEqual(loaded.tobytes(), built.tobytes())
+
+    def test_concurrent_builds_leave_no_temp_files(self):
+        def build(_):
+            _overlay_cache.clear()
+            return self.overlay().size
+
+        with ThreadPoolExecutor(8) as pool:
+            self.assertEqual(set(pool.map(build, range(32))), {(400, 300)})
+        self.assertEqual([name for name in os.listdir(self.dir) if name.endswith(".tmp")], [])
+
+    def test_face_cutout_does_not_change_cached_overlay(self):
+        overlay = self.overlay()
+        before = overlay.tobytes()
+        _render_watermark(Image.new("RGB", (400, 300), (10, 20, 30)), [(50, 250, 200, 100)])
+        self.assertEqual(overlay.tobytes(), before)
+
+    def test_face_is_left_clean(self):
+        img = Image.new("RGB", (400, 300), (10, 20, 30))
+        result = _render_watermark(img, [(50, 250, 200, 100)])
+        face = result.crop((120, 80, 230, 170))
+        self.assertEqual(face.getcolors(), [(110 * 90, (10, 20, 30))])
+
+
+class WatermarkStyleTests(TestCase):
+
+    def setUp(self):
+        settings_override = override_settings(WATERMARK_CACHE_DIR=None)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        _overlay_cache.clear()
+        self.addCleanup(_overlay_cache.clear)
+        self.image = Image.new("RGB", (400, 300), (10, 20, 30))
+
+    def render(self, **style):
+        return _render_watermark(self.image, [], DEFAULT_WATERMARK_STYLE._replace(**style)).tobytes()
+
+    def test_photographer_style_defaults(self):
+        user = get_user_model().objects.create_user("studio", password="x")
+        photographer = Photographer.objects.create(
+            user=user, studio_name="Studio", first_name="Анна", last_name="Иванова",
+        )
+        self.assertEqual(photographer.watermark_style(), DEFAULT_WATERMARK_STYLE)
+
+        photographer.watermark_text = "STUDIO"
+        photographer.watermark_opacity = 90
+        photographer.watermark_angle = -45
+        self.assertEqual(photographer.watermark_style(), WatermarkStyle("STUDIO", 90, -45))
+
+    def test_style_changes_rendered_preview(self):
+        default = self.render()
+        self.assertNotEqual(self.render(text="STUDIO"), default)
+        self.assertNotEqual(self.render(alpha=60), default)
+        self.assertNotEqual(self.render(angle=-30), default)
+        self.assertEqual(self.render(), default)
+
+    def test_text_tile_is_rasterised_once(self):
+        _get_text_tile.cache_clear()
+        self.render(text="ONCE")
+        _overlay_cache.clear()
+        self.render(text="ONCE")
+        info = _get_text_tile.cache_info()
+        self.assertEqual((info.misses, info.hits), (1, 1))
+
+
+# ========== ZIP С ОРИГИНАЛАМИ ==========
+
+class StoredZipTests(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        rng = np.random.default_rng(0)
+        self.files = {}
+        self.entries = []
+        for i, size in enumerate([0, 1, 1000, 70_000]):
+            name = f"фото_{i}.jpg"
+            data = rng.integers(0, 256, size, dtype=np.uint8).tobytes()
+            path = os.path.join(self.dir, name)
+            with open(path, "wb") as f:
+                f.write(data)
+            self.files[name] = data
+            self.entries.append(ZipEntry(name, path, size, zlib.crc32(data), datetime(2024, 5, 1, 12, 30)))
+
+    def test_archive_is_valid_zip(self):
+        archive = StoredZip(self.entries, chunk_size=4096)
+        data = b"".join(archive.iter_range())
+        self.assertEqual(len(data), archive.size)
+
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.namelist(), list(self.files))
+            for name, content in self.files.items():
+                self.assertEqual(zf.read(name), content)
+
+    def test_any_range_matches_full_archive(self):
+        archive = StoredZip(self.entries, chunk_size=4096)
+        data = b"".join(archive.iter_range())
+        boundaries = sorted({0, 1, archive.size - 1, archive.size} | set(archive._offsets))
+        points = sorted(set(boundaries) | {b + 1 for b in boundaries if b < archive.size})
+        for start in points:
+            for end in points:
+                if start <= end:
+                    self.assertEqual(b"".join(archive.iter_range(start, end)), data[start:end])
+
+    def test_etag_depends_on_contents(self):
+        self.assertEqual(StoredZip(self.entries).etag, StoredZip(list(self.entries)).etag)
+        changed = self.entries[:-1] + [self.entries[-1]._replace(crc32=self.entries[-1].crc32 ^ 1)]
+        self.assertNotEqual(StoredZip(self.entries).etag, StoredZip(changed).etag)
+
+
+class SessionDownloadTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.photos = photos = [self.add_photo(f"img{i}.jpg", jpeg_bytes(color=(i * 40, 0, 0))) for i in range(3)]
+        for photo in photos:
+            SessionPhoto.objects.filter(id=photo.id).update(crc32=file_crc32(photo.original_image.path))
+        self.order = PhotoOrder.objects.create(
+            photographer=self.photographer,
+            session=self.session,
+            client_name="Клиент",
+            client_phone="1",
+            paid_at=timezone.now(),
+            amount=100,
+        )
+        self.order.photos.add(*photos[:2])
+        self.url = f"/api/download/?download_code={self.session.download_code}&order={self.order.id}"
+
+    def _get(self, **headers):
+        response = APIClient().get(self.url, **headers)
+        return response, b"".join(response.streaming_content) if response.streaming else b""
+
+    def test_full_archive_has_order_photos(self):
+        response, data = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response["Content-Length"]), len(data))
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            self.assertEqual(zf.namelist(), ["img0.jpg", "img1.jpg"])
+
+    def test_range_resumes_download(self):
+        full, data = self._get()
+        response, part = self._get(HTTP_RANGE="bytes=100-", HTTP_IF_RANGE=full["ETag"])
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 100-{len(data) - 1}/{len(data)}")
+        self.assertEqual(part, data[100:])
+
+    def test_stale_if_range_returns_whole_archive(self):
+        _, data = self._get()
+        response, body = self._get(HTTP_RANGE="bytes=100-", HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, data)
+
+    def test_unsatisfiable_range(self):
+        response, _ = self._get(HTTP_RANGE="bytes=999999999-")
+        self.assertEqual(response.status_code, 416)
+
+    def test_whole_session_without_order(self):
+        url = f"/api/download/?download_code={self.session.download_code}"
+        response = APIClient().get(url)
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as zf:
+            self.assertEqual(zf.namelist(), ["img0.jpg", "img1.jpg", "img2.jpg"])
+
+    def test_order_of_another_session_is_not_downloadable(self):
+        other = PhotoSession.objects.create(
+            photographer=self.photographer, client_name="Другой", client_phone="2",
+        )
+        url = f"/api/download/?download_code={other.download_code}&order={self.order.id}"
+        self.assertEqual(APIClient().get(url).status_code, 404)
+
+    def test_waits_for_missing_crc32(self):
+        SessionPhoto.objects.filter(id=self.photos[0].id).update(crc32=None)
+        response, _ = self._get()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "60")
+
+        fill_missing_crc32(10)
+        self.assertEqual(self._get()[0].status_code, 200)
+
+    def test_missing_original_does_not_block_download(self):
+        os.remove(self.photos[0].original_image.path)
+        SessionPhoto.objects.filter(id=self.photos[0].id).update(crc32=None)
+        fill_missing_crc32(10)
+
+        response, data = self._get()
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            self.assertEqual(zf.namelist(), ["img1.jpg"])
+
+
+# ========== ОЧЕРЕДЬ ОБРАБОТКИ ==========
+
+def processed_photo(faces=()) -> ProcessedPhoto:
+    """
+    Результат process_photo_file() без face_recognition: настоящие
+    водяной знак, варианты и placeholder, лица – заданные.
+    """
+    with mock.patch("photostudio.utils._detect_faces", return_value=[]):
+        processed = _process_image(Image.new("RGB", (1200, 800), (90, 120, 150)), DEFAULT_WATERMARK_STYLE)
+    faces = [DetectedFace(location, encoding) for location, encoding in faces]
+    return processed._replace(faces=faces, face_locations=[face.location for face in faces])
+
+
+class PhotoJobQueueTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.photos = [self.add_photo(f"img{i}.jpg", processed=False) for i in range(3)]
+
+    def jobs(self):
+        return {job.photo_id: job for job in PhotoJob.objects.all()}
+
+    def test_claim_takes_pending_jobs_once(self):
+        first = claim_jobs(2)
+        self.assertEqual([job.photo_id for job in first], [p.id for p in self.photos[:2]])
+        self.assertEqual({job.status for job in first}, {PhotoJob.STATUS_RUNNING})
+        self.assertEqual({job.attempts for job in first}, {1})
+        self.assertEqual([job.photo_id for job in claim_jobs(2)], [self.photos[2].id])
+        self.assertEqual(claim_jobs(2), [])
+
+    def test_release_does_not_count_attempt(self):
+        release_jobs(claim_jobs(3))
+        self.assertEqual({(job.status, job.attempts) for job in self.jobs().values()}, {(PhotoJob.STATUS_PENDING, 0)})
+
+    def test_retried_jobs_are_claimed_one_by_one_until_failed(self):
+        with override_settings(PHOTO_JOB_MAX_ATTEMPTS=2):
+            retry_jobs(claim_jobs(3))
+            retried = claim_jobs(3)
+            self.assertEqual(len(retried), 1)
+            self.assertEqual(retried[0].attempts, 2)
+
+            self.assertEqual(retry_jobs(retried), (0, 1))
+            self.assertEqual(self.jobs()[retried[0].photo_id].status, PhotoJob.STATUS_FAILED)
+            self.assertEqual(len(claim_jobs(3)), 1)
+
+    def test_stale_running_jobs_are_requeued(self):
+        claimed = claim_jobs(3)
+        PhotoJob.objects.filter(id=claimed[0].id).update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=10)), (1, 0))
+        self.assertEqual(self.jobs()[claimed[0].photo_id].status, PhotoJob.STATUS_PENDING)
+
+    @mock.patch("photostudio.jobs.process_photo_file")
+    def test_process_jobs_stores_results(self, process):
+        encoding = np.full(PhotoFace.ENCODING_SIZE, 0.1)
+        process.side_effect = [
+            processed_photo([((100, 300, 300, 100), encoding)]),
+            ValueError("битый файл"),
+            processed_photo(),
+        ]
+        process_jobs(claim_jobs(3))
+
+        jobs = self.jobs()
+        self.assertEqual(jobs[self.photos[0].id].status, PhotoJob.STATUS_DONE)
+        self.assertEqual(jobs[self.photos[1].id].status, PhotoJob.STATUS_FAILED)
+        self.assertEqual(jobs[self.photos[1].id].error, "ValueError: битый файл")
+
+        photo = SessionPhoto.objects.get(id=self.photos[0].id)
+        self.assertTrue(os.path.exists(photo.watermarked_image.path))
+        self.assertEqual((photo.width, photo.height), (1200, 800))
+        self.assertTrue(photo.placeholder.startswith("data:image/jpeg;base64,"))
+        self.assertEqual(list(photo.faces.values_list("top", "right", "bottom", "left")), [(100, 300, 300, 100)])
+        self.assertTrue(photo.renditions.filter(name="preview").exists())
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.faces_version, 1)
+        index = IVFFaceIndex.load(FaceScope.for_session(self.session).path)
+        self.assertEqual(index.face_ids.tolist(), list(photo.faces.values_list("id", flat=True)))
+
+    @mock.patch("photostudio.jobs.process_photo_file")
+    def test_reprocessing_drops_old_faces_and_files(self, process):
+        photo = self.photos[0]
+        PhotoJob.objects.exclude(photo=photo).update(status=PhotoJob.STATUS_DONE)
+        process.return_value = processed_photo([((100, 300, 300, 100), np.zeros(PhotoFace.ENCODING_SIZE))])
+        process_jobs(claim_jobs(1))
+        photo.refresh_from_db()
+        old_files = [photo.watermarked_image.path] + [r.image.path for r in photo.renditions.all()]
+
+        # повторная обработка: лиц больше нет
+        PhotoJob.objects.filter(photo=photo).update(status=PhotoJob.STATUS_PENDING)
+        process.return_value = processed_photo()
+        process_jobs(claim_jobs(1))
+
+        photo.refresh_from_db()
+        self.assertFalse(photo.faces.exists())
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.faces_version, 2)
+        index = IVFFaceIndex.load(FaceScope.for_session(self.session).path)
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.version, FaceScope.for_session(self.session).version())
+
+        for path in old_files:
+            self.assertFalse(os.path.exists(path), path)
+        self.assertTrue(os.path.exists(photo.watermarked_image.path))
+        for rendition in photo.renditions.all():
+            self.assertTrue(os.path.exists(rendition.image.path))
+
+
+# ========== ЛЮДИ НА ФОТОСЕССИИ ==========
+
+def unit(i) -> np.ndarray:
+    vector = np.zeros(PhotoFace.ENCODING_SIZE, dtype=np.float32)
+    vector[i] = 1
+    return vector
+
+
+class FaceClusterTests(MediaTestCase):
+    """
+    Два человека по три фото (encoding'и у центров unit(0) и unit(1))
+    и случайное лицо на фоне – оно в кластер не попадает.
+    """
+    BOX = (10, 40, 40, 10)
+
+    def setUp(self):
+        super().setUp()
+        self.people = {0: [], 1: []}
+        for person in (0, 1):
+            for i in range(3):
+                photo = self.add_photo(f"p{person}_{i}.jpg")
+                self.add_face(photo, self.BOX, unit(person) + 0.05 * unit(10 + i))
+                self.people[person].append(photo.id)
+        self.stranger = self.add_photo("stranger.jpg")
+        self.add_face(self.stranger, self.BOX, unit(2))
+        PhotoSession.bump_faces_version([self.session.id])
+        self.session.refresh_from_db()
+
+    def test_edges_do_not_depend_on_chunk(self):
+        rng = np.random.default_rng(0)
+        vectors = (rng.random((500, 128)) * 0.05).astype(np.float32)
+        photo_ids = rng.integers(0, 200, 500)
+        src, dst = face_edges(vectors, photo_ids, 0.2, chunk=500)
+        with override_settings(FACE_CLUSTER_MEMORY_BYTES=50_000):
+            small_src, small_dst = face_edges(vectors, photo_ids, 0.2)
+        np.testing.assert_array_equal(src, small_src)
+        np.testing.assert_array_equal(dst, small_dst)
+        self.assertFalse(np.any(photo_ids[src] == photo_ids[dst]))
+
+    def test_chinese_whispers_separates_people(self):
+        rng = np.random.default_rng(0)
+        who = rng.integers(0, 20, 600)
+        centers = rng.random((20, 128)).astype(np.float32)
+        vectors = centers[who] + rng.normal(size=(600, 128)).astype(np.float32) * 0.01
+        labels = chinese_whispers(600, *face_edges(vectors, np.arange(600), 0.3))
+        self.assertEqual(len(np.unique(labels)), 20)
+        for label in np.unique(labels):
+            self.assertEqual(len(np.unique(who[labels == label])), 1)
+
+    def test_cluster_session(self):
+        self.assertEqual(cluster_session(self.session), 2)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.clusters_version, self.session.faces_version)
+
+        clusters = list(self.session.clusters.all())
+        self.assertEqual(sorted(c.photos_count for c in clusters), [3, 3])
+        members = sorted(sorted(c.faces.values_list("photo_id", flat=True)) for c in clusters)
+        self.assertEqual(members, [self.people[0], self.people[1]])
+        self.assertIsNone(self.stranger.faces.get().cluster_id)
+
+    def test_avatar_is_watermarked(self):
+        cluster_session(self.session)
+        cluster = self.session.clusters.select_related("representative__photo").first()
+        avatar = Image.open(cluster.image.path).convert("RGB")
+        plain = _face_image(cluster.representative.photo.original_image.path, self.BOX, avatar.width)
+        # средняя разница с вырезом без знака – не шум JPEG
+        difference = np.abs(np.asarray(avatar, dtype=np.int16) - np.asarray(plain.convert("RGB"), dtype=np.int16))
+        self.assertGreater(difference.mean(), 3)
+
+    def test_people_list(self):
+        cluster_session(self.session)
+        people = APIClient().get("/api/people/", {"view_code": self.session.view_code}).json()
+        self.assertEqual(sorted(p["photos_count"] for p in people), [3, 3])
+        self.assertTrue(all(p["image_url"] for p in people))
+
+    def test_search_clusters_keeps_threshold(self):
+        far = self.add_photo("far.jpg")
+        self.add_face(far, self.BOX, unit(0) + 0.4 * unit(20))
+        PhotoSession.bump_faces_version([self.session.id])
+        self.session.refresh_from_db()
+        cluster_session(self.session)
+
+        photo_ids, distances = search_clusters(self.session, [unit(0)], 0.3)[0]
+        self.assertEqual(sorted(photo_ids.tolist()), self.people[0])
+        self.assertTrue(np.all(distances <= 0.3))
+        self.assertIn(far.id, search_clusters(self.session, [unit(0)], 0.45)[0][0].tolist())
+
+    def test_stale_clusters_are_not_used(self):
+        cluster_session(self.session)
+        PhotoSession.bump_faces_version([self.session.id])
+        self.session.refresh_from_db()
+        self.assertEqual(search_clusters(self.session, [unit(0)], 0.3), [None])
+
+    def _search(self, threshold=0.3):
+        selfie = SimpleUploadedFile("selfie.jpg", jpeg_bytes(), "image/jpeg")
+        return APIClient().post(
+            f"/api/search-by-face/?view_code={self.session.view_code}&threshold={threshold}",
+            {"image": selfie},
+            format="multipart",
+        ).json()
+
+    @mock.patch("photostudio.views.extract_selfie_encodings", return_value=[unit(0)])
+    def test_face_search_merges_people_and_caches_by_clusters_version(self, extract):
+        with mock.patch("photostudio.views.search_clusters", wraps=search_clusters) as people:
+            before = self._search()
+            self._search()
+            self.assertEqual(people.call_count, 1)
+
+            # кластеры появились – закэшированный результат без них не годится
+            cluster_session(self.session)
+            after = self._search()
+            self.assertEqual(people.call_count, 2)
+
+        for data in (before, after):
+            self.assertEqual(sorted(m["photo_id"] for m in data["matches"]), self.people[0])
+            self.assertTrue(all(m["distance"] <= 0.3 for m in data["matches"]))
+
+
+# ========== ИНДЕКС ЛИЦ ==========
+
+def random_faces(n, start_id=1, seed=0):
+    rng = np.random.default_rng(seed)
+    face_ids = np.arange(start_id, start_id + n, dtype=np.int64)
+    photo_ids = face_ids // 2
+    vectors = rng.random((n, 128), dtype=np.float32) * 0.2
+    return face_ids, photo_ids, vectors
+
+
+def brute_force(face_ids, photo_ids, vectors, query, threshold):
+    distances = np.linalg.norm(vectors - query, axis=1)
+    best = {}
+    for photo_id, distance in zip(photo_ids[distances <= threshold], distances[distances <= threshold]):
+        best[int(photo_id)] = min(best.get(int(photo_id), np.inf), float(distance))
+    return best
+
+
+@override_settings(FACE_ANN_MIN_FACES=100)
+class IVFFaceIndexTests(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        self.face_ids, self.photo_ids, self.vectors = random_faces(400)
+        self.index = IVFFaceIndex.build("v1", self.face_ids, self.photo_ids, self.vectors)
+
+    def assertSearchEqual(self, result, expected):
+        photo_ids, distances = result
+        self.assertEqual(photo_ids.tolist(), sorted(expected))
+        # search_many считает через ||x||² - 2x·q + ||q||² – погрешность float32
+        np.testing.assert_allclose(distances, [expected[i] for i in sorted(expected)], atol=1e-3)
+
+    def assertListsConsistent(self, index):
+        for i in range(len(index.centroids)):
+            rows = index.vectors[index.offsets[i]:index.offsets[i + 1]]
+            self.assertTrue(np.all(_nearest_centroid(rows, index.centroids) == i))
+
+    def test_build_splits_into_lists(self):
+        self.assertEqual(len(self.index.centroids), 20)
+        self.assertEqual(self.index.offsets[-1], 400)
+        self.assertListsConsistent(self.index)
+
+    def test_save_load_roundtrip(self):
+        path = os.path.join(self.dir, "session_1.idx")
+        self.index.save(path)
+        loaded = IVFFaceIndex.load(path)
+
+        # массивы – окна в memmap файла, а не копии в памяти
+        self.assertIsInstance(loaded.vectors.base, np.memmap)
+        self.assertFalse(loaded.vectors.flags.writeable)
+        self.assertEqual(loaded.version, "v1")
+        self.assertEqual(loaded.trained_size, 400)
+        for name in ("centroids", "offsets", "face_ids", "photo_ids", "vectors"):
+            np.testing.assert_array_equal(getattr(loaded, name), getattr(self.index, name))
+
+        query = self.vectors[7]
+        loaded_ids, loaded_distances = loaded.search(query, 0.3, nprobe=20)
+        ids, distances = self.index.search(query, 0.3, nprobe=20)
+        np.testing.assert_array_equal(loaded_ids, ids)
+        np.testing.assert_array_equal(loaded_distances, distances)
+
+    def test_load_missing_or_foreign_file(self):
+        self.assertIsNone(IVFFaceIndex.load(os.path.join(self.dir, "missing.idx")))
+        path = os.path.join(self.dir, "foreign.idx")
+        with open(path, "wb") as f:
+            f.write(b"NOPE" + b"\0" * 200)
+        self.assertIsNone(IVFFaceIndex.load(path))
+
+    def test_exhaustive_search_matches_brute_force(self):
+        for query in self.vectors[:5]:
+            self.assertSearchEqual(
+                self.index.search(query, 0.35, nprobe=20),
+                brute_force(self.face_ids, self.photo_ids, self.vectors, query, 0.35),
+            )
+        results = self.index.search_many(self.vectors[:3], 0.35, nprobe=20)
+        for query, result in zip(self.vectors[:3], results):
+            self.assertSearchEqual(result, brute_force(self.face_ids, self.photo_ids, self.vectors, query, 0.35))
+
+    def test_updated_adds_and_removes_faces_without_retraining(self):
+        new_ids, new_photo_ids, new_vectors = random_faces(100, start_id=1000, seed=1)
+        current = np.concatenate([self.face_ids[50:], new_ids])
+        loaded = []
+
+        def load_faces(ids):
+            loaded.append(np.sort(ids).tolist())
+            rows = np.searchsorted(new_ids, ids)
+            return new_ids[rows], new_photo_ids[rows], new_vectors[rows]
+
+        updated = self.index.updated("v2", current, load_faces)
+
+        self.assertEqual(loaded, [new_ids.tolist()])
+        self.assertEqual(updated.version, "v2")
+        self.assertIs(updated.centroids, self.index.centroids)
+        self.assertEqual(updated.trained_size, 400)
+        self.assertEqual(sorted(updated.face_ids.tolist()), sorted(current.tolist()))
+        self.assertListsConsistent(updated)
+
+        all_ids = np.concatenate([self.face_ids, new_ids])
+        all_photo_ids = np.concatenate([self.photo_ids, new_photo_ids])
+        all_vectors = np.concatenate([self.vectors, new_vectors])
+        keep = np.isin(all_ids, current)
+        for query in (self.vectors[60], new_vectors[3]):
+            self.assertSearchEqual(
+                updated.search(query, 0.35, nprobe=20),
+                brute_force(all_ids[keep], all_photo_ids[keep], all_vectors[keep], query, 0.35),
+            )
+
+    def test_updated_retrains_when_size_doubles(self):
+        new_ids, new_photo_ids, new_vectors = random_faces(500, start_id=1000, seed=1)
+        updated = self.index.updated(
+            "v2",
+            np.concatenate([self.face_ids, new_ids]),
+            lambda ids: (new_ids, new_photo_ids, new_vectors),
+        )
+        self.assertEqual(updated.trained_size, 900)
+        self.assertEqual(len(updated.centroids), 30)
+        self.assertListsConsistent(updated)
+
+
+class FaceScopeSearchTests(MediaTestCase):
+    """
+    Поиск по альбому и по всем сессиям фотографа – одним индексом области.
+    Индекс – файл в FACE_INDEX_DIR: процессы открывают его через memmap,
+    а не собирают заново из БД.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.album = Album.objects.create(photographer=self.photographer, name="Школа")
+        self.other = PhotoSession.objects.create(
+            photographer=self.photographer, client_name="Другой", client_phone="2",
+        )
+        PhotoSession.objects.filter(id__in=[self.session.id, self.other.id]).update(album=self.album)
+        self.photos = []
+        for session in (self.session, self.other):
+            photo = self.add_photo(f"kid{session.id}.jpg", session=session)
+            self.add_face(photo, encoding=unit(0))
+            self.photos.append(photo.id)
+        PhotoSession.bump_faces_version([self.session.id, self.other.id])
+
+    def search(self, query, client=None):
+        return (client or APIClient()).post(
+            f"/api/search-by-face/?{query}",
+            {"image": SimpleUploadedFile("selfie.jpg", jpeg_bytes(), "image/jpeg")},
+            format="multipart",
+        )
+
+    @mock.patch("photostudio.views.extract_selfie_encodings", return_value=[unit(0)])
+    def test_album_search_covers_all_sessions(self, _):
+        data = self.search(f"album_code={self.album.view_code}").json()
+        self.assertEqual(sorted(m["photo_id"] for m in data["matches"]), sorted(self.photos))
+        self.assertTrue(os.path.exists(FaceScope("album", self.album.id).path))
+
+    @mock.patch("photostudio.views.extract_selfie_encodings", return_value=[unit(0)])
+    def test_photographer_scope_needs_photographer(self, _):
+        self.assertEqual(self.search("scope=photographer").status_code, 403)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        data = self.search("scope=photographer", client).json()
+        self.assertEqual(sorted(m["photo_id"] for m in data["matches"]), sorted(self.photos))
+
+    def test_index_is_reused_from_disk(self):
+        scope = FaceScope("album", self.album.id)
+        built = get_scope_index(scope)
+        self.assertIsInstance(built.vectors.base, np.memmap)
+
+        # другой процесс: в памяти пусто, файл уже есть
+        _scope_indexes.clear()
+        with mock.patch("photostudio.faceindex._load_faces") as load_faces:
+            loaded = get_scope_index(scope)
+        load_faces.assert_not_called()
+        self.assertEqual(loaded.version, built.version)
+        self.assertEqual(sorted(loaded.photo_ids.tolist()), sorted(self.photos))
+
+    def test_album_index_waits_for_drained_queue(self):
+        scope = FaceScope("album", self.album.id)
+        published = refresh_scope_index(scope).version
+
+        # в сессии идёт загрузка: появилось лицо, фото ещё в очереди
+        photo = self.add_photo("new.jpg", processed=False)
+        self.add_face(photo, encoding=unit(0))
+        PhotoSession.bump_faces_version([self.session.id])
+        refresh_scope_indexes([self.session.id])
+
+        self.assertEqual(IVFFaceIndex.load(scope.path).version, published)
+        self.assertEqual(scope.search_version(), published)
+        session_index = IVFFaceIndex.load(FaceScope.for_session(self.session).path)
+        self.assertIn(photo.id, session_index.photo_ids.tolist())
+
+        # очередь разобрана – переписываем и индекс альбома
+        PhotoJob.objects.filter(photo=photo).update(status=PhotoJob.STATUS_DONE)
+        refresh_scope_indexes([self.session.id], drained_ids=[self.session.id])
+        self.assertEqual(IVFFaceIndex.load(scope.path).version, scope.version())
+        self.assertNotEqual(scope.search_version(), published)
+
+
+# ========== ПОИСК ПО ЛИЦУ ==========
+
+class SelfieCacheTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.photo = self.add_photo("kid.jpg")
+        self.add_face(self.photo, encoding=unit(0))
+        PhotoSession.bump_faces_version([self.session.id])
+
+    def search(self):
+        return APIClient().post(
+            f"/api/search-by-face/?view_code={self.session.view_code}",
+            {"image": SimpleUploadedFile("selfie.jpg", jpeg_bytes(), "image/jpeg")},
+            format="multipart",
+        )
+
+    def test_encodings_are_extracted_once_per_selfie(self):
+        extract = mock.Mock(return_value=[unit(0)])
+        for _ in range(2):
+            encodings = get_selfie_encodings("digest", extract)
+        self.assertEqual(extract.call_count, 1)
+        np.testing.assert_array_equal(encodings, [unit(0)])
+
+        # «лиц нет» тоже кэшируется, all_faces – отдельный ключ
+        empty = mock.Mock(return_value=[])
+        for _ in range(2):
+            encodings = get_selfie_encodings("digest", empty, all_faces=True)
+        self.assertEqual(encodings.shape, (0, PhotoFace.ENCODING_SIZE))
+        self.assertEqual(empty.call_count, 1)
+
+    def test_cached_result_is_keyed_by_version(self):
+        scope = FaceScope.for_session(self.session)
+        set_cached_result(scope, "v1", "q", 0.5, "result")
+        self.assertEqual(get_cached_result(scope, "v1", "q", 0.5), "result")
+        self.assertIsNone(get_cached_result(scope, "v2", "q", 0.5))
+        self.assertIsNone(get_cached_result(scope, "v1", "q", 0.4))
+
+    @mock.patch("photostudio.views.extract_selfie_encodings", return_value=[unit(0)])
+    def test_repeat_search_uses_cache_until_faces_change(self, extract):
+        with mock.patch("photostudio.views.get_scope_index", wraps=get_scope_index) as index:
+            first = self.search().json()
+            self.assertEqual(self.search().json(), first)
+            self.assertEqual((extract.call_count, index.call_count), (1, 1))
+
+            # новое лицо – новая версия сессии, старый результат не годится
+            other = self.add_photo("other.jpg")
+            self.add_face(other, encoding=unit(0))
+            PhotoSession.bump_faces_version([self.session.id])
+            second = self.search().json()
+            self.assertEqual((extract.call_count, index.call_count), (1, 2))
+
+        self.assertEqual([m["photo_id"] for m in first["matches"]], [self.photo.id])
+        self.assertEqual(sorted(m["photo_id"] for m in second["matches"]), [self.photo.id, other.id])
+
+    @mock.patch("photostudio.views.extract_selfie_encodings", return_value=[])
+    def test_selfie_without_face_is_not_reprocessed(self, extract):
+        for _ in range(2):
+            self.assertEqual(self.search().status_code, 400)
+        self.assertEqual(extract.call_count, 1)
+
+
+class FaceSearchCursorTests(MediaTestCase):
+
+    def test_cursor_roundtrip_is_exact(self):
+        distance = np.float32(0.123456789)
+        self.assertEqual(decode_cursor(encode_cursor(distance, 42)), (float(distance), 42))
+
+    def test_garbage_cursor(self):
+        for cursor in ("", "!!!", "bm9wZQ"):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+    def test_pages_cover_all_matches_once_in_order(self):
+        photo_ids = np.array([5, 3, 9, 1, 7, 2, 8, 4, 6], dtype=np.int64)
+        distances = np.array([0.2, 0.1, 0.2, 0.3, 0.1, 0.2, 0.05, 0.3, 0.2], dtype=np.float32)
+        expected = np.lexsort((photo_ids, distances))
+
+        seen, after = [], None
+        while True:
+            page_ids, page_distances, has_more = rank_page(photo_ids, distances, 2, after)
+            seen += page_ids.tolist()
+            if not has_more:
+                break
+            after = decode_cursor(encode_cursor(page_distances[-1], page_ids[-1]))
+
+        self.assertEqual(seen, photo_ids[expected].tolist())
+
+    @mock.patch("photostudio.views.extract_selfie_encodings", return_value=[unit(0)])
+    def test_search_pages_by_threshold(self, _):
+        # лицо на расстоянии d от селфи unit(0)
+        by_distance = {}
+        for d in (0.3, 0.1, 0.5, 0.2, 0.7):
+            photo = self.add_photo(f"d{d}.jpg")
+            self.add_face(photo, encoding=unit(0) + d * unit(1))
+            by_distance[d] = photo.id
+        PhotoSession.bump_faces_version([self.session.id])
+
+        def search(**params):
+            query = "&".join(f"{k}={v}" for k, v in params.items())
+            return APIClient().post(
+                f"/api/search-by-face/?view_code={self.session.view_code}&{query}",
+                {"image": SimpleUploadedFile("selfie.jpg", jpeg_bytes(), "image/jpeg")},
+                format="multipart",
+            )
+
+        first = search(threshold=0.4, limit=2).json()
+        self.assertEqual(first["total"], 3)
+        self.assertEqual([m["photo_id"] for m in first["matches"]], [by_distance[0.1], by_distance[0.2]])
+        second = search(threshold=0.4, limit=2, cursor=first["next_cursor"]).json()
+        self.assertEqual([m["photo_id"] for m in second["matches"]], [by_distance[0.3]])
+        self.assertIsNone(second["next_cursor"])
+
+        for params in ({"threshold": 0}, {"threshold": 2}, {"limit": 0}, {"cursor": "!!!"}):
+            self.assertEqual(search(**params).status_code, 400, params)
+
+
+# ========== ГАЛЕРЕЯ ==========
+
+class GalleryCacheTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.add_photo("img0.jpg")
+        self.session.refresh_from_db()
+        self.url = f"/api/photos/?view_code={self.session.view_code}"
+
+    def test_not_modified_repeats_etag(self):
+        etag = APIClient().get(self.url)["ETag"]
+        response = APIClient().get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_repeat_request_is_served_from_cache(self):
+        first = APIClient().get(self.url)
+        # из кэша: только версия сессии, без фото и вариантов
+        with self.assertNumQueries(1):
+            second = APIClient().get(self.url)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertEqual(second.content, first.content)
+
+    def test_new_photo_changes_etag(self):
+        first = APIClient().get(self.url)
+        photo = self.add_photo("img1.jpg")
+        response = APIClient().get(self.url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], first["ETag"])
+        self.assertIn(photo.id, [p["id"] for p in response.json()["photos"]])
+
+    def test_service_change_invalidates_services(self):
+        url = f"/api/services/?view_code={self.session.view_code}"
+        first = APIClient().get(url)
+        self.assertEqual(first.json(), [])
+        Service.objects.create(photographer=self.photographer, name="Печать", price=100)
+        response = APIClient().get(url)
+        self.assertNotEqual(response["ETag"], first["ETag"])
+        self.assertEqual([s["name"] for s in response.json()], ["Печать"])
+
+    def test_session_save_keeps_bumped_versions(self):
+        stale = PhotoSession.objects.get(id=self.session.id)
+        PhotoSession.bump_content_version([self.session.id])
+        PhotoSession.bump_faces_version([self.session.id])
+        bumped = PhotoSession.objects.get(id=self.session.id)
+
+        # save() устаревшего экземпляра не откатывает версии назад
+        stale.client_name = "Новое имя"
+        stale.save()
+        stale.refresh_from_db()
+        self.assertEqual(stale.faces_version, bumped.faces_version)
+        self.assertEqual(stale.content_version, bumped.content_version + 1)
+
+
+class GalleryLayoutTests(MediaTestCase):
+
+    def test_dimensions_follow_exif_rotation(self):
+        buf = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: повернуть на 90° по часовой
+        Image.new("RGB", (1200, 800), (90, 120, 150)).save(buf, "JPEG", exif=exif)
+        path = os.path.join(self.media, "rotated.jpg")
+        with open(path, "wb") as f:
+            f.write(buf.getvalue())
+
+        with mock.patch("photostudio.utils._ensure_face_libs_loaded"), \
+                mock.patch("photostudio.utils._detect_faces", return_value=[]):
+            processed = process_photo_file(path)
+        self.assertEqual((processed.width, processed.height), (800, 1200))
+
+    def test_placeholder_is_tiny_jpeg(self):
+        placeholder = processed_photo().placeholder
+        prefix = "data:image/jpeg;base64,"
+        self.assertTrue(placeholder.startswith(prefix))
+        data = base64.b64decode(placeholder[len(prefix):])
+        self.assertLess(len(data), 1024)
+        with Image.open(io.BytesIO(data)) as img:
+            self.assertEqual(max(img.size), 16)
+
+    @mock.patch("photostudio.jobs.process_photo_file")
+    def test_gallery_has_layout_fields(self, process):
+        old = self.add_photo("old.jpg")
+        self.add_photo("new.jpg", processed=False)
+        process.return_value = processed_photo()
+        process_jobs(claim_jobs(1))
+
+        photos = APIClient().get(f"/api/photos/?view_code={self.session.view_code}").json()["photos"]
+        layout = [(p["width"], p["height"], p["orientation"], bool(p["placeholder"])) for p in photos]
+        # фото, обработанное до появления размеров, – без раскладки
+        self.assertEqual(photos[0]["id"], old.id)
+        self.assertEqual(layout, [(None, None, None, False), (1200, 800, "landscape", True)])
+
+        # статический манифест несёт те же поля раскладки
+        write_manifest(self.session)
+        with open(manifest_path(self.session), encoding="utf-8") as f:
+            manifest = json.load(f)
+        fields = ("width", "height", "orientation", "placeholder")
+        self.assertEqual(
+            [{k: p[k] for k in fields} for p in manifest["photos"]],
+            [{k: p[k] for k in fields} for p in photos],
+        )
+
+
+class SessionPhotoListCursorTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.photos = [self.add_photo(f"img{i}.jpg") for i in range(5)]
+        self.add_photo("pending.jpg", processed=False)
+        # три фото с одинаковым uploaded_at – порядок между ними по id
+        now = timezone.now()
+        times = [now, now - timedelta(minutes=1), now - timedelta(minutes=1), now - timedelta(minutes=1), now]
+        for photo, uploaded_at in zip(self.photos, times):
+            SessionPhoto.objects.filter(id=photo.id).update(uploaded_at=uploaded_at)
+        self.expected = [
+            photo.id for photo, _ in sorted(zip(self.photos, times), key=lambda p: (p[1], p[0].id))
+        ]
+
+    def test_pages_cover_all_photos_once_in_order(self):
+        client = APIClient()
+        seen, cursor = [], None
+        while True:
+            params = {"view_code": self.session.view_code, "limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            data = client.get("/api/photos/", params).json()
+            self.assertLessEqual(len(data["photos"]), 2)
+            seen += [photo["id"] for photo in data["photos"]]
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, self.expected)
+
+    def test_bad_cursor(self):
+        response = APIClient().get("/api/photos/", {"view_code": self.session.view_code, "cursor": "!!!"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_bad_limit(self):
+        for limit in ("0", "501", "x"):
+            response = APIClient().get("/api/photos/", {"view_code": self.session.view_code, "limit": limit})
+            self.assertEqual(response.status_code, 400, limit)
+
+    def test_queries_do_not_grow_with_page_size(self):
+        PhotoRendition.objects.bulk_create(
+            PhotoRendition(photo=photo, name="thumb", format="JPEG", width=320, height=240,
+                           image=f"photos/renditions/thumb{photo.id}.jpg")
+            for photo in self.photos
+        )
+        counts = []
+        for limit in (1, 5):
+            with CaptureQueriesContext(connection) as queries:
+                APIClient().get("/api/photos/", {"view_code": self.session.view_code, "limit": limit})
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+class ManifestTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.photos = [self.add_photo(f"img{i}.jpg") for i in range(2)]
+        self.session.refresh_from_db()
+        self.path = manifest_path(self.session)
+
+    def read(self):
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def test_full_manifest_has_only_visible_photos(self):
+        hidden = self.add_photo("pending.jpg", processed=False)
+        write_manifest(self.session)
+
+        manifest = self.read()
+        self.assertEqual(manifest["format"], MANIFEST_FORMAT)
+        self.assertEqual(manifest["session"], {
+            "id": self.session.id,
+            "client_name": "Клиент",
+            "view_code": self.session.view_code,
+        })
+        self.assertNotIn(self.session.download_code, json.dumps(manifest))
+        self.assertEqual([p["id"] for p in manifest["photos"]], [p.id for p in self.photos])
+        self.assertNotIn(hidden.id, [p["id"] for p in manifest["photos"]])
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o644)
+
+    def test_incremental_update_keeps_order(self):
+        write_manifest(self.session)
+        photo = self.add_photo("img2.jpg")
+        write_manifest(self.session, added=[photo.id], removed=[self.photos[0].id])
+        self.assertEqual([p["id"] for p in self.read()["photos"]], [self.photos[1].id, photo.id])
+
+    def test_old_format_is_rebuilt(self):
+        write_manifest(self.session)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"format": MANIFEST_FORMAT - 1, "photos": []}, f)
+        write_manifest(self.session, added=[self.photos[1].id])
+        self.assertEqual([p["id"] for p in self.read()["photos"]], [p.id for p in self.photos])
+
+    def test_deleted_photo_leaves_manifest_after_commit(self):
+        write_manifest(self.session)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.photos[0].delete()
+        self.assertEqual([p["id"] for p in self.read()["photos"]], [self.photos[1].id])
+
+    def test_session_rename_rebuilds_manifest(self):
+        write_manifest(self.session)
+        self.session.client_name = "Новое имя"
+        self.session.save()
+        manifest = self.read()
+        self.assertEqual(manifest["session"]["client_name"], "Новое имя")
+        self.assertEqual({p["client_name"] for p in manifest["photos"]}, {"Новое имя"})
+
+    def test_write_holds_lock(self):
+        # flock – на открытый файл: второй open() того же .lock конфликтует
+        # с блокировкой write_manifest даже внутри одного процесса
+        def build(*args):
+            with open(self.path + ".lock", "a") as lock:
+                with self.assertRaises(BlockingIOError):
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return build_manifest(*args)
+
+        with mock.patch("photostudio.manifests._build", side_effect=build) as patched:
+            write_manifest(self.session)
+        self.assertEqual(patched.call_count, 1)
+        self.assertEqual(len(self.read()["photos"]), 2)
+
+    def test_view_writes_missing_manifest(self):
+        response = APIClient().get(f"/api/photos/manifest/?view_code={self.session.view_code}")
+        self.assertEqual(response.status_code, 200)
+        manifest = json.loads(b"".join(response.streaming_content))
+        self.assertEqual([p["id"] for p in manifest["photos"]], [p.id for p in self.photos])
+        self.assertTrue(os.path.exists(self.path))
+
+        # теперь и в /api/photos/ есть ссылка на файл
+        data = APIClient().get(f"/api/photos/?view_code={self.session.view_code}").json()
+        self.assertTrue(data["manifest_url"].endswith(f"manifests/{self.session.view_code}.json"))
@@ -0,0 +1,39 @@
+import hashlib
+import os
+import zlib
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+
+class HashingTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Каждый загружаемый файл сразу пишется кусками во временный файл
+    (FILE_UPLOAD_TEMP_DIR) – в памяти держится только текущий chunk.
+    По пути считаются sha256 и CRC32 (для ZIP-архивов), они доступны
+    как `uploaded_file.sha256` и `uploaded_file.crc32`.
+
+    FILE_UPLOAD_TEMP_DIR лежит на том же томе, что и MEDIA_ROOT,
+    поэтому FileSystemStorage переносит файл на место через rename,
+    без повторного копирования.
+    """
+
+    def new_file(self, *args, **kwargs):
+        # том MEDIA_ROOT монтируется пустым – каталог заводим здесь,
+        # а не при импорте settings
+        if settings.FILE_UPLOAD_TEMP_DIR:
+            os.makedirs(settings.FILE_UPLOAD_TEMP_DIR, exist_ok=True)
+        super().new_file(*args, **kwargs)
+        self._sha256 = hashlib.sha256()
+        self._crc32 = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self._sha256.update(raw_data)
+        self._crc32 = zlib.crc32(raw_data, self._crc32)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self._sha256.hexdigest()
+        file.crc32 = self._crc32
+        return file
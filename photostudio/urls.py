@@ -6,9 +6,14 @@ from .views import (
     login_view,
     PhotoSessionViewSet,
     SessionPhotoBulkUploadView,
+    SessionPhotoStatusView,
     FaceSearchView,
+    PeopleListView,
     PhotoOrderCreateView,
+    SessionDownloadView,
     SessionPhotoListView, 
+    SessionManifestView,
+    PhotoRenderView,
     ServiceListView, 
     dashboard_view, 
     dashboard_export_xlsx
@@ -32,14 +37,24 @@ urlpatterns = [
         SessionPhotoBulkUploadView.as_view(),
         name="session-photo-bulk-upload",
     ),
+    path(
+        "sessions/<int:session_id>/photos/status/",
+        SessionPhotoStatusView.as_view(),
+        name="session-photo-status",
+    ),
     
     path("services/", ServiceListView.as_view(), name="service-list"),
 
     # поиск по лицу
     path("search-by-face/", FaceSearchView.as_view(), name="face-search"),
+    path("people/", PeopleListView.as_view(), name="people-list"),
 
     # заказ после оплаты
     path("orders/", PhotoOrderCreateView.as_view(), name="orders-create"),
+    # оригиналы оплаченного заказа одним ZIP (download_code + order)
+    path("download/", SessionDownloadView.as_view(), name="session-download"),
     path("photos/", SessionPhotoListView.as_view(), name="photos-list"),
+    path("photos/manifest/", SessionManifestView.as_view(), name="photos-manifest"),
+    path("photos/<int:photo_id>/render/", PhotoRenderView.as_view(), name="photo-render"),
 
 ]
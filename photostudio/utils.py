@@ -1,6 +1,11 @@
+import base64
+import hashlib
 import io
 import math
-from typing import Optional, List
+import os
+import tempfile
+from functools import lru_cache
+from typing import Optional, List, NamedTuple, Tuple
 
 from PIL import (
     Image,
@@ -8,30 +13,71 @@ from PIL import (
     ImageDraw,
     ImageFont,
     UnidentifiedImageError,
+    features,
 )
 from django.conf import settings
 
+from .cache import LRUCache
+
 # Ленивая инициализация – сначала None,
 # позже загрузим внутри функции.
 np = None
 face_recognition = None
 
 
-def _load_image_safely(file_bytes: bytes) -> Image.Image:
+def _load_image_safely(source, draft_size: Optional[Tuple[int, int]] = None) -> Image.Image:
     """
     Приводим картинку к нормальному RGB и учитываем EXIF-поворот.
+    source – bytes, путь к файлу или открытый файл. С диска Pillow
+    читает файл кусками, сжатый JPEG целиком в память не попадает.
+
+    draft_size – если полное разрешение не нужно: JPEG сразу
+    декодируется в уменьшенном (1/2, 1/4, 1/8) масштабе, но не меньше
+    draft_size.
     """
-    img = Image.open(io.BytesIO(file_bytes))
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+
+    img = Image.open(source)
+
+    if draft_size:
+        img.draft("RGB", draft_size)
 
     try:
-        img = ImageOps.exif_transpose(img)
+        # in_place – без лишней полноразмерной копии, если поворачивать не нужно
+        ImageOps.exif_transpose(img, in_place=True)
     except Exception:
         pass
 
-    img = img.convert("RGB")
+    if img.mode != "RGB":
+        img = img.convert("RGB")
     return img
 
 
+def check_image_header(file, max_pixels: Optional[int] = None) -> None:
+    """
+    Быстрая проверка, что файл – картинка: читается только заголовок,
+    пиксели не декодируются. Позиция в файле возвращается в начало.
+    Не картинка или больше max_pixels пикселей -> ValueError.
+    """
+    try:
+        with Image.open(file) as img:
+            width, height = img.size
+    except (UnidentifiedImageError, OSError):
+        raise ValueError("Файл не является изображением")
+    finally:
+        file.seek(0)
+
+    if max_pixels and width * height > max_pixels:
+        raise ValueError("Слишком большое изображение")
+
+
+class FaceLibsMissing(RuntimeError):
+    """
+    Не установлены face_recognition / numpy – проблема окружения, а не фото.
+    """
+
+
 def _ensure_face_libs_loaded():
     """
     Ленивая загрузка numpy и face_recognition.
@@ -47,7 +93,7 @@ def _ensure_face_libs_loaded():
         import face_recognition as _fr
     except BaseException:
         # BaseException, чтобы словить даже sys.exit() внутри face_recognition
-        raise RuntimeError(
+        raise FaceLibsMissing(
             "Библиотеки 'face_recognition', 'face_recognition_models' и 'numpy' "
             "обязательны для работы распознавания по лицу. "
             "Установи их в виртуальное окружение."
@@ -57,171 +103,581 @@ def _ensure_face_libs_loaded():
     face_recognition = _fr
 
 
-def extract_face_encoding_from_file(file) -> Optional[List[float]]:
+def _detection_factor(size: Tuple[int, int], max_side: Optional[int]) -> int:
+    """
+    Во сколько раз (целое) уменьшить картинку, чтобы длинная сторона
+    стала не больше max_side. 0/None – без уменьшения.
     """
-    Основная функция распознавания:
+    if not max_side:
+        return 1
+    return max(1, math.ceil(max(size) / float(max_side)))
 
-    - Если нет нужных библиотек -> RuntimeError (так как это обязательный функционал).
-    - Если лицо не найдено или файл битый -> возвращаем None.
+
+def _detect_faces(
+    img: Image.Image,
+    max_side: Optional[int] = None,
+    upsample: Optional[int] = None,
+) -> List[Tuple[int, int, int, int]]:
     """
-    # Ленивая загрузка библиотек
-    _ensure_face_libs_loaded()
+    Один проход HOG-детектора по уже декодированной картинке.
 
-    try:
-        data = file.read()
-        img = _load_image_safely(data)
-
-        # конвертируем в numpy-массив
-        arr = np.array(img, dtype=np.uint8)
-        arr = np.ascontiguousarray(arr)
-
-        # ищем лицо
-        locations = face_recognition.face_locations(
-            arr,
-            number_of_times_to_upsample=1,
-            model="hog",
+    Стоимость HOG растёт с числом пикселей, поэтому лица ищем на копии,
+    уменьшенной Image.reduce() до FACE_DETECTION_MAX_SIDE по длинной
+    стороне, а рамки (top, right, bottom, left) возвращаем уже
+    в координатах исходного img.
+    """
+    if max_side is None:
+        max_side = getattr(settings, "FACE_DETECTION_MAX_SIDE", 1600)
+    if upsample is None:
+        upsample = getattr(settings, "FACE_DETECTION_UPSAMPLE", 1)
+
+    factor = _detection_factor(img.size, max_side)
+    small = img.reduce(factor) if factor > 1 else img
+
+    arr = np.array(small, dtype=np.uint8)
+    arr = np.ascontiguousarray(arr)
+
+    locations = face_recognition.face_locations(
+        arr,
+        number_of_times_to_upsample=upsample,
+        model="hog",
+    )
+
+    width, height = img.size
+    return [
+        (
+            max(top * factor, 0),
+            min(right * factor, width),
+            min(bottom * factor, height),
+            max(left * factor, 0),
         )
-        if not locations:
-            return None
+        for (top, right, bottom, left) in locations
+    ]
 
-        encodings = face_recognition.face_encodings(arr, known_face_locations=locations)
-        if not encodings:
-            return None
 
-        return encodings[0].tolist()
+class DetectedFace(NamedTuple):
+    location: Tuple[int, int, int, int]  # (top, right, bottom, left)
+    encoding: List[float]
 
-    except UnidentifiedImageError:
-        # не удалось распознать файл как изображение
-        return None
-    except Exception:
-        # любая другая ошибка – не роняем проект, просто нет encoding
-        return None
 
+def _encode_faces(
+    img: Image.Image,
+    locations: List[Tuple[int, int, int, int]],
+) -> List[DetectedFace]:
+    """
+    Encoding лиц по уже известным рамкам (без повторного поиска лиц).
+    В numpy переводится не весь кадр, а только вырез вокруг каждого лица
+    в полном разрешении – этого достаточно для landmarks и face chip.
+    Лица, для которых encoding не посчитался, пропускаются.
+    """
+    width, height = img.size
+    result = []
+
+    for (top, right, bottom, left) in locations:
+        margin = max(bottom - top, right - left) // 2
+        cx0 = max(left - margin, 0)
+        cy0 = max(top - margin, 0)
+        cx1 = min(right + margin, width)
+        cy1 = min(bottom + margin, height)
+
+        crop = np.ascontiguousarray(
+            np.array(img.crop((cx0, cy0, cx1, cy1)), dtype=np.uint8)
+        )
+        box = (top - cy0, right - cx0, bottom - cy0, left - cx0)
+
+        encodings = face_recognition.face_encodings(crop, known_face_locations=[box])
+        if encodings:
+            result.append(DetectedFace(
+                location=(int(top), int(right), int(bottom), int(left)),
+                encoding=encodings[0].tolist(),
+            ))
 
-def face_distance(enc1: List[float], enc2: List[float]) -> float:
+    return result
+
+
+def _box_area(location) -> int:
+    top, right, bottom, left = location
+    return (bottom - top) * (right - left)
+
+
+def extract_selfie_encodings(data: bytes, all_faces: bool = False) -> List[List[float]]:
     """
-    Евклидово расстояние между двумя embedding'ами.
-    Работает даже без numpy (чистый Python).
+    Encoding'и для поиска по селфи.
+
+    На селфи почти всегда одно крупное лицо, поэтому:
+    - JPEG сразу декодируется уменьшенным (draft), а HOG идёт по копии
+      не больше SELFIE_MAX_SIDE по длинной стороне;
+    - сначала без upsample, и только если лицо не нашлось – с upsample=1
+      (мелкие лица);
+    - лица идут от крупного к мелкому; без all_faces берём только самое
+      крупное, с all_faces – все (несколько детей на одном фото).
+
+    Лица нет / файл битый -> [], нет библиотек -> RuntimeError.
     """
-    global np
+    _ensure_face_libs_loaded()
 
-    if np is None:
-        try:
-            import numpy as _np
-            np = _np
-        except BaseException:
-            np = None
+    max_side = getattr(settings, "SELFIE_MAX_SIDE", 800)
+    try:
+        img = _load_image_safely(data, draft_size=(max_side, max_side))
 
-    if np is not None:
-        a = np.array(enc1)
-        b = np.array(enc2)
-        return float(np.linalg.norm(a - b))
+        locations = _detect_faces(img, max_side=max_side, upsample=0)
+        if not locations:
+            locations = _detect_faces(img, max_side=max_side, upsample=1)
+
+        locations = sorted(locations, key=_box_area, reverse=True)
+        if not all_faces:
+            locations = locations[:1]
+        return [face.encoding for face in _encode_faces(img, locations)]
 
-    # Fallback без numpy
-    return math.sqrt(sum((a - b) ** 2 for a, b in zip(enc1, enc2)))
+    except Exception:
+        return []
 
 
-def add_watermark_to_bytes(data: bytes, text: str = "photoeasy") -> bytes:
+class WatermarkStyle(NamedTuple):
     """
-    Создаёт копию изображения с водяным знаком «PHOTOEASY» сеткой по диагонали.
-    - Сжимает изображение по ширине до 1000 px, если оно больше.
-    - Область лица вырезается КРУГОМ из слоя с водяным знаком.
-    Возвращает bytes JPEG.
+    Оформление водяного знака (у каждого фотографа своё,
+    см. Photographer.watermark_style()).
     """
-    # 1. Загружаем и нормализуем изображение
-    img = _load_image_safely(data)
-    width, height = img.size
+    text: str = "PHOTOEASY"
+    alpha: int = 160  # прозрачность (0-255)
+    angle: int = 30   # градусов, по часовой
 
-    # 2. Сжатие до ширины 1000 px (если нужно)
-    max_width = 1000
-    if width > max_width:
-        ratio = max_width / float(width)
-        new_height = int(height * ratio)
-        img = img.resize((max_width, new_height), Image.LANCZOS)
-        width, height = img.size
 
-    # 3. Подготовка шрифта
-    draw_dummy = ImageDraw.Draw(img)
-    font = None
+DEFAULT_WATERMARK_STYLE = WatermarkStyle()
+
+# Готовые слои водяного знака. В сессии почти все фото одного размера,
+# так что построенный один раз слой переиспользуется для всех.
+_overlay_cache = LRUCache(getattr(settings, "WATERMARK_OVERLAY_CACHE_SIZE", 8))
+
+
+@lru_cache(maxsize=32)
+def _get_font(font_path: Optional[str], size: int):
+    """
+    Шрифт нужного размера, загруженный один раз на процесс.
+    """
     try:
-        font_path = getattr(settings, "WATERMARK_FONT_PATH", None)
-        if font_path:
-            font = ImageFont.truetype(
-                font_path,
-                size=int(min(width, height) * 0.06),  # размер от размеров фото
-            )
+        if font_path and size > 0:
+            return ImageFont.truetype(font_path, size=size)
     except Exception:
-        font = None
+        pass
+    return ImageFont.load_default()
 
-    if font is None:
-        font = ImageFont.load_default()
 
-    watermark_text = "PHOTOEASY"
+@lru_cache(maxsize=32)
+def _get_text_tile(font_path: Optional[str], size: int, text: str, alpha: int):
+    """
+    Надпись, один раз отрисованная на маленьком прозрачном тайле.
+    Возвращает (тайл, смещение (dx, dy) относительно точки text(), шаг сетки).
+    """
+    font = _get_font(font_path, size)
+    bbox = ImageDraw.Draw(Image.new("RGBA", (1, 1))).textbbox((0, 0), text, font=font)
+
+    # текст может «вылезать» левее/выше точки привязки – учитываем смещение
+    dx, dy = min(bbox[0], 0), min(bbox[1], 0)
+    tile = Image.new("RGBA", (max(bbox[2] - dx, 1), max(bbox[3] - dy, 1)), (0, 0, 0, 0))
+    ImageDraw.Draw(tile).text((-dx, -dy), text, font=font, fill=(255, 255, 255, alpha))
 
-    # Размер текста
-    bbox = draw_dummy.textbbox((0, 0), watermark_text, font=font)
     text_width = bbox[2] - bbox[0]
     text_height = bbox[3] - bbox[1]
+    step = (max(int(text_width * 3), 1), max(int(text_height * 3), 1))
+    return tile, (dx, dy), step
+
+
+def _build_watermark_overlay(
+    width: int,
+    height: int,
+    font_size: int,
+    text: str,
+    angle: int,
+    alpha: int,
+) -> Image.Image:
+    """
+    Строит прозрачный слой width×height с текстом сеткой по диагонали.
+    Надпись растеризуется один раз (_get_text_tile) и дальше только
+    копируется по сетке.
+    """
+    font_path = getattr(settings, "WATERMARK_FONT_PATH", None)
+    tile, (dx, dy), (step_x, step_y) = _get_text_tile(font_path, font_size, text, alpha)
 
-    # 4. Большой квадратный слой (чтобы при повороте не было дыр)
+    # Большой квадратный слой (чтобы при повороте не было дыр)
     diag = int(math.hypot(width, height))
     overlay_size = diag + max(width, height)
     overlay = Image.new("RGBA", (overlay_size, overlay_size), (0, 0, 0, 0))
-    overlay_draw = ImageDraw.Draw(overlay)
-
-    # Шаги по сетке
-    step_x = int(text_width * 3)
-    step_y = int(text_height * 3)
 
-    alpha = 160  # прозрачность (0-255)
-    fill = (255, 255, 255, alpha)
-
-    # 5. Заполняем текстом по всей площади overlay
+    # Заполняем надписью по всей площади overlay
     for y in range(0, overlay_size, step_y):
         for x in range(0, overlay_size, step_x):
-            overlay_draw.text((x, y), watermark_text, font=font, fill=fill)
+            overlay.paste(tile, (x + dx, y + dy))
 
-    # 6. Поворачиваем слой с текстом для диагонального эффекта
-    rotated = overlay.rotate(-30, expand=True)
+    # Поворачиваем слой с текстом для диагонального эффекта
+    rotated = overlay.rotate(-angle, expand=True)
     rw, rh = rotated.size
 
-    # Вырезаем центр под размер исходного изображения
+    # Вырезаем центр под размер изображения
     left = (rw - width) // 2
     top = (rh - height) // 2
-    rotated = rotated.crop((left, top, left + width, top + height))
+    return rotated.crop((left, top, left + width, top + height))
+
 
-    # 7. Находим лицо и вырезаем *круг* из слоя водяного знака
+def _get_watermark_overlay(
+    width: int,
+    height: int,
+    font_size: int,
+    text: str,
+    angle: int,
+    alpha: int,
+) -> Image.Image:
+    """
+    Слой водяного знака из кэша: сначала память (LRU), потом диск
+    (WATERMARK_CACHE_DIR, если задан), и только потом построение.
+    Возвращаемый слой общий – менять его можно только через copy().
+    """
+    key = (width, height, font_size, text, angle, alpha)
+
+    overlay = _overlay_cache.get(key)
+    if overlay is not None:
+        return overlay
+
+    cache_dir = getattr(settings, "WATERMARK_CACHE_DIR", None)
+    path = None
+    if cache_dir:
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        path = os.path.join(cache_dir, f"overlay_{digest}.png")
+        try:
+            with Image.open(path) as cached:
+                overlay = cached.convert("RGBA")
+        except (OSError, UnidentifiedImageError):
+            overlay = None
+
+    if overlay is None:
+        overlay = _build_watermark_overlay(width, height, font_size, text, angle, alpha)
+        if path:
+            # свой tmp-файл на запись: слой могут строить несколько потоков сразу
+            tmp_path = None
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    overlay.save(f, format="PNG")
+                os.replace(tmp_path, path)
+            except OSError:
+                if tmp_path and os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+
+    _overlay_cache.set(key, overlay)
+    return overlay
+
+
+def _render_watermark(
+    img: Image.Image,
+    face_locations: List[Tuple[int, int, int, int]],
+    style: WatermarkStyle = DEFAULT_WATERMARK_STYLE,
+    max_width: int = 1000,
+) -> Image.Image:
+    """
+    Рисует водяной знак (по умолчанию «PHOTOEASY») сеткой по диагонали
+    на уже декодированном изображении.
+    - Сжимает изображение по ширине до max_width px, если оно больше.
+    - Область лица (рамки в координатах исходного img) вырезается
+      КРУГОМ из слоя с водяным знаком.
+    Возвращает RGB-картинку (превью с водяным знаком).
+    """
+    width, height = img.size
+
+    # 1. Сжатие до ширины max_width px (если нужно)
+    scale = 1.0
+    if width > max_width:
+        scale = max_width / float(width)
+        new_height = int(height * scale)
+        img = img.resize((max_width, new_height), Image.LANCZOS)
+        width, height = img.size
+
+    # 2. Готовый слой с текстом – из кэша (тот же размер фото -> тот же слой)
+    overlay = _get_watermark_overlay(
+        width,
+        height,
+        font_size=int(min(width, height) * 0.06),  # размер от размеров фото
+        text=style.text,
+        angle=style.angle,
+        alpha=style.alpha,
+    )
+
+    # 3. Вырезаем *круг* на месте каждого лица.
+    # Рамки пришли в координатах исходника – переводим в координаты превью.
     face_boxes = []
-    try:
-        _ensure_face_libs_loaded()
-        arr = np.array(img, dtype=np.uint8)
-        arr = np.ascontiguousarray(arr)
-        locations = face_recognition.face_locations(
-            arr,
-            number_of_times_to_upsample=1,
-            model="hog",
-        )
-        for (top_f, right_f, bottom_f, left_f) in locations:
-            margin = int((bottom_f - top_f) * 0.25)
-            lx = max(left_f - margin, 0)
-            ty = max(top_f - margin, 0)
-            rx = min(right_f + margin, width)
-            by = min(bottom_f + margin, height)
-            face_boxes.append((lx, ty, rx, by))
-    except Exception:
-        face_boxes = []
+    for (top_f, right_f, bottom_f, left_f) in face_locations:
+        top_f, right_f = int(top_f * scale), int(right_f * scale)
+        bottom_f, left_f = int(bottom_f * scale), int(left_f * scale)
+        margin = int((bottom_f - top_f) * 0.25)
+        lx = max(left_f - margin, 0)
+        ty = max(top_f - margin, 0)
+        rx = min(right_f + margin, width)
+        by = min(bottom_f + margin, height)
+        face_boxes.append((lx, ty, rx, by))
 
     if face_boxes:
-        cut_draw = ImageDraw.Draw(rotated)
+        # слой из кэша общий – режем его копию
+        overlay = overlay.copy()
+        cut_draw = ImageDraw.Draw(overlay)
         for (lx, ty, rx, by) in face_boxes:
             # вместо прямоугольника — круг (эллипс в bounding box)
             cut_draw.ellipse((lx, ty, rx, by), fill=(0, 0, 0, 0))
 
-    # 8. Склеиваем исходное изображение и водяной знак
+    # 4. Склеиваем исходное изображение и водяной знак
     img_rgba = img.convert("RGBA")
-    watermarked = Image.alpha_composite(img_rgba, rotated)
+    watermarked = Image.alpha_composite(img_rgba, overlay)
+
+    return watermarked.convert("RGB")
+
 
-    # 9. Сохраняем в JPEG и возвращаем
+def _encode_image(img: Image.Image, fmt: str = "JPEG", quality: int = 90) -> bytes:
     buf = io.BytesIO()
-    watermarked.convert("RGB").save(buf, format="JPEG", quality=90)
+    img.save(buf, format=fmt, quality=quality)
     return buf.getvalue()
+
+
+class Rendition(NamedTuple):
+    """
+    Один вариант фото (превью, миниатюра, WebP...) – готовые байты.
+    """
+    name: str
+    format: str
+    width: int
+    height: int
+    data: bytes
+
+
+def _make_renditions(watermarked: Image.Image) -> List[Rendition]:
+    """
+    Дополнительные варианты из настроек PHOTO_RENDITIONS, например
+    [{"name": "thumb", "max_width": 320, "format": "JPEG", "quality": 80}].
+    Все строятся из уже готового превью с водяным знаком – без
+    повторного декодирования и повторной отрисовки знака.
+    """
+    result = []
+    for spec in getattr(settings, "PHOTO_RENDITIONS", []):
+        fmt = spec.get("format", "JPEG").upper()
+        if fmt == "WEBP" and not features.check("webp"):
+            continue
+
+        img = watermarked
+        max_width = spec.get("max_width")
+        if max_width and img.width > max_width:
+            new_height = max(int(img.height * max_width / float(img.width)), 1)
+            img = img.resize((max_width, new_height), Image.LANCZOS, reducing_gap=2.0)
+
+        result.append(Rendition(
+            name=spec["name"],
+            format=fmt,
+            width=img.width,
+            height=img.height,
+            data=_encode_image(img, fmt, spec.get("quality", 85)),
+        ))
+    return result
+
+
+class ProcessedPhoto(NamedTuple):
+    """
+    Результат обработки одной фотографии при загрузке.
+    """
+    faces: List[DetectedFace]  # все лица с encoding'ами
+    face_locations: List[Tuple[int, int, int, int]]
+    watermarked: Rendition  # основное превью 1000 px (SessionPhoto.watermarked_image)
+    renditions: List[Rendition]
+    width: int  # размер оригинала после EXIF-поворота
+    height: int
+    placeholder: str  # data:image/jpeg;base64,... – крошечное размытое превью
+
+
+def _make_placeholder(img: Image.Image, size: int = 16) -> str:
+    """
+    Крошечный JPEG (до size px по длинной стороне) как data URI –
+    клиент растягивает его с blur, пока грузится настоящее превью.
+    Несколько сотен байт, встраивается прямо в JSON галереи.
+    """
+    tiny = img.copy()
+    tiny.thumbnail((size, size), Image.BILINEAR, reducing_gap=2.0)
+    buf = io.BytesIO()
+    # optimize – свои таблицы Хаффмана, заметно короче стандартных
+    tiny.convert("RGB").save(buf, format="JPEG", quality=40, optimize=True)
+    return "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def _process_image(img: Image.Image, style: WatermarkStyle) -> ProcessedPhoto:
+    faces = []
+    locations = []
+    try:
+        locations = _detect_faces(img)
+        # все лица: на групповом фото ребёнок может быть и не первым
+        faces = _encode_faces(img, locations)
+    except Exception:
+        # сбой детектора не должен мешать водяному знаку
+        faces = []
+        locations = []
+
+    watermarked = _render_watermark(img, locations, style)
+
+    return ProcessedPhoto(
+        faces=faces,
+        face_locations=[tuple(loc) for loc in locations],
+        watermarked=Rendition(
+            name="preview",
+            format="JPEG",
+            width=watermarked.width,
+            height=watermarked.height,
+            data=_encode_image(watermarked),
+        ),
+        renditions=_make_renditions(watermarked),
+        width=img.width,
+        height=img.height,
+        # из уже уменьшенного превью – без лишней работы с полным кадром
+        placeholder=_make_placeholder(watermarked),
+    )
+
+
+def process_photo_file(
+    path: str,
+    style: WatermarkStyle = DEFAULT_WATERMARK_STYLE,
+) -> ProcessedPhoto:
+    """
+    Единый пайплайн загрузки фото:
+    JPEG декодируется (и поворачивается по EXIF) один раз,
+    HOG-детектор запускается один раз, и по тем же рамкам считаются
+    encoding'и ВСЕХ лиц для поиска и вырезы под лица в водяном знаке.
+    Из превью с водяным знаком тут же делаются варианты PHOTO_RENDITIONS.
+
+    - Если нет нужных библиотек -> FaceLibsMissing.
+    - Если файл не картинка -> UnidentifiedImageError.
+    - Если лиц не найдено -> faces=[], водяной знак всё равно есть.
+
+    Файл читается с диска по ходу декодирования. Удобно и для пула
+    процессов: в дочерний процесс передаётся только путь.
+
+    Память на одно фото (RGB, W×H пикселей, P = W·H·3 байт):
+    декодированное изображение P + уменьшенная копия для детектора
+    + превью под водяной знак. Полный кадр в numpy не переводится –
+    только вырезы вокруг лиц (см. _encode_faces). Сжатый JPEG
+    в памяти не держится.
+    """
+    _ensure_face_libs_loaded()
+    return _process_image(_load_image_safely(path), style)
+
+
+RENDER_VARIANTS = ("watermarked", "thumbnail", "face")
+
+
+def _face_crop(img: Image.Image, location: Tuple[int, int, int, int], size: int) -> Image.Image:
+    """
+    Квадратный вырез вокруг лица (с полями), приведённый к size×size.
+    """
+    top, right, bottom, left = location
+    side = int(max(bottom - top, right - left) * 1.8)
+    cx, cy = (left + right) // 2, (top + bottom) // 2
+
+    x0 = min(max(cx - side // 2, 0), max(img.width - side, 0))
+    y0 = min(max(cy - side // 2, 0), max(img.height - side, 0))
+    crop = img.crop((x0, y0, x0 + side, y0 + side))
+    return crop.resize((size, size), Image.LANCZOS)
+
+
+def _face_image(path: str, location: Tuple[int, int, int, int], size: int) -> Image.Image:
+    """
+    Вырез лица size×size по уже известной рамке (в пикселях оригинала),
+    без поиска лица. Оригинал декодируется уменьшенным (draft) ровно
+    настолько, чтобы вырез остался не меньше size.
+    """
+    top, right, bottom, left = location
+    side = max(bottom - top, right - left) * 1.8
+
+    with Image.open(path) as probe:
+        width, height = probe.size
+    scale = max(side / size, 1.0)
+    img = _load_image_safely(path, draft_size=(int(width / scale), int(height / scale)))
+
+    # во сколько раз декодированная картинка меньше оригинала
+    factor = max(width, height) / float(max(img.size))
+    location = tuple(int(v / factor) for v in location)
+    return _face_crop(img, location, size)
+
+
+def face_thumbnail(
+    path: str,
+    location: Tuple[int, int, int, int],
+    size: int = 160,
+    style: WatermarkStyle = DEFAULT_WATERMARK_STYLE,
+) -> bytes:
+    """
+    JPEG-вырез лица по уже известной рамке (см. _face_image). Водяной
+    знак и по лицу – вырез публичный, без знака это готовый портрет.
+    """
+    crop = _face_image(path, location, size)
+    return _encode_image(_render_watermark(crop, [], style, max_width=size), quality=85)
+
+
+def _load_scaled(path: str, size: int) -> Tuple[Image.Image, float]:
+    """
+    Картинка, декодированная уменьшенной (draft) под size, и во сколько
+    раз она меньше оригинала.
+    """
+    with Image.open(path) as probe:
+        original = max(probe.size)
+    img = _load_image_safely(path, draft_size=(size, size))
+    return img, original / float(max(img.size))
+
+
+def render_variant(
+    path: str,
+    variant: str,
+    size: int,
+    style: WatermarkStyle = DEFAULT_WATERMARK_STYLE,
+    face_locations: Optional[List[Tuple[int, int, int, int]]] = None,
+) -> bytes:
+    """
+    Рендер варианта фото «по запросу» (см. PhotoRenderView):
+
+    - watermarked – превью с водяным знаком шириной до size px;
+    - thumbnail   – квадрат size×size из центра, с водяным знаком;
+    - face        – квадратный вырез первого лица size×size, водяной знак
+                    и по лицу – иначе это готовый платный портрет
+                    (ValueError, если лица нет).
+
+    face_locations – рамки лиц в пикселях оригинала (PhotoFace), если фото
+    уже обработано; None – ищем лица сами (HOG).
+
+    Возвращает bytes JPEG.
+    """
+    if variant not in RENDER_VARIANTS:
+        raise ValueError(f"Неизвестный вариант: {variant}")
+
+    img = None
+    if face_locations is None:
+        _ensure_face_libs_loaded()
+        img, factor = _load_scaled(path, size)
+        try:
+            locations = _detect_faces(img)
+        except Exception:
+            locations = []
+        # дальше рамки – в пикселях оригинала, как у PhotoFace
+        face_locations = [tuple(int(v * factor) for v in loc) for loc in locations]
+
+    if variant == "face":
+        if not face_locations:
+            raise ValueError("Лицо не найдено")
+        return face_thumbnail(path, face_locations[0], size, style)
+
+    if img is None:
+        img, factor = _load_scaled(path, size)
+    locations = [tuple(int(v / factor) for v in loc) for loc in face_locations]
+
+    if variant == "thumbnail":
+        side = min(img.size)
+        x0 = (img.width - side) // 2
+        y0 = (img.height - side) // 2
+        img = img.crop((x0, y0, x0 + side, y0 + side))
+        locations = [
+            (top - y0, right - x0, bottom - y0, left - x0)
+            for (top, right, bottom, left) in locations
+        ]
+
+    watermarked = _render_watermark(img, locations, style, max_width=size)
+    return _encode_image(watermarked, quality=85)
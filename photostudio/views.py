@@ -1,16 +1,23 @@
+import base64
 import io
-from django.http import HttpResponse
+import os
+import hashlib
+import numpy as np
+from django.http import HttpResponse, FileResponse, StreamingHttpResponse
 from openpyxl import Workbook
 
-from datetime import timedelta
+from datetime import datetime, timedelta
 from django.contrib.auth.decorators import login_required
 
 from django.contrib.auth import authenticate, get_user_model
-from django.core.files.base import ContentFile
-from django.db import transaction
-from django.db.models import Sum, Count
+from django.core.files.storage import default_storage
+from django.db.models import Q, Sum, Count
 from django.db.models.functions import TruncDate
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header
 from django.shortcuts import get_object_or_404, render
 
 from rest_framework import generics, permissions, viewsets
@@ -22,7 +29,7 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.views import APIView
 
 from django.contrib.admin.views.decorators import staff_member_required
-from .models import Photographer, PhotoSession, SessionPhoto, PhotoOrder, Service
+from .models import Album, Photographer, PhotoSession, SessionPhoto, PhotoOrder, Service, PhotoJob, PhotoRendition
 from .serializers import (
     UserRegisterSerializer,
     PhotographerSerializer,
@@ -30,12 +37,34 @@ from .serializers import (
     SessionPhotoSerializer,
     PhotoOrderSerializer,
     SessionPhotoGallerySerializer,
-    ServiceSerializer
+    ServiceSerializer,
+    PhotoJobSerializer,
+    FaceClusterSerializer,
+    gallery_photos,
 )
+from .cache import DiskLRUCache
+from .clusters import search_clusters
+from .faceindex import (
+    FaceScope,
+    decode_cursor,
+    encode_cursor,
+    get_cached_result,
+    get_scope_index,
+    get_selfie_encodings,
+    merge_results,
+    rank_page,
+    selfie_hash,
+    session_index_version,
+    set_cached_result,
+)
+from .jobs import enqueue_upload
+from .zipstream import StoredZip, ZipEntry
+from .manifests import manifest_path, manifest_url, visible_photos, write_manifest
 from .utils import (
-    extract_face_encoding_from_file,
-    add_watermark_to_bytes,
-    face_distance,
+    RENDER_VARIANTS,
+    check_image_header,
+    extract_selfie_encodings,
+    render_variant,
 )
 
 User = get_user_model()
@@ -399,6 +428,14 @@ class SessionPhotoBulkUploadView(generics.GenericAPIView):
       images: file1
       images: file2
       ...
+
+    Сохраняет оригиналы и ставит их в очередь обработки.
+    Ответ 202:
+    {
+      "jobs": [{"job_id": ..., "photo_id": ..., "status": "PENDING", ...}],
+      "errors": [{"file": "IMG_1.jpg", "detail": "..."}]
+    }
+    Прогресс – GET /api/sessions/{session_id}/photos/status/
     """
     parser_classes = [MultiPartParser, FormParser]
     serializer_class = SessionPhotoSerializer
@@ -416,88 +453,357 @@ class SessionPhotoBulkUploadView(generics.GenericAPIView):
         if not files:
             return Response({"detail": "Не переданы файлы 'images'"}, status=400)
 
+        # каждый файл – своя короткая транзакция: ошибка в одном файле
+        # не откатывает остальные, а SQLite не блокируется на всю загрузку
         created = []
-        with transaction.atomic():
-            for f in files:
-                raw = f.read()
+        errors = []
+        for f in files:
+            try:
+                created.append(enqueue_upload(session, f))
+            except Exception as e:
+                errors.append({"file": f.name, "detail": str(e)})
 
-                # encoding для поиска по лицу
-                try:
-                    encoding = extract_face_encoding_from_file(ContentFile(raw, f.name))
-                except RuntimeError as e:
-                    return Response({"detail": str(e)}, status=500)
+        data = {
+            "jobs": PhotoJobSerializer(created, many=True).data,
+            "errors": errors,
+        }
+        return Response(data, status=202 if created else 400)
 
-                original_file = ContentFile(raw, name=f.name)
 
-                photo = SessionPhoto(
-                    session=session,
-                    original_image=original_file,
-                    face_encoding=encoding,
-                )
-                # внутри save() генерируется watermarked_image
-                photo.save()
-                created.append(photo)
+class SessionPhotoStatusView(APIView):
+    """
+    GET /api/sessions/{session_id}/photos/status/
+    GET /api/sessions/{session_id}/photos/status/?ids=1,2,3   (job_id)
 
-        data = SessionPhotoSerializer(created, many=True).data
-        return Response(data, status=201)
+    Прогресс обработки загруженных фото:
+    {
+      "total": 300, "pending": 120, "running": 1, "done": 178, "failed": 1,
+      "jobs": [{"job_id": ..., "photo_id": ..., "status": "...", ...}]
+    }
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, session_id):
+        session = get_object_or_404(
+            PhotoSession,
+            id=session_id,
+            photographer=request.user.photographer,
+        )
+
+        jobs = PhotoJob.objects.filter(photo__session=session)
+
+        ids = request.query_params.get("ids")
+        if ids:
+            try:
+                jobs = jobs.filter(id__in=[int(i) for i in ids.split(",") if i])
+            except ValueError:
+                return Response({"detail": "Параметр 'ids' – список чисел через запятую"}, status=400)
+
+        counts = {
+            row["status"]: row["count"]
+            for row in jobs.values("status").annotate(count=Count("id"))
+        }
+
+        return Response({
+            "total": sum(counts.values()),
+            "pending": counts.get(PhotoJob.STATUS_PENDING, 0),
+            "running": counts.get(PhotoJob.STATUS_RUNNING, 0),
+            "done": counts.get(PhotoJob.STATUS_DONE, 0),
+            "failed": counts.get(PhotoJob.STATUS_FAILED, 0),
+            "jobs": PhotoJobSerializer(jobs.order_by("id"), many=True).data,
+        })
 
 
 # ========== ПОИСК ПО ЛИЦУ (ДЛЯ КЛИЕНТА ПО КОНКРЕТНОЙ СЪЁМКЕ) ==========
 
 class FaceSearchView(APIView):
     """
-    POST /api/search-by-face/?view_code=ABCD1234
-
-    Тело: form-data c полем image (фото/селфи).
-    Поиск ведём ТОЛЬКО по сессии с этим view_code.
+    POST /api/search-by-face/?view_code=ABCD1234      – по одной сессии
+    POST /api/search-by-face/?album_code=EFGH5678     – по всем сессиям альбома
+    POST /api/search-by-face/?scope=photographer      – по всем сессиям
+                                                        текущего фотографа (нужен токен)
+
+    Тело: form-data c полем image (фото/селфи). Можно передать несколько
+    image (например, селфи каждого ребёнка), а с ?all_faces=1 – искать
+    по всем лицам на каждом фото, а не только по самому крупному.
+
+    Параметры выдачи (query):
+      threshold – максимальное расстояние (по умолчанию FACE_MATCH_THRESHOLD)
+      limit     – размер страницы (по умолчанию 50, не больше 200)
+      cursor    – next_cursor из предыдущего ответа
+
+    В сессии с готовыми кластерами селфи ещё сравнивается с центроидами
+    «людей» (clusters.search_clusters): если человек найден, к совпадениям
+    из индекса добавляются его фото – тоже не дальше threshold.
+
+    Ответ: {"matches": [...], "next_cursor": "..." | null, "total": N},
+    matches – от самых похожих к менее похожим. Если лиц-запросов
+    несколько, matches – объединение по всем, а в "queries" – первая
+    страница по каждому лицу отдельно:
+      [{"image": "kid1.jpg", "face": 0, "matches": [...], "total": N}, ...]
     """
     permission_classes = [AllowAny]
     parser_classes = [MultiPartParser, FormParser]
 
+    DEFAULT_LIMIT = 50
+    MAX_LIMIT = 200
+    MAX_IMAGES = 10
+
     def post(self, request):
-        file = request.FILES.get("image")
+        files = request.FILES.getlist("image")
+        all_faces = request.query_params.get("all_faces") in ("1", "true")
         view_code = request.query_params.get("view_code")
+        album_code = request.query_params.get("album_code")
 
-        if not file:
+        if not files:
             return Response({"detail": "Не передано поле 'image'"}, status=400)
+        if len(files) > self.MAX_IMAGES:
+            return Response({"detail": f"Не больше {self.MAX_IMAGES} фото за запрос"}, status=400)
+
+        try:
+            threshold = float(request.query_params.get("threshold", settings.FACE_MATCH_THRESHOLD))
+            limit = int(request.query_params.get("limit", self.DEFAULT_LIMIT))
+            cursor = request.query_params.get("cursor")
+            after = decode_cursor(cursor) if cursor else None
+        except ValueError:
+            return Response({"detail": "Некорректные threshold / limit / cursor"}, status=400)
+        if not 0 < threshold <= 1 or not 1 <= limit <= self.MAX_LIMIT:
+            return Response(
+                {"detail": f"threshold: (0, 1], limit: 1..{self.MAX_LIMIT}"},
+                status=400,
+            )
+
+        # Область поиска: сессия по view_code (публичный код для клиентов),
+        # альбом по его коду или все сессии фотографа
+        if view_code:
+            session = get_object_or_404(PhotoSession, view_code=view_code)
+            scope = FaceScope.for_session(session)
+            version = session_index_version(session)
+            # в результат входят и кластеры (см. ниже) – кэш по обеим версиям
+            result_version = f"{version}:{session.clusters_version}"
+        elif album_code:
+            album = get_object_or_404(Album, view_code=album_code)
+            scope = FaceScope("album", album.id)
+            version = result_version = scope.search_version()
+        elif request.query_params.get("scope") == "photographer":
+            if not hasattr(request.user, "photographer"):
+                return Response({"detail": "Поиск по всем сессиям доступен только фотографу"}, status=403)
+            scope = FaceScope("photographer", request.user.photographer.id)
+            version = result_version = scope.search_version()
+        else:
+            return Response(
+                {"detail": "Передайте 'view_code', 'album_code' или scope=photographer"},
+                status=400,
+            )
+
+        # слишком большой файл отсекаем до чтения, по пикселям – по заголовку
+        for file in files:
+            if file.size > settings.SELFIE_MAX_UPLOAD_BYTES:
+                return Response({"detail": f"{file.name}: слишком большой файл"}, status=413)
+            try:
+                check_image_header(file, max_pixels=settings.SELFIE_MAX_PIXELS)
+            except ValueError as e:
+                return Response({"detail": f"{file.name}: {e}"}, status=400)
+
+        # лица-запросы: (имя файла, номер лица, ключ кэша, encoding)
+        queries = []
+        for file in files:
+            data = file.read()
+            digest = selfie_hash(data)
+            encodings = get_selfie_encodings(
+                digest,
+                lambda: extract_selfie_encodings(data, all_faces),
+                all_faces,
+            )
+            mode = "all" if all_faces else "one"
+            for i, encoding in enumerate(encodings):
+                queries.append((file.name, i, f"{digest}:{mode}:{i}", encoding))
+
+        if not queries:
+            return Response({"detail": "Лицо не найдено на фото"}, status=400)
+
+        # тот же селфи по той же версии индекса – совпадения из кэша,
+        # остальные лица – одним пакетом (одна матрица расстояний Q×N)
+        found = [get_cached_result(scope, result_version, key, threshold) for _, _, key, _ in queries]
+        missing = [i for i, result in enumerate(found) if result is None]
+
+        if missing:
+            encodings = [queries[i][3] for i in missing]
+            index = get_scope_index(scope, version)
+            results = index.search_many(encodings, threshold)
+            # в сессии к совпадениям из индекса добавляем лица найденного
+            # «человека» (не дальше того же threshold)
+            people = (
+                search_clusters(session, encodings, threshold)
+                if view_code else [None] * len(missing)
+            )
+            for i, result, person in zip(missing, results, people):
+                if person is not None:
+                    result = merge_results([result, person])
+                found[i] = result
+                set_cached_result(scope, result_version, queries[i][2], threshold, result)
+
+        photo_ids, distances = found[0] if len(found) == 1 else merge_results(found)
+        page_ids, page_distances, has_more = rank_page(photo_ids, distances, limit, after)
+
+        pages = [(page_ids, page_distances)]
+        if len(found) > 1:
+            pages += [rank_page(ids, dist, limit)[:2] for ids, dist in found]
+
+        # объекты и URL – только для отдаваемых страниц
+        photos = SessionPhoto.objects.select_related("session").in_bulk(
+            np.unique(np.concatenate([ids for ids, _ in pages])).tolist()
+        )
+
+        next_cursor = None
+        if has_more:
+            next_cursor = encode_cursor(page_distances[-1], page_ids[-1])
+
+        response = {
+            "matches": self._matches(photos, page_ids, page_distances),
+            "next_cursor": next_cursor,
+            "total": len(photo_ids),
+        }
+        if len(found) > 1:
+            response["queries"] = [
+                {
+                    "image": name,
+                    "face": face,
+                    "matches": self._matches(photos, ids, dist),
+                    "total": len(result[0]),
+                }
+                for (name, face, _, _), (ids, dist), result in zip(queries, pages[1:], found)
+            ]
+        return Response(response)
+
+    @staticmethod
+    def _matches(photos, photo_ids, distances):
+        matches = []
+        for photo_id, distance in zip(photo_ids.tolist(), distances.tolist()):
+            p = photos.get(photo_id)
+            if p is None:
+                continue
+            matches.append({
+                "photo_id": p.id,
+                "image_url": (
+                    p.watermarked_image.url
+                    if p.watermarked_image
+                    else p.original_image.url
+                ),
+                "session_id": p.session_id,
+                "client_name": p.session.client_name,
+                "distance": distance,
+            })
+        return matches
+
+
+# ========== ВАРИАНТЫ ФОТО ПО ЗАПРОСУ ==========
+
+render_cache = DiskLRUCache(
+    getattr(settings, "RENDITION_CACHE_DIR", "cache/renditions"),
+    getattr(settings, "RENDITION_CACHE_MAX_BYTES", 512 * 1024 * 1024),
+)
+
+
+class PhotoRenderView(APIView):
+    """
+    GET /api/photos/{photo_id}/render/?view_code=ABCD1234&variant=thumbnail&size=320
+
+    variant: watermarked (по умолчанию) | thumbnail | face
+    size:    одно из RENDITION_SIZES (face – не больше FACE_RENDER_MAX_SIZE)
+
+    Рендерится при первом запросе и кладётся в дисковый LRU-кэш
+    (RENDITION_CACHE_DIR, не больше RENDITION_CACHE_MAX_BYTES).
+    Лица берутся из PhotoFace, HOG – только для ещё не обработанных фото.
+    Ответ с ETag, на If-None-Match отвечаем 304. Last-Modified не отдаём:
+    картинка меняется и вместе с оформлением водяного знака, а время
+    загрузки фото об этом не знает.
+    """
+    permission_classes = [AllowAny]
+
+    # меняется вместе с самим рендером – старые файлы кэша не подхватятся
+    RENDER_VERSION = 2
+
+    def get(self, request, photo_id):
+        view_code = request.query_params.get("view_code")
+        variant = request.query_params.get("variant", "watermarked")
 
         if not view_code:
             return Response({"detail": "Не передан параметр 'view_code'"}, status=400)
 
-        # Находим сессию по view_code (это публичный код для клиентов)
-        session = get_object_or_404(PhotoSession, view_code=view_code)
-
-        data = file.read()
-        encoding = extract_face_encoding_from_file(ContentFile(data, name=file.name))
-        if encoding is None:
-            return Response({"detail": "Лицо не найдено на фото"}, status=400)
+        if variant not in RENDER_VARIANTS:
+            return Response(
+                {"detail": f"variant: одно из {', '.join(RENDER_VARIANTS)}"},
+                status=400,
+            )
+
+        sizes = getattr(settings, "RENDITION_SIZES", [320, 1000])
+        try:
+            size = int(request.query_params.get("size", sizes[-1]))
+        except ValueError:
+            size = None
+        if size not in sizes:
+            return Response(
+                {"detail": f"size: одно из {', '.join(map(str, sizes))}"},
+                status=400,
+            )
+        face_max = getattr(settings, "FACE_RENDER_MAX_SIZE", 320)
+        if variant == "face" and size > face_max:
+            return Response({"detail": f"size: для face не больше {face_max}"}, status=400)
+
+        photo = get_object_or_404(
+            SessionPhoto.objects.select_related("session__photographer"),
+            id=photo_id,
+            session__view_code=view_code,
+        )
+        style = photo.session.photographer.watermark_style()
 
-        # Берём только фото из этой сессии
-        photos = SessionPhoto.objects.filter(session=session)
-        matches = []
-        THRESHOLD = 0.45  # можно подкрутить
+        # ключ меняется вместе с исходником и оформлением водяного знака
+        source = photo.sha256 or photo.original_image.name
+        key = hashlib.sha256(
+            f"{photo.id}:{source}:{variant}:{size}:{tuple(style)}:{self.RENDER_VERSION}".encode("utf-8")
+        ).hexdigest()
+        etag = f'"{key[:32]}"'
 
-        for p in photos:
-            if not p.face_encoding:
-                continue
+        response = get_conditional_response(request, etag=etag)
 
-            enc2 = list(map(float, p.face_encoding))
+        if response is None:
+            path = render_cache.get(f"{key}.jpg")
+            if path is not None:
+                try:
+                    response = FileResponse(open(path, "rb"), content_type="image/jpeg")
+                except FileNotFoundError:
+                    # успел вытесниться другим процессом – отрендерим заново
+                    response = None
 
-            dist = face_distance(encoding, enc2)
-            if dist <= THRESHOLD:
-                matches.append({
-                    "photo_id": p.id,
-                    "image_url": (
-                        p.watermarked_image.url
-                        if p.watermarked_image
-                        else p.original_image.url
-                    ),
-                    "session_id": p.session_id,
-                    "client_name": p.session.client_name,
-                    "distance": float(dist),
-                })
+        if response is None:
+            try:
+                data = render_variant(
+                    photo.original_image.path, variant, size, style, self._face_locations(photo)
+                )
+            except RuntimeError as e:
+                return Response({"detail": str(e)}, status=500)
+            except ValueError as e:
+                return Response({"detail": str(e)}, status=404)
+            render_cache.set(f"{key}.jpg", data)
+            response = HttpResponse(data, content_type="image/jpeg")
+
+        response["ETag"] = etag
+        response["Cache-Control"] = "public, max-age=86400"
+        return response
 
-        return Response({"matches": matches})
+    @staticmethod
+    def _face_locations(photo):
+        """
+        Рамки лиц, найденные воркером (в пикселях оригинала), или None,
+        если фото ещё не обработано / рамки не сохранены (старые лица).
+        """
+        if not photo.watermarked_image:
+            return None
+        boxes = list(photo.faces.values_list("top", "right", "bottom", "left"))
+        if any(None in box for box in boxes):
+            return None
+        return boxes
 
 
 # ========== ЗАКАЗЫ (после оплаты клиентом) ==========
@@ -535,25 +841,245 @@ class PhotoOrderCreateView(generics.CreateAPIView):
         serializer.save(photographer=photographer, session=session)
 
 
+# ========== СКАЧИВАНИЕ ОРИГИНАЛОВ (ZIP) ==========
+
+def _parse_range(header, size):
+    """
+    "bytes=100-199" / "bytes=100-" / "bytes=-500" -> (start, end), end не
+    включается. None – заголовка нет или он нам не подходит (несколько
+    диапазонов и т.п.): тогда отдаём файл целиком, это разрешено.
+    ValueError – диапазон за пределами архива (416).
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if not first:
+            start, end = max(size - int(last), 0), size
+        else:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+    if start >= size or start >= end:
+        raise ValueError(header)
+    return start, end
+
+
+class SessionDownloadView(APIView):
+    """
+    GET /api/download/?download_code=XXXX[&order=15]
+
+    ZIP с оригиналами сессии (или только с фото заказа order). download_code
+    клиент получает от фотографа – в публичных ответах (галерея, манифест)
+    его нет.
+    Архив без сжатия собирается на лету: файлы читаются кусками
+    (ZIP_CHUNK_SIZE), поэтому память не зависит от размера сессии.
+    Размер известен заранее, поддерживаются Range / If-Range – прерванную
+    загрузку можно докачать.
+
+    Долгая отдача держит поток gunicorn, а не весь процесс – см. gthread
+    в entrypoint.sh.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        download_code = request.query_params.get("download_code")
+        if not download_code:
+            return Response({"detail": "Не передан параметр 'download_code'"}, status=400)
+
+        session = get_object_or_404(PhotoSession, download_code=download_code)
+        photos = SessionPhoto.objects.filter(session=session)
+
+        order_id = request.query_params.get("order")
+        if order_id:
+            if not order_id.isdigit():
+                return Response({"detail": "order: ожидается id заказа"}, status=400)
+            order = get_object_or_404(PhotoOrder, id=order_id, session=session)
+            photos = photos.filter(orders=order)
+
+        # CRC32 старых фото досчитывает воркер (jobs.fill_missing_crc32),
+        # в запросе читать всю сессию с диска не будем. Фото без файла
+        # воркер пропускает (CRC у них так и останется пустым), в архив
+        # они тоже не попадут – ждать их незачем.
+        pending = photos.filter(crc32__isnull=True).only("id", "original_image")
+        if any(os.path.exists(photo.original_image.path) for photo in pending):
+            response = Response(
+                {"detail": "Архив ещё готовится, попробуйте через минуту"},
+                status=503,
+            )
+            response["Retry-After"] = "60"
+            return response
+
+        photos = (
+            photos
+            .only("id", "original_image", "crc32", "uploaded_at")
+            .order_by("uploaded_at", "id")
+        )
+        archive = StoredZip(
+            self._entries(photos),
+            chunk_size=getattr(settings, "ZIP_CHUNK_SIZE", 1024 * 1024),
+        )
+
+        start, end = 0, archive.size
+        status = 200
+        if request.headers.get("If-Range") in (None, archive.etag):
+            try:
+                requested = _parse_range(request.headers.get("Range"), archive.size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{archive.size}"
+                return response
+            if requested is not None:
+                start, end = requested
+                status = 206
+
+        response = StreamingHttpResponse(
+            archive.iter_range(start, end),
+            status=status,
+            content_type="application/zip",
+        )
+        response["Content-Length"] = str(end - start)
+        if status == 206:
+            response["Content-Range"] = f"bytes {start}-{end - 1}/{archive.size}"
+        response["Accept-Ranges"] = "bytes"
+        response["ETag"] = archive.etag
+        response["Content-Disposition"] = content_disposition_header(
+            True, f"{session.client_name or 'photos'}_{session.id}.zip"
+        )
+        # nginx не должен складывать гигабайты во временный файл
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    @staticmethod
+    def _entries(photos):
+        entries = []
+        names = set()
+        for photo in photos:
+            path = photo.original_image.path
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                # оригинал пропал с диска – архив без него
+                continue
+
+            name = os.path.basename(photo.original_image.name)
+            if name in names:
+                name = f"{photo.id}_{name}"
+            names.add(name)
+            entries.append(ZipEntry(
+                name, path, size, photo.crc32, timezone.localtime(photo.uploaded_at)
+            ))
+        return entries
+
+
 # ========== СПИСОК ФОТО ДЛЯ КЛИЕНТА ПО view_code ==========
 
-class SessionPhotoListView(generics.ListAPIView):
+class SessionContentCacheMixin:
+    """
+    Кэш ответов GET ?view_code=... по версии содержимого сессии
+    (PhotoSession.content_version).
+
+    Ключ – версия + полный URL + формат ответа, поэтому ничего не нужно
+    чистить: после изменений версия другая, и старые записи просто
+    вытесняются. ETag сильный, на If-None-Match отвечаем 304, не трогая
+    ни кэш, ни сериализацию; в кэше ("default") – уже готовые байты.
+    """
+    cache_name = None
+
+    def get(self, request, *args, **kwargs):
+        self._cache_key = None
+        view_code = request.query_params.get("view_code")
+        version = None
+        if view_code:
+            version = (
+                PhotoSession.objects
+                .filter(view_code=view_code)
+                .values_list("content_version", flat=True)
+                .first()
+            )
+        if version is None:
+            # нет кода / нет сессии – обычный ответ (в т.ч. 404)
+            return super().get(request, *args, **kwargs)
+
+        key = hashlib.sha256(
+            f"{self.cache_name}|{version}|{request.accepted_renderer.format}|"
+            f"{request.build_absolute_uri()}".encode()
+        ).hexdigest()
+        self._etag = f'"{key[:32]}"'
+
+        response = get_conditional_response(request, etag=self._etag)
+        if response is not None:
+            # 304 обязан повторить валидатор (RFC 9110, 15.4.5)
+            response["ETag"] = self._etag
+            return response
+
+        cached = cache.get(f"response:{key}")
+        if cached is not None:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            response["ETag"] = self._etag
+            return response
+
+        self._cache_key = f"response:{key}"
+        return super().get(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        key = getattr(self, "_cache_key", None)
+        if key and isinstance(response, Response) and response.status_code == 200:
+            response["ETag"] = self._etag
+            response.add_post_render_callback(
+                lambda r: cache.set(key, (r.content, r["Content-Type"]))
+            )
+        return response
+
+
+class PeopleListView(generics.ListAPIView):
+    """
+    GET /api/people/?view_code=ABCD1234
+
+    «Люди на фотосессии»: вырез лица и число фото по каждому человеку.
+    Клиент выбирает себя / своего ребёнка без загрузки селфи,
+    а его фото берёт из /api/photos/?view_code=...&person=<id>.
+    """
+    serializer_class = FaceClusterSerializer
+    permission_classes = [AllowAny]
+
+    def get_queryset(self):
+        session = get_object_or_404(
+            PhotoSession,
+            view_code=self.request.query_params.get("view_code", ""),
+        )
+        return session.clusters.all()
+
+
+class SessionPhotoListView(SessionContentCacheMixin, generics.ListAPIView):
     """
     GET /api/photos/?view_code=ABCD1234
+    GET /api/photos/?view_code=ABCD1234&person=<id>  – только фото этого человека
+
+    Постранично, по (uploaded_at, id): limit (по умолчанию 100, не больше 500)
+    и cursor – next_cursor из предыдущего ответа.
 
     Возвращает:
     {
       "session": {
           "id": ...,
           "client_name": "...",
-          "view_code": "...",
-          "download_code": "..."
+          "view_code": "..."
       },
-      "photos": [ ... ]
+      "photos": [ ... ],
+      "next_cursor": "..." | null,
+      "manifest_url": "https://.../photos/manifests/ABCD1234.json" | null
     }
     """
     serializer_class = SessionPhotoGallerySerializer
     permission_classes = [AllowAny]
+    cache_name = "photos"
+
+    DEFAULT_LIMIT = 100
+    MAX_LIMIT = 500
 
     def get_queryset(self):
         view_code = self.request.query_params.get("view_code")
@@ -567,34 +1093,116 @@ class SessionPhotoListView(generics.ListAPIView):
         session = get_object_or_404(PhotoSession, view_code=view_code)
         self.session = session
 
-        return (
-            SessionPhoto.objects
-            .filter(session=session)
-            .select_related("session")
-            .order_by("uploaded_at")
-        )
+        # пока воркер не наложил водяной знак – фото клиенту не показываем
+        queryset = visible_photos(session)
+
+        person = self.request.query_params.get("person")
+        if person:
+            if not person.isdigit():
+                return SessionPhoto.objects.none()
+            queryset = queryset.filter(faces__cluster_id=person).distinct()
+
+        return queryset
+
+    @staticmethod
+    def _encode_cursor(uploaded_at, photo_id) -> str:
+        raw = f"{uploaded_at.isoformat()}|{photo_id}".encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+            uploaded_at, photo_id = raw.split("|")
+            return datetime.fromisoformat(uploaded_at), int(photo_id)
+        except (ValueError, UnicodeDecodeError):
+            raise ValueError("Некорректный cursor")
 
     def list(self, request, *args, **kwargs):
-        # стандартный список фоток
-        response = super().list(request, *args, **kwargs)
-
-        # если сессия найдена – оборачиваем ответ
-        if getattr(self, "session", None):
-            return Response({
-                "session": {
-                    "id": self.session.id,
-                    "client_name": self.session.client_name,
-                    "view_code": self.session.view_code,
-                    "download_code": self.session.download_code,
-                },
-                "photos": response.data,
-            })
+        queryset = self.get_queryset()
+
+        # если кода нет – пустой список
+        if self.session is None:
+            return Response([])
+
+        try:
+            limit = int(request.query_params.get("limit", self.DEFAULT_LIMIT))
+            cursor = request.query_params.get("cursor")
+            after = self._decode_cursor(cursor) if cursor else None
+        except ValueError:
+            return Response({"detail": "Некорректные limit / cursor"}, status=400)
+        if not 1 <= limit <= self.MAX_LIMIT:
+            return Response({"detail": f"limit: 1..{self.MAX_LIMIT}"}, status=400)
+
+        # keyset: строго после последнего отданного фото – без OFFSET,
+        # любая страница стоит одинаково (индекс session, uploaded_at, id)
+        if after is not None:
+            uploaded_at, photo_id = after
+            queryset = queryset.filter(
+                Q(uploaded_at__gt=uploaded_at) | Q(uploaded_at=uploaded_at, id__gt=photo_id)
+            )
+
+        rows = list(
+            queryset.values(
+                "id", "uploaded_at", "original_image", "watermarked_image",
+                "width", "height", "placeholder",
+            )[:limit + 1]
+        )
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self._encode_cursor(rows[-1]["uploaded_at"], rows[-1]["id"])
+
+        renditions = (
+            PhotoRendition.objects
+            .filter(photo_id__in=[row["id"] for row in rows])
+            .order_by("width", "name")
+            .values("photo_id", "name", "format", "width", "height", "image")
+        )
 
-        # если кода нет – вернётся обычный пустой список
-        return response
+        return Response({
+            "session": {
+                "id": self.session.id,
+                "client_name": self.session.client_name,
+                "view_code": self.session.view_code,
+            },
+            "photos": gallery_photos(
+                rows,
+                renditions,
+                request.build_absolute_uri(default_storage.url("")),
+                self.session.client_name,
+            ),
+            "next_cursor": next_cursor,
+            # вся галерея одним статическим файлом (отдаёт nginx)
+            "manifest_url": (
+                request.build_absolute_uri(manifest_url(self.session))
+                if os.path.exists(manifest_path(self.session))
+                else None
+            ),
+        })
+
+
+class SessionManifestView(APIView):
+    """
+    GET /api/photos/manifest/?view_code=ABCD1234
+
+    Манифест галереи (см. manifests.py) файлом – если клиент не может
+    взять его по manifest_url напрямую у nginx. Нет файла – строим.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        session = get_object_or_404(
+            PhotoSession,
+            view_code=request.query_params.get("view_code", ""),
+        )
+        path = manifest_path(session)
+        if not os.path.exists(path):
+            write_manifest(session)
+        return FileResponse(open(path, "rb"), content_type="application/json")
 
 
-class ServiceListView(generics.ListAPIView):
+class ServiceListView(SessionContentCacheMixin, generics.ListAPIView):
     """
     GET /api/services/?view_code=ABCD1234
 
@@ -604,6 +1212,7 @@ class ServiceListView(generics.ListAPIView):
     """
     serializer_class = ServiceSerializer
     permission_classes = [AllowAny]
+    cache_name = "services"
 
     def get_queryset(self):
         view_code = self.request.query_params.get("view_code")
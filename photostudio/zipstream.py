@@ -0,0 +1,213 @@
+"""
+ZIP без сжатия (STORE), который отдаётся потоком.
+
+JPEG дальше не сжимается, поэтому файлы идут в архив как есть, а все
+заголовки строятся заранее по размерам и CRC32 файлов. Отсюда:
+
+- точный размер архива известен до первого байта (Content-Length);
+- любой диапазон байт можно собрать заново – работает докачка (Range);
+- в памяти только заголовки и один кусок файла (chunk_size).
+
+Архив больше 4 ГБ (или с файлами / смещениями за 4 ГБ) пишется в ZIP64.
+"""
+import bisect
+import hashlib
+import struct
+import zlib
+from datetime import datetime
+from typing import Iterator, List, NamedTuple
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_VERSION = 20
+ZIP64_VERSION = 45
+FLAG_UTF8 = 0x0800  # имена файлов в UTF-8
+UNIX_FILE_MODE = 0o100644 << 16
+
+
+class ZipEntry(NamedTuple):
+    name: str  # путь внутри архива
+    path: str  # файл на диске
+    size: int
+    crc32: int
+    modified: datetime
+
+
+def file_crc32(path, chunk_size: int = 1024 * 1024) -> int:
+    """
+    CRC32 файла, читается кусками.
+    """
+    crc = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return crc
+            crc = zlib.crc32(chunk, crc)
+
+
+def _dos_datetime(dt: datetime):
+    if dt.year < 1980:
+        return 0, (1 << 5) | 1  # 1980-01-01 – раньше формат не умеет
+    time = (dt.hour << 11) | (dt.minute << 5) | (dt.second // 2)
+    date = ((dt.year - 1980) << 9) | (dt.month << 5) | dt.day
+    return time, date
+
+
+def _zip64_extra(*values) -> bytes:
+    if not values:
+        return b""
+    return struct.pack(f"<HH{len(values)}Q", 0x0001, 8 * len(values), *values)
+
+
+class StoredZip:
+    """
+    Раскладка архива: последовательность частей (заголовки – bytes,
+    данные – ZipEntry), у каждой известно смещение в архиве.
+
+        archive = StoredZip(entries)
+        archive.size                       # Content-Length
+        archive.iter_range(start, end)     # байты [start, end)
+    """
+
+    def __init__(self, entries: List[ZipEntry], chunk_size: int = 1024 * 1024):
+        self.chunk_size = chunk_size
+        self._offsets = []
+        self._parts = []
+
+        central = []
+        for entry in entries:
+            header_offset = self._tail()
+            name = entry.name.encode("utf-8")
+            time, date = _dos_datetime(entry.modified)
+            big = entry.size >= ZIP64_LIMIT
+            size32 = ZIP64_LIMIT if big else entry.size
+
+            extra = _zip64_extra(entry.size, entry.size) if big else b""
+            self._add(struct.pack(
+                "<IHHHHHIIIHH",
+                0x04034B50,
+                ZIP64_VERSION if big else ZIP_VERSION,
+                FLAG_UTF8,
+                0,  # STORE
+                time,
+                date,
+                entry.crc32,
+                size32,
+                size32,
+                len(name),
+                len(extra),
+            ) + name + extra)
+            self._add(entry)
+
+            # в центральном каталоге в ZIP64-поле – только то, что не влезло
+            values = [entry.size, entry.size] if big else []
+            if header_offset >= ZIP64_LIMIT:
+                values.append(header_offset)
+            extra = _zip64_extra(*values)
+            version = ZIP64_VERSION if values else ZIP_VERSION
+            central.append(struct.pack(
+                "<IHHHHHHIIIHHHHHII",
+                0x02014B50,
+                (3 << 8) | version,  # создан в Unix
+                version,
+                FLAG_UTF8,
+                0,
+                time,
+                date,
+                entry.crc32,
+                size32,
+                size32,
+                len(name),
+                len(extra),
+                0,
+                0,
+                0,
+                UNIX_FILE_MODE,
+                min(header_offset, ZIP64_LIMIT),
+            ) + name + extra)
+
+        directory = b"".join(central)
+        directory_offset = self._tail()
+        count = len(entries)
+
+        end = b""
+        if count >= 0xFFFF or directory_offset >= ZIP64_LIMIT or len(directory) >= ZIP64_LIMIT:
+            zip64_end_offset = directory_offset + len(directory)
+            end += struct.pack(
+                "<IQHHIIQQQQ",
+                0x06064B50,
+                44,  # размер записи без первых 12 байт
+                (3 << 8) | ZIP64_VERSION,
+                ZIP64_VERSION,
+                0,
+                0,
+                count,
+                count,
+                len(directory),
+                directory_offset,
+            )
+            end += struct.pack("<IIQI", 0x07064B50, 0, zip64_end_offset, 1)
+        end += struct.pack(
+            "<IHHHHIIH",
+            0x06054B50,
+            0,
+            0,
+            min(count, 0xFFFF),
+            min(count, 0xFFFF),
+            min(len(directory), ZIP64_LIMIT),
+            min(directory_offset, ZIP64_LIMIT),
+            0,
+        )
+        self._add(directory + end)
+        self.size = self._tail()
+
+        digest = hashlib.sha1()
+        for entry in entries:
+            digest.update(f"{entry.name}\0{entry.size}\0{entry.crc32}\0".encode("utf-8"))
+        # одинаковый состав -> тот же ETag, If-Range при докачке сработает
+        self.etag = f'"{digest.hexdigest()}"'
+
+    def _tail(self) -> int:
+        if not self._parts:
+            return 0
+        return self._offsets[-1] + self._length(self._parts[-1])
+
+    @staticmethod
+    def _length(part) -> int:
+        return part.size if isinstance(part, ZipEntry) else len(part)
+
+    def _add(self, part) -> None:
+        self._offsets.append(self._tail())
+        self._parts.append(part)
+
+    def iter_range(self, start: int = 0, end: int = None) -> Iterator[bytes]:
+        """
+        Байты архива [start, end). Файлы читаются кусками по chunk_size.
+        """
+        if end is None:
+            end = self.size
+
+        i = max(bisect.bisect_right(self._offsets, start) - 1, 0)
+        position = start
+        while position < end and i < len(self._parts):
+            part, offset = self._parts[i], self._offsets[i]
+            skip = position - offset
+            take = min(self._length(part) - skip, end - position)
+
+            if isinstance(part, ZipEntry):
+                with open(part.path, "rb") as f:
+                    f.seek(skip)
+                    left = take
+                    while left:
+                        chunk = f.read(min(self.chunk_size, left))
+                        if not chunk:
+                            # файл укоротился после расчёта раскладки –
+                            # архив уже не собрать, обрываем ответ
+                            raise IOError(f"{part.path}: файл изменился во время отдачи")
+                        left -= len(chunk)
+                        yield chunk
+            else:
+                yield part[skip:skip + take]
+
+            position += take
+            i += 1